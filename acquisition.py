@@ -0,0 +1,545 @@
+"""
+Dedicated acquisition process for the OpenHSI web controller.
+
+The camera is owned by this process, which writes captured lines straight into
+a `multiprocessing.shared_memory` datacube. Web workers attach to the same
+segments to read frames zero-copy and drive the camera through a small control
+channel (a `multiprocessing.connection` socket), so the web tier never touches
+the camera. Captures no longer share a GIL with request handling and renders,
+and a restart of the web server leaves a running capture alone.
+
+Serving the web tier from several worker processes is out of scope: the
+log, capture history, background jobs and telemetry still live in the web
+process, and would have to move here or into a shared store first.
+
+Run it alongside the web server:
+
+    python acquisition.py --json-path settings.json --cal-path calibration.nc
+
+and start the web tier with OPENHSI_ACQUISITION_ADDRESS pointing at the socket.
+"""
+import argparse
+import os
+import threading
+import time
+from multiprocessing import resource_tracker
+from multiprocessing.connection import Client, Listener
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+from openhsi.data import DataCube, DateTimeBuffer
+
+from cubes import truncated, wrap_buffer
+
+DEFAULT_ADDRESS = "/tmp/openhsi-acquisition.sock"
+DEFAULT_AUTHKEY = os.environ.get("OPENHSI_ACQUISITION_AUTHKEY", "openhsi").encode()
+DEFAULT_PREFIX = "openhsi-acq"
+
+# Layout of the int64 status header shared with every web worker.
+HEADER_FIELDS = [
+    "generation",
+    "state",
+    "current",
+    "total",
+    "start_ns",
+    "end_ns",
+    "processed",
+    "processing_ns",
+    "queue_depth",
+    "overruns",
+    # Cancel and pause: lines the last capture stored, and where they start in each buffer.
+    "paused",
+    "captured",
+    "line_start",
+    "ts_start",
+    "temp_start",
+]
+STATE_IDLE, STATE_CAPTURING, STATE_FINISHED, STATE_ERROR, STATE_PROCESSING = range(5)
+
+
+def _attach(name):
+    """Attach to an existing shared memory segment without taking ownership.
+
+    The resource tracker would otherwise unlink the segment when this process
+    exits, pulling it out from under the acquisition process.
+    """
+    shm = SharedMemory(name=name)
+    try:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+    return shm
+
+
+def _header_view(shm):
+    return np.ndarray((len(HEADER_FIELDS),), dtype=np.int64, buffer=shm.buf)
+
+
+class _Segment:
+    """Base object of arrays in a shared memory segment; holds the SharedMemory open.
+
+    numpy keeps no buffer export on shm.buf, so an array built on it straight
+    away outlives a close() of the segment and crashes the process when read.
+    Arrays (and views of them) built on a _Segment keep it, and so the
+    mapping, alive; the SharedMemory closes itself once the last one is gone.
+    """
+
+    def __init__(self, shm, array):
+        self.shm = shm
+        self.__array_interface__ = array.__array_interface__
+
+
+def _shared_array(shm, shape, dtype, offset=0):
+    """An array over `shm` that keeps the segment mapped for as long as it is referenced."""
+    return np.asarray(_Segment(shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)))
+
+
+class AcquisitionServer:
+    """Owns the camera and publishes its datacube through shared memory."""
+
+    def __init__(self, cam, address=DEFAULT_ADDRESS, authkey=DEFAULT_AUTHKEY, prefix=DEFAULT_PREFIX):
+        self.cam = cam
+        self.address = address
+        self.authkey = authkey
+        self.prefix = prefix
+        self.cam_lock = threading.Lock()
+        self.capture_thread = None
+        self.cube_shm = None
+        self.last_error = None
+
+        self.header_shm = SharedMemory(
+            name=f"{prefix}-header", create=True, size=8 * len(HEADER_FIELDS)
+        )
+        self.header = _header_view(self.header_shm)
+        self.header[:] = 0
+        self._publish_buffers()
+
+    def _set(self, field, value):
+        self.header[HEADER_FIELDS.index(field)] = value
+
+    def _get(self, field):
+        return int(self.header[HEADER_FIELDS.index(field)])
+
+    def _publish_buffers(self):
+        """Move the camera's datacube, timestamp and temperature buffers into a new shared segment."""
+        cam = self.cam
+        generation = self._get("generation") + 1
+        cube = cam.dc.data
+        cube_nbytes = cube.nbytes
+        ts_offset = cube_nbytes
+        temp_offset = ts_offset + cam.timestamps.data.nbytes
+        temps = getattr(cam, "cam_temperatures", None)
+        size = temp_offset + (temps.data.nbytes if temps is not None else 0)
+
+        shm = SharedMemory(name=f"{self.prefix}-cube-{os.getpid()}-{generation}", create=True, size=size)
+        shared_cube = _shared_array(shm, cube.shape, cube.dtype)
+        shared_cube[:] = cube
+        cam.dc.data = shared_cube
+        shared_ts = _shared_array(shm, cam.timestamps.data.shape, cam.timestamps.data.dtype, ts_offset)
+        shared_ts[:] = cam.timestamps.data
+        cam.timestamps.data = shared_ts
+        if temps is not None:
+            shared_temps = _shared_array(shm, temps.data.shape, temps.data.dtype, temp_offset)
+            shared_temps[:] = temps.data
+            temps.data = shared_temps
+        cam.nc = None
+
+        old_shm, self.cube_shm = self.cube_shm, shm
+        self.layout = {
+            "generation": generation,
+            "shm_name": shm.name,
+            "dc_shape": cube.shape,
+            "dtype": cube.dtype.str,
+            "ts_offset": ts_offset,
+            "temp_offset": temp_offset if temps is not None else None,
+        }
+        self._set("generation", generation)
+        self._set("state", STATE_IDLE)
+        self._set("current", 0)
+        self._set("total", cam.n_lines)
+        if old_shm is not None:
+            # Only the name goes: arrays of the old generation, here and in the web
+            # tier, keep their mappings until the last of them is dropped.
+            old_shm.unlink()
+
+    def _progress(self, progress_info):
+        if progress_info.get("phase") == "processing":
+            if self._get("state") != STATE_PROCESSING:
+                self._set("processing_ns", time.time_ns())
+                self._set("state", STATE_PROCESSING)
+            self._set("processed", progress_info.get("n", 0))
+            return
+        self._set("current", progress_info.get("n", 0))
+        self._set("total", progress_info.get("total", 0))
+        self._set("queue_depth", progress_info.get("queue_depth", 0))
+        self._set("overruns", progress_info.get("overruns", 0))
+
+    def _run_capture(self):
+        self._set("start_ns", time.time_ns())
+        self._set("end_ns", 0)
+        self._set("current", 0)
+        self._set("processed", 0)
+        self._set("processing_ns", 0)
+        self._set("queue_depth", 0)
+        self._set("overruns", 0)
+        self._set("paused", 0)
+        self._set("captured", 0)
+        self._set("state", STATE_CAPTURING)
+        try:
+            with self.cam_lock:
+                try:
+                    self.cam.collect(progress_callback=self._progress)
+                finally:
+                    line_start, ts_start, temp_start = self.cam.capture_starts
+                    self._set("line_start", line_start)
+                    self._set("ts_start", ts_start)
+                    self._set("temp_start", -1 if temp_start is None else temp_start)
+                    self._set("captured", self.cam.lines_captured)
+                    self._set("paused", 0)
+                self.cam.nc = None
+            self._set("current", self.cam.lines_captured)
+            self._set("state", STATE_FINISHED)
+        except Exception as e:
+            self.last_error = str(e)
+            self._set("state", STATE_ERROR)
+        finally:
+            self._set("end_ns", time.time_ns())
+
+    # Control channel commands ------------------------------------------------
+    def cmd_describe(self):
+        cam = self.cam
+        return dict(
+            self.layout,
+            settings=dict(cam.settings),
+            n_lines=cam.n_lines,
+            proc_lvl=cam.proc_lvl,
+            binned_wavelengths=getattr(cam, "binned_wavelengths", None),
+            last_error=self.last_error,
+        )
+
+    def cmd_capture(self):
+        if self.capture_thread is not None and self.capture_thread.is_alive():
+            return {"started": False}
+        self.last_error = None
+        self.capture_thread = threading.Thread(target=self._run_capture, daemon=True)
+        self.capture_thread.start()
+        return {"started": True}
+
+    def _capture_running(self):
+        return self.capture_thread is not None and self.capture_thread.is_alive()
+
+    def cmd_cancel(self):
+        if not self._capture_running():
+            return {"ok": False}
+        self.cam.request_cancel()
+        return {"ok": True}
+
+    def cmd_pause(self):
+        if not self._capture_running():
+            return {"ok": False}
+        self.cam.request_pause()
+        self._set("paused", 1)
+        return {"ok": True}
+
+    def cmd_resume(self):
+        if not self._capture_running():
+            return {"ok": False}
+        self.cam.request_resume()
+        self._set("paused", 0)
+        return {"ok": True}
+
+    def cmd_set_exposure(self, exposure_ms):
+        with self.cam_lock:
+            self.cam.set_exposure(exposure_ms)
+        return {"exposure_ms": self.cam.settings.get("exposure_ms")}
+
+    def cmd_reinitialise(self, **kwargs):
+        with self.cam_lock:
+            self.cam.reinitialise(**kwargs)
+            self._publish_buffers()
+        return self.cmd_describe()
+
+    def cmd_apply_settings(self, **requested):
+        with self.cam_lock:
+            result = self.cam.apply_settings(**requested)
+            if result["reinitialised"]:
+                self._publish_buffers()
+        return result
+
+    def cmd_acquire_reference(self, kind, n_frames=None):
+        if self.capture_thread is not None and self.capture_thread.is_alive():
+            raise RuntimeError("Capture in progress")
+        with self.cam_lock:
+            return self.cam.acquire_reference(kind, n_frames)
+
+    def cmd_preview(self, n_lines=None, binning=None, n_bands=None):
+        if self.capture_thread is not None and self.capture_thread.is_alive():
+            raise RuntimeError("Capture in progress")
+        with self.cam_lock:
+            return self.cam.preview(n_lines, binning, n_bands)
+
+    def cmd_clear_reference(self, kind):
+        with self.cam_lock:
+            return self.cam.clear_reference(kind)
+
+    def cmd_reference_status(self):
+        return self.cam.reference_status()
+
+    def cmd_sample_temperature(self):
+        # Never queue behind a capture or burst; they already record the temperature.
+        if not self.cam_lock.acquire(blocking=False):
+            return self.cam.recorded_temperature()
+        try:
+            return self.cam.sample_temperature()
+        finally:
+            self.cam_lock.release()
+
+    def _handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    cmd, kwargs = conn.recv()
+                except EOFError:
+                    break
+                try:
+                    result = getattr(self, f"cmd_{cmd}")(**kwargs)
+                    conn.send(("ok", result))
+                except Exception as e:
+                    conn.send(("error", f"{type(e).__name__}: {e}"))
+
+    def serve_forever(self):
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+        with Listener(self.address, authkey=self.authkey) as listener:
+            while True:
+                conn = listener.accept()
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def close(self):
+        # The camera's buffers still map the cube segment, which closes with them.
+        for shm in (self.cube_shm, self.header_shm):
+            if shm is not None:
+                shm.unlink()
+
+
+class AcquisitionClient:
+    """Camera stand-in used by web workers; reads the shared datacube zero-copy.
+
+    Exposes the subset of the openhsiCamera interface used by server.py.
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, authkey=DEFAULT_AUTHKEY, prefix=DEFAULT_PREFIX):
+        self.address = address
+        self.authkey = authkey
+        self.prefix = prefix
+        self._header_shm = None
+        self._view = None
+        self._lock = threading.Lock()
+
+    def _call(self, cmd, **kwargs):
+        with Client(self.address, authkey=self.authkey) as conn:
+            conn.send((cmd, kwargs))
+            status, result = conn.recv()
+        if status == "error":
+            raise RuntimeError(result)
+        return result
+
+    @property
+    def header(self):
+        if self._header_shm is None:
+            self._header_shm = _attach(f"{self.prefix}-header")
+        return dict(zip(HEADER_FIELDS, _header_view(self._header_shm).tolist()))
+
+    def describe(self):
+        return self._call("describe")
+
+    @property
+    def settings(self):
+        return self.describe()["settings"]
+
+    @property
+    def n_lines(self):
+        return self.header["total"]
+
+    @property
+    def lines_captured(self):
+        """Lines stored by the last capture; fewer than n_lines if it was cancelled."""
+        return self.header["captured"]
+
+    def status(self):
+        """Capture status in the same shape as the /api/status response."""
+        header = self.header
+        elapsed_ns = (header["end_ns"] or time.time_ns()) - header["start_ns"]
+        elapsed = elapsed_ns / 1e9 if header["start_ns"] else 0
+        current, total = header["current"], header["total"]
+        state = header["state"]
+        status = {
+            "capturing": state in (STATE_CAPTURING, STATE_PROCESSING),
+            "finished": state == STATE_FINISHED,
+            "phase": "paused"
+            if state == STATE_CAPTURING and header["paused"]
+            else {STATE_CAPTURING: "capturing", STATE_PROCESSING: "processing"}.get(state),
+            "progress": {
+                "current": current,
+                "total": total,
+                "elapsed": elapsed,
+                "rate": current / elapsed if elapsed else 0,
+                "percentage": (current / total) * 100 if total else 0,
+                "queue_depth": header["queue_depth"],
+                "overruns": header["overruns"],
+            },
+            "processing": {},
+        }
+        if header["processing_ns"]:
+            processed = header["processed"]
+            elapsed = ((header["end_ns"] or time.time_ns()) - header["processing_ns"]) / 1e9
+            status["progress"]["elapsed"] = (header["processing_ns"] - header["start_ns"]) / 1e9
+            status["progress"]["rate"] = current / status["progress"]["elapsed"] if current else 0
+            status["processing"] = {
+                "current": processed,
+                "total": total,
+                "elapsed": elapsed,
+                "rate": processed / elapsed if elapsed else 0,
+                "percentage": (processed / total) * 100 if total else 0,
+            }
+        return status
+
+    def start_capture(self):
+        return self._call("capture")["started"]
+
+    def collect(self, progress_callback=None, poll_interval=0.1):
+        """Start a capture in the acquisition process and wait for it to finish."""
+        self.start_capture()
+        while True:
+            header = self.header
+            if progress_callback:
+                progress_callback({"n": header["current"], "total": header["total"]})
+                if header["state"] == STATE_PROCESSING:
+                    progress_callback({"phase": "processing", "n": header["processed"], "total": header["total"]})
+            if header["state"] in (STATE_FINISHED, STATE_ERROR):
+                break
+            time.sleep(poll_interval)
+        if header["state"] == STATE_ERROR:
+            raise RuntimeError(self.describe()["last_error"])
+
+    def request_cancel(self):
+        return self._call("cancel")["ok"]
+
+    def request_pause(self):
+        return self._call("pause")["ok"]
+
+    def request_resume(self):
+        return self._call("resume")["ok"]
+
+    def truncated_cube(self):
+        """The lines of the last capture if it was cancelled early, else None; see CaptureMixin.truncated_cube."""
+        header = self.header
+        if header["state"] != STATE_FINISHED or header["captured"] >= self.view().n_lines:
+            return None
+        temp_start = None if header["temp_start"] < 0 else header["temp_start"]
+        return truncated(self.view(), header["captured"], header["line_start"], header["ts_start"], temp_start)
+
+    def set_exposure(self, exposure_ms):
+        self._call("set_exposure", exposure_ms=exposure_ms)
+
+    def reinitialise(self, **kwargs):
+        self._call("reinitialise", **kwargs)
+
+    def apply_settings(self, **requested):
+        return self._call("apply_settings", **requested)
+
+    def acquire_reference(self, kind, n_frames=None):
+        return self._call("acquire_reference", kind=kind, n_frames=n_frames)
+
+    def clear_reference(self, kind):
+        return self._call("clear_reference", kind=kind)
+
+    def preview(self, n_lines=None, binning=None, n_bands=None):
+        return self._call("preview", n_lines=n_lines, binning=binning, n_bands=n_bands)
+
+    def reference_status(self):
+        return self._call("reference_status")
+
+    def sample_temperature(self):
+        return self._call("sample_temperature")
+
+    def view(self):
+        """Return a DataCube backed by the shared segment of the current generation."""
+        with self._lock:
+            generation = self.header["generation"]
+            if self._view is not None and self._view.generation == generation:
+                return self._view
+            info = self.describe()
+            shm = _attach(info["shm_name"])
+            dtype = np.dtype(info["dtype"])
+            n_lines = info["dc_shape"][1]
+
+            view = DataCube.__new__(DataCube)
+            view.generation = info["generation"]
+            view.settings = info["settings"]
+            view.n_lines = n_lines
+            view.proc_lvl = info["proc_lvl"]
+            view.dc_shape = info["dc_shape"]
+            # Each array holds the segment open, so cubes and views handed out
+            # earlier stay readable after a later generation replaces this one.
+            view.dc = wrap_buffer(_shared_array(shm, info["dc_shape"], dtype))
+            view.timestamps = DateTimeBuffer(n_lines)
+            view.timestamps.data = _shared_array(shm, (n_lines,), "datetime64[ns]", info["ts_offset"])
+            view.timestamps.count = n_lines
+            if info["temp_offset"] is not None:
+                view.cam_temperatures = wrap_buffer(_shared_array(shm, (n_lines,), np.float32, info["temp_offset"]))
+            if info["binned_wavelengths"] is not None:
+                view.binned_wavelengths = info["binned_wavelengths"]
+            view.nc = None
+
+            self._view = view
+            return view
+
+    def show(self, **kwargs):
+        return self.view().show(**kwargs)
+
+    def save(self, save_dir, **kwargs):
+        view = self.view()
+        result = view.save(save_dir=save_dir, **kwargs)
+        self.directory = view.directory
+        self.timestamps = view.timestamps
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenHSI acquisition process")
+    parser.add_argument("--json-path", required=True, help="Camera settings file")
+    parser.add_argument("--cal-path", required=True, help="Camera calibration file")
+    parser.add_argument("--n-lines", type=int, default=512)
+    parser.add_argument("--exposure-ms", type=float, default=10)
+    parser.add_argument("--processing-lvl", type=int, default=-1)
+    parser.add_argument(
+        "--backend",
+        default=os.environ.get("OPENHSI_CAMERA_BACKEND", "flir"),
+        help="Camera backend (flir, lucid, ximea or simulated)",
+    )
+    parser.add_argument("--address", default=os.environ.get("OPENHSI_ACQUISITION_ADDRESS", DEFAULT_ADDRESS))
+    parser.add_argument("--prefix", default=DEFAULT_PREFIX, help="Shared memory name prefix")
+    args = parser.parse_args()
+
+    from camera import get_camera_class
+
+    cam = get_camera_class(args.backend)(
+        n_lines=args.n_lines,
+        exposure_ms=args.exposure_ms,
+        processing_lvl=args.processing_lvl,
+        json_path=args.json_path,
+        cal_path=args.cal_path,
+    )
+    server = AcquisitionServer(cam, address=args.address, prefix=args.prefix)
+    print(f"Acquisition process listening on {args.address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""
+ASGI entry point for the web controller.
+
+    uvicorn asgi:app --host 127.0.0.1 --port 5000
+
+Serves the endpoints that hold connections open from an event loop instead
+of one thread per connection:
+
+- /api/status and /api/cameras/<id>/status, plus /api/status/stream, which
+  pushes status changes as server-sent events
+- /api/logs (with the same ETag/304 handling as the Flask route)
+- /api/show and /api/cameras/<id>/show; the request awaits the shared render
+  on server.render_pool without holding a thread
+- /api/view/<path> and /api/download/<path>, streamed in chunks with range
+  support, so slow clients only cost a socket
+- /api/cube and /api/cameras/<id>/cube, the in-memory datacube streamed in
+  chunks of lines (see cube_stream.py)
+
+Calls that reach into a camera run on `camera_executor`, a small thread pool
+of their own, so they never block the event loop or wait behind file
+transfers. Every other route is the unchanged Flask app, mounted as WSGI.
+
+Run a single worker; several are not supported. The camera is opened once
+per process, and the log, capture history, jobs and telemetry are kept in
+process memory, even when the camera is owned by a separate acquisition
+process (see acquisition.py).
+"""
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.http import parse_etags, quote_etag
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:  # uvicorn ships a basic one
+    from uvicorn.middleware.wsgi import WSGIMiddleware
+
+import server
+from compression import ASGICompression
+from history import UnknownCapture
+from render_pool import Saturated
+
+# Seconds between status checks on /api/status/stream.
+STATUS_STREAM_INTERVAL_S = 0.25
+# Comment lines keep idle event streams from being closed by proxies.
+STATUS_STREAM_KEEPALIVE_S = 15
+# Binary and streamed routes, left alone by ASGICompression.
+UNCOMPRESSED_ROUTES = r"/api/(cameras/[^/]+/)?(show|cube|status/stream)$|/api/(view|download)/"
+
+server.start()
+camera_executor = ThreadPoolExecutor(max_workers=max(2, len(server.registry)), thread_name_prefix="openhsi-camera")
+
+
+async def run_camera_call(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(camera_executor, fn, *args)
+
+
+def camera_entry(request):
+    """The camera named in the path, or the default camera for the /api/... routes."""
+    cam_id = request.path_params.get("cam_id")
+    if cam_id is None:
+        return server.registry.default
+    return server.registry.get(cam_id)
+
+
+def unknown_camera(request):
+    return JSONResponse({"message": f"Unknown camera '{request.path_params['cam_id']}'"}, status_code=404)
+
+
+async def status(request):
+    entry = camera_entry(request)
+    if entry is None:
+        return unknown_camera(request)
+    if "cam_id" not in request.path_params:
+        return JSONResponse(await run_camera_call(server.get_capture_status))
+    # line_rate reads the cube, a shared-memory attach (and RPC) for remote cameras.
+    return JSONResponse(await run_camera_call(camera_status, entry))
+
+
+def camera_status(entry):
+    return dict(entry.status(), line_rate_hz=entry.line_rate())
+
+
+async def status_stream(request):
+    """Server-sent events with the capture status, sent whenever it changes."""
+    entry = camera_entry(request)
+    if entry is None:
+        return unknown_camera(request)
+
+    async def events():
+        last, idle = None, 0.0
+        while True:
+            body = json.dumps(entry.status())
+            if body != last:
+                yield f"data: {body}\n\n"
+                last, idle = body, 0.0
+            elif idle >= STATUS_STREAM_KEEPALIVE_S:
+                yield ": keepalive\n\n"
+                idle = 0.0
+            await asyncio.sleep(STATUS_STREAM_INTERVAL_S)
+            idle += STATUS_STREAM_INTERVAL_S
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def logs(request):
+    with server.log_lock:
+        tag = f"logs-{server.log_version}"
+        etag = {"ETag": quote_etag(tag, weak=True), "Cache-Control": "no-cache"}
+        if parse_etags(request.headers.get("if-none-match")).contains_weak(tag):
+            return Response(status_code=304, headers=etag)
+        body = {"status": "success", "logs": list(server.log_messages)}
+    return JSONResponse(body, headers=etag)
+
+
+async def show(request):
+    entry = camera_entry(request)
+    if entry is None:
+        return unknown_camera(request)
+    try:
+        # Finding the cube to render reads the camera's status and buffers.
+        future = await run_camera_call(server.submit_show, entry, request.query_params)
+        if future is None:
+            return Response(status_code=204)
+        # shield: other requests may be waiting on the same render.
+        png = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), server.RENDER_TIMEOUT_S)
+    except UnknownCapture as e:
+        return JSONResponse({"message": str(e)}, status_code=404)
+    except (Saturated, asyncio.TimeoutError):
+        return JSONResponse(
+            {"status": "error", "error": "Renderer busy, try again shortly"},
+            status_code=503,
+            headers={"Retry-After": str(server.RENDER_RETRY_AFTER_S)},
+        )
+    except Exception as e:
+        server.app.logger.error(f"Error generating image: {e}")
+        return Response(status_code=204)
+    return Response(png, media_type="image/png")
+
+
+async def cube(request):
+    entry = camera_entry(request)
+    if entry is None:
+        return unknown_camera(request)
+    try:
+        opened = await run_camera_call(server.open_cube_stream, entry, request.query_params)
+    except UnknownCapture as e:
+        return JSONResponse({"message": str(e)}, status_code=404)
+    except ValueError as e:
+        return JSONResponse({"status": "error", "error": str(e)}, status_code=400)
+    if opened is None:
+        return Response(status_code=204)
+    chunks, headers = opened
+    # A plain generator: starlette copies each chunk out on its thread pool.
+    return StreamingResponse(chunks, headers=headers)
+
+
+def data_file(filename):
+    """Absolute path of `filename` in the data directory, or None if it escapes it."""
+    data_dir = os.path.abspath(server.DATA_DIR)
+    full_path = os.path.abspath(os.path.join(data_dir, filename))
+    if not full_path.startswith(data_dir):
+        return None
+    return full_path
+
+
+def file_route(attachment):
+    async def send(request):
+        full_path = data_file(request.path_params["filename"])
+        if full_path is None:
+            return Response(status_code=403)
+        if not os.path.isfile(full_path):
+            return Response(status_code=404)
+        return FileResponse(
+            full_path,
+            filename=os.path.basename(full_path),
+            content_disposition_type="attachment" if attachment else "inline",
+        )
+
+    return send
+
+
+@asynccontextmanager
+async def lifespan(app):
+    server.add_log_message("Server started", "success")
+    yield
+    camera_executor.shutdown(wait=False)
+
+
+app = Starlette(
+    routes=[
+        Route("/api/status", status),
+        Route("/api/status/stream", status_stream),
+        Route("/api/logs", logs, methods=["GET"]),
+        Route("/api/show", show),
+        Route("/api/view/{filename:path}", file_route(attachment=False)),
+        Route("/api/download/{filename:path}", file_route(attachment=True)),
+        Route("/api/cameras/{cam_id}/status", status),
+        Route("/api/cameras/{cam_id}/status/stream", status_stream),
+        Route("/api/cameras/{cam_id}/show", show),
+        Route("/api/cube", cube),
+        Route("/api/cameras/{cam_id}/cube", cube),
+        # Everything else, including DELETE /api/logs, is served by Flask.
+        Mount("/", app=WSGIMiddleware(server.app)),
+    ],
+    # JSON from the routes above is compressed and tagged like the Flask app's (see compression.py).
+    middleware=[Middleware(ASGICompression, exclude=UNCOMPRESSED_ROUTES)],
+    lifespan=lifespan,
+)
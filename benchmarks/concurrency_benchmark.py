@@ -0,0 +1,192 @@
+"""
+Connection capacity of the threaded Flask server versus the ASGI entry point.
+
+Starts the controller with the simulated camera in each serving mode and holds
+N slow connections open against it: downloads whose client stops reading after
+the first bytes, like a laptop on poor field Wi-Fi. While they are held it
+measures /api/status latency from a separate client, and the threads and
+resident memory of the server process:
+
+    python benchmarks/concurrency_benchmark.py --output concurrency_results.json
+    python benchmarks/concurrency_benchmark.py --quick   # fewer connections
+"""
+import argparse
+import datetime
+import http.client
+import json
+import os
+import platform
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from run_benchmarks import summarise  # noqa: E402
+
+MODES = {
+    "flask-threaded": lambda port: [
+        sys.executable,
+        "-c",
+        f"import server; server.start(); server.app.run(host='127.0.0.1', port={port}, debug=False, threaded=True)",
+    ],
+    "asgi": lambda port: [sys.executable, "-m", "uvicorn", "asgi:app", "--port", str(port), "--log-level", "warning"],
+}
+# Large enough that a stalled client leaves the server blocked in the middle of sending it.
+DOWNLOAD_BYTES = 64 * 2**20
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(mode, port, env):
+    proc = subprocess.Popen(MODES[mode](port), cwd=REPO_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        try:
+            get(port, "/api/status", timeout=1)
+            return proc
+        except OSError:
+            if proc.poll() is not None:
+                raise RuntimeError(f"{mode} server exited with {proc.returncode}")
+            time.sleep(0.5)
+    proc.kill()
+    raise RuntimeError(f"{mode} server did not start")
+
+
+def get(port, path, timeout=10):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    try:
+        conn.request("GET", path)
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    finally:
+        conn.close()
+
+
+def hold_connections(port, n, path):
+    """Open `n` downloads and stop reading each after the first chunk."""
+    held = []
+    for _ in range(n):
+        s = socket.socket()
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        s.settimeout(10)
+        try:
+            s.connect(("127.0.0.1", port))
+            s.sendall(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+            s.recv(1024)
+        except OSError:
+            s.close()
+            continue
+        held.append(s)
+    return held
+
+
+def process_stats(pid):
+    stats = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key == "Threads":
+                stats["threads"] = int(value)
+            elif key == "VmRSS":
+                stats["rss_mb"] = int(value.split()[0]) / 1024
+    return stats
+
+
+def bench_status(port, n_requests, concurrency):
+    def worker(_):
+        t0 = time.perf_counter()
+        try:
+            ok = get(port, "/api/status", timeout=5) == 200
+        except OSError:
+            ok = False
+        return ok, time.perf_counter() - t0
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(worker, range(n_requests)))
+    latencies = [elapsed for ok, elapsed in results if ok]
+    summary = summarise(latencies) if latencies else {"n": 0}
+    summary["errors"] = sum(1 for ok, _ in results if not ok)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", default="concurrency_results.json", help="Where to write the JSON results")
+    parser.add_argument("--quick", action="store_true", help="Hold fewer connections for a fast smoke run")
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=list(MODES))
+    args = parser.parse_args()
+
+    levels = [0, 50] if args.quick else [0, 100, 400, 1000]
+    # Every held connection is a file descriptor here and in the server.
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, max(soft, 4 * max(levels) + 256)), hard))
+
+    data_dir = tempfile.mkdtemp(prefix="openhsi-bench-")
+    with open(os.path.join(data_dir, "big.bin"), "wb") as f:
+        f.write(np.random.default_rng(0).bytes(DOWNLOAD_BYTES))
+    env = dict(
+        os.environ,
+        OPENHSI_CAMERA_BACKEND="simulated",
+        OPENHSI_DATA_DIR=data_dir,
+        OPENHSI_REFERENCE_DIR=os.path.join(data_dir, ".references"),
+    )
+    env.pop("OPENHSI_ACQUISITION_ADDRESS", None)
+
+    results = {}
+    try:
+        for mode in args.modes:
+            port = free_port()
+            print(f"{mode} ...")
+            proc = start_server(mode, port, env)
+            results[mode] = {}
+            try:
+                for n in levels:
+                    held = hold_connections(port, n, "/api/download/big.bin")
+                    time.sleep(1)  # let the server settle into its blocked sends
+                    status = bench_status(port, n_requests=100 if args.quick else 400, concurrency=8)
+                    results[mode][str(n)] = dict(
+                        process_stats(proc.pid), held_connections=len(held), status=status
+                    )
+                    print(f"  {len(held)} held: {json.dumps(results[mode][str(n)])}")
+                    for s in held:
+                        s.close()
+                    time.sleep(1)
+            finally:
+                proc.terminate()
+                proc.wait(timeout=30)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    report = {
+        "schema": 1,
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "host": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+        },
+        "config": {"quick": args.quick, "held_connections": levels, "download_bytes": DOWNLOAD_BYTES},
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+End-to-end benchmarks for the OpenHSI web controller using the synthetic camera.
+
+Measures capture throughput and the latency/throughput of the main HTTP endpoints
+against a real threaded HTTP server, and writes the results as JSON so they can
+be compared between commits:
+
+    python benchmarks/run_benchmarks.py --output bench_results.json
+    python benchmarks/run_benchmarks.py --quick   # smaller sizes for a smoke run
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+
+def summarise(samples):
+    """Latency summary in milliseconds."""
+    ms = np.asarray(samples) * 1e3
+    return {
+        "n": int(ms.size),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+
+def make_camera(n_lines, processing_lvl=-1):
+    from camera import ASSETS_DIR, get_camera_class
+
+    return get_camera_class("simulated")(
+        n_lines=n_lines,
+        exposure_ms=10,
+        processing_lvl=processing_lvl,
+        json_path=os.path.join(ASSETS_DIR, "cam_settings.json"),
+        cal_path=os.path.join(ASSETS_DIR, "cam_calibration.nc"),
+        line_rate_hz=0,
+        frame_pool=64,
+    )
+
+
+def bench_collect(n_lines, levels, repeats):
+    """Lines per second through openhsiCamera.collect for each processing level."""
+    results = {}
+    for lvl in levels:
+        cam = make_camera(n_lines, lvl)
+        cam.start_cam()  # precompute the frame pool outside the timed region
+        rates = []
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            cam.collect(progress_callback=lambda info: None)
+            rates.append(n_lines / (time.perf_counter() - t0))
+        results[str(lvl)] = {
+            "n_lines": n_lines,
+            "lines_per_s_mean": float(np.mean(rates)),
+            "lines_per_s_max": float(np.max(rates)),
+        }
+    return results
+
+
+class ServerThread:
+    """Serve the Flask app on an ephemeral port in a background thread."""
+
+    def __init__(self, app):
+        from werkzeug.serving import make_server
+
+        self.httpd = make_server("127.0.0.1", 0, app, threaded=True)
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_port}"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+
+    def request(self, path, method="GET", payload=None):
+        data = json.dumps(payload).encode() if payload is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method)
+        if data is not None:
+            req.add_header("Content-Type", "application/json")
+        t0 = time.perf_counter()
+        with urllib.request.urlopen(req) as resp:
+            body = resp.read()
+            status = resp.status
+        return time.perf_counter() - t0, status, body
+
+
+def wait_for_capture(srv, timeout=600):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        _, _, body = srv.request("/api/status")
+        status = json.loads(body)
+        if status["finished"] and not status["capturing"]:
+            return
+        time.sleep(0.05)
+    raise TimeoutError("capture did not finish")
+
+
+def bench_show(srv, repeats):
+    samples = []
+    for _ in range(repeats):
+        dt, status, body = srv.request("/api/show")
+        if status != 200:
+            raise RuntimeError(f"/api/show returned {status}")
+        samples.append(dt)
+    return dict(summarise(samples), png_bytes=len(body))
+
+
+def bench_save(srv, save_dir, repeats):
+    samples, nbytes = [], 0
+    for _ in range(repeats):
+        dt, _, body = srv.request("/api/save", "POST", {"save_dir": save_dir})
+        samples.append(dt)
+        nbytes = os.path.getsize(json.loads(body)["filepath"])
+    total = sum(samples)
+    return dict(
+        summarise(samples),
+        file_bytes=nbytes,
+        saves_per_s=repeats / total,
+        mb_per_s=nbytes * repeats / total / 2**20,
+    )
+
+
+def bench_file_list(srv, data_dir, n_files, repeats):
+    folder = f"filelist_{n_files}"
+    target = os.path.join(data_dir, folder)
+    os.makedirs(target, exist_ok=True)
+    for i in range(n_files):
+        open(os.path.join(target, f"capture_{i:06d}.nc"), "wb").close()
+    samples = [srv.request(f"/api/file_list?folder={folder}")[0] for _ in range(repeats)]
+    return dict(summarise(samples), n_files=n_files)
+
+
+def bench_status(srv, concurrency_levels, requests_per_worker):
+    results = {}
+    for concurrency in concurrency_levels:
+        def worker(_):
+            return [srv.request("/api/status")[0] for _ in range(requests_per_worker)]
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            samples = [s for batch in pool.map(worker, range(concurrency)) for s in batch]
+        elapsed = time.perf_counter() - t0
+        results[str(concurrency)] = dict(summarise(samples), requests_per_s=len(samples) / elapsed)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", default="bench_results.json", help="Where to write the JSON results")
+    parser.add_argument("--quick", action="store_true", help="Use small sizes for a fast smoke run")
+    args = parser.parse_args()
+
+    quick = args.quick
+    n_lines = 128 if quick else 512
+    data_dir = tempfile.mkdtemp(prefix="openhsi-bench-")
+
+    # server.py reads these at import time.
+    os.environ["OPENHSI_CAMERA_BACKEND"] = "simulated"
+    os.environ["OPENHSI_DATA_DIR"] = data_dir
+    os.environ.pop("OPENHSI_ACQUISITION_ADDRESS", None)
+
+    try:
+        results = {}
+        print("collect ...")
+        results["collect"] = bench_collect(n_lines, levels=[-1, 0, 1, 2, 3], repeats=1 if quick else 3)
+
+        import server
+
+        server.start()
+        server.registry.default.cam = make_camera(n_lines)
+        with ServerThread(server.app) as srv:
+            srv.request("/api/capture", "POST")
+            wait_for_capture(srv)
+            print("/api/show ...")
+            results["show"] = bench_show(srv, repeats=3 if quick else 10)
+            print("/api/save ...")
+            results["save"] = bench_save(srv, data_dir, repeats=2 if quick else 5)
+            print("/api/file_list ...")
+            results["file_list"] = bench_file_list(srv, data_dir, 1_000 if quick else 10_000, repeats=3 if quick else 10)
+            print("/api/status ...")
+            results["status"] = bench_status(srv, [1, 8, 32], requests_per_worker=20 if quick else 100)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    report = {
+        "schema": 1,
+        "version": server.__version__,
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "host": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+        },
+        "config": {"quick": quick, "n_lines": n_lines},
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
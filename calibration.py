@@ -0,0 +1,192 @@
+"""
+Calibration cache for openhsiCamera.
+
+Switching `processing_lvl` goes through `reinitialise`, which reloads the
+calibration file and recomputes every transform reference. This module keeps
+both in memory instead:
+
+- raw calibration dicts, keyed by the content hash of the calibration file
+- derived transform setup (smile-correction indices, spectral bin offsets,
+  radiance references), keyed by (calibration hash, binning, window,
+  processing level, ...)
+
+Entries are evicted least-recently-used once the memory budget is exceeded.
+Derived entries can also be written to a directory of `.npz` files so they
+survive restarts.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Attributes that CameraProperties.tfm_setup derives from settings and calibration.
+SETUP_ATTRS = (
+    "smiled_size",
+    "byte_sz",
+    "width",
+    "bin_rows",
+    "bin_cols",
+    "reduced_shape",
+    "binned_wavelengths",
+    "λs",
+    "bin_idxs",
+    "nearest_exposure",
+    "dark_current",
+    "ref_luminance",
+    "spec_rad_ref",
+    "rad_6SV",
+    "smile_idx",
+    "smile_cols",
+    "bin_starts",
+    "bin_stop",
+    "bin_empty",
+)
+TUPLE_ATTRS = ("smiled_size", "reduced_shape")
+
+
+def _nbytes(value):
+    if isinstance(value, dict):
+        return sum(_nbytes(v) for v in value.values())
+    return getattr(value, "nbytes", 64)
+
+
+class CalibrationCache:
+    """Memory-bounded LRU cache of calibrations and derived transform setup."""
+
+    def __init__(self, max_bytes=256 * 2**20, cache_dir=None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self._file_hashes = {}
+
+    def file_hash(self, path):
+        """Content hash of a calibration file, memoised on its size and mtime."""
+        st = os.stat(path)
+        stat_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        if stat_key not in self._file_hashes:
+            h = hashlib.sha1()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    h.update(chunk)
+            self._file_hashes[stat_key] = h.hexdigest()
+        return self._file_hashes[stat_key]
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+        value = self._load_npz(key)
+        with self.lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self._insert(key, value)
+        return value
+
+    def put(self, key, value, persist=False):
+        self._insert(key, value)
+        if persist:
+            self._save_npz(key, value)
+
+    def _insert(self, key, value):
+        nbytes = _nbytes(value)
+        with self.lock:
+            if key in self.entries:
+                self.size -= _nbytes(self.entries.pop(key))
+            self.entries[key] = value
+            self.size += nbytes
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= _nbytes(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    # On-disk tier --------------------------------------------------------
+    def _npz_path(self, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.npz")
+
+    def _save_npz(self, key, value):
+        if not self.cache_dir:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        arrays = {name: np.asarray(v) for name, v in value.items()}
+        arrays["__key__"] = np.asarray(repr(key))
+        tmp_path = self._npz_path(key) + ".tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, self._npz_path(key))
+
+    def _load_npz(self, key):
+        if not self.cache_dir or not os.path.exists(self._npz_path(key)):
+            return None
+        try:
+            with np.load(self._npz_path(key), allow_pickle=False) as npz:
+                if str(npz["__key__"]) != repr(key):
+                    return None
+                value = {}
+                for name in npz.files:
+                    if name == "__key__":
+                        continue
+                    array = npz[name]
+                    if name in TUPLE_ATTRS:
+                        value[name] = tuple(int(v) for v in array)
+                    elif array.ndim == 0:
+                        value[name] = array[()]
+                    else:
+                        value[name] = array
+                return value
+        except Exception:
+            return None
+
+
+def setup_key(cam, dtype, lvl):
+    """Cache key for the derived transform setup of `cam` at processing level `lvl`."""
+    s = cam.settings
+    key = [
+        cam.calibration_hash,
+        lvl,
+        np.dtype(dtype).str,
+        tuple(s.get("binxy", ())),
+        tuple(s.get("win_offset", ())),
+        tuple(s.get("win_resolution", ())),
+        tuple(s.get("row_slice", ())),
+        tuple(s.get("resolution", ())),
+        s.get("fwhm_nm"),
+    ]
+    if cam.dn2rad in cam.tfm_list:
+        key += [s.get("exposure_ms"), s.get("luminance")]
+    return tuple(key)
+
+
+def smile_indices(smile_shifts, n_rows, n_cols, width):
+    """Flat indices into a cropped (n_rows, n_cols) frame that apply the fast smile correction."""
+    shifts = np.asarray(smile_shifts[:n_rows], dtype=np.intp)
+    return (np.arange(n_rows, dtype=np.intp)[:, None] * n_cols + shifts[:, None] + np.arange(width, dtype=np.intp)[None, :])
+
+
+calibration_cache = CalibrationCache(
+    max_bytes=int(float(os.environ.get("OPENHSI_CAL_CACHE_MB", 256)) * 2**20),
+    cache_dir=os.environ.get("OPENHSI_CAL_CACHE_DIR") or None,
+)
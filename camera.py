@@ -0,0 +1,812 @@
+import os
+import queue
+import threading
+import time
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import numpy as np
+from tqdm import tqdm
+from openhsi.capture import OpenHSI
+from openhsi.data import CircArrayBuffer
+
+from calibration import SETUP_ATTRS, calibration_cache, setup_key, smile_indices
+from cubes import truncated
+from preview import PREVIEW_BANDS, PREVIEW_BINNING, PREVIEW_LINES, PreviewReducer
+from reference import (
+    REFERENCE_KINDS,
+    apply_correction,
+    correction_terms,
+    describe_key,
+    reference_key,
+    reference_store,
+    streaming_mean,
+)
+
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
+
+
+# Settings that can be changed on a running camera without rebuilding the buffers.
+LIVE_SETTINGS = ("exposure_ms", "deferred_processing", "pipelined_capture")
+# Settings that have to be written to the sensor itself.
+HARDWARE_SETTINGS = ("binxy", "win_offset", "win_resolution", "pixel_format")
+
+
+def diff_settings(current, requested):
+    """Return the requested settings whose values differ from `current`."""
+    changes = {}
+    for key, value in requested.items():
+        if value is None:
+            continue
+        old = current.get(key)
+        if isinstance(value, (list, tuple)) and old is not None:
+            same = list(old) == list(value)
+        else:
+            same = old == value
+        if not same:
+            changes[key] = value
+    return changes
+
+
+# reimplemnted openhsi capture to allow capture progress feedback.
+class CaptureMixin:
+    calibration_hash = None
+    collecting = False
+
+    def __init__(self, *args, **kwargs):
+        # Held while the camera SDK is in use (captures, bursts, settings changes),
+        # so telemetry never talks to the sensor at the same time.
+        self.camera_lock = threading.RLock()
+        super().__init__(*args, **kwargs)
+
+    def collect(self, progress_callback=None):
+        with self.camera_lock:
+            self.collecting = True
+            # Where this capture's lines start in the (circular) buffers, and how many it stored.
+            temps = getattr(self, "cam_temperatures", None)
+            self.capture_starts = (
+                self.dc.write_pos[self.dc.axis],
+                self.timestamps.write_pos,
+                None if temps is None else temps.write_pos[temps.axis],
+            )
+            self.lines_captured = 0
+            try:
+                self._collect(progress_callback)
+            finally:
+                self.collecting = False
+                self.reset_capture_control()  # drop requests that arrived too late to act on
+
+    def _collect(self, progress_callback=None):
+        deferred = self.settings.get("deferred_processing", False) and len(self.tfm_list) > 0
+        store = self.put_raw if deferred else self.put
+        if self.settings.get("pipelined_capture", False):
+            self.collect_pipelined(store, progress_callback)
+        else:
+            self.start_cam()
+            pbar = tqdm(range(self.n_lines))
+            for _ in pbar:
+                if self.interrupt and self.checkpoint():
+                    break
+                store(self.get_img())
+                self.lines_captured += 1
+                if callable(getattr(self, "get_temp", None)):
+                    self.cam_temperatures.put(self.get_temp())
+                # If a progress_callback is provided, extract the progress data from pbar.
+                if progress_callback:
+                    # pbar.format_dict returns a dictionary with useful keys
+                    # such as 'n', 'total', 'elapsed', and 'eta'.
+                    progress_callback(pbar.format_dict)
+            if not self.paused:
+                self.stop_cam()
+            if progress_callback:
+                progress_callback(pbar.format_dict)  # final counts, tqdm refreshes lazily
+        if deferred:
+            self.process_deferred(progress_callback)
+
+    # Cancel and pause ----------------------------------------------------
+    # The collect loops test `interrupt` once per line and only call
+    # checkpoint() when a request is pending, so the cost per line is a
+    # single attribute read.
+
+    interrupt = False
+    cancel_requested = False
+    pause_requested = False
+    paused = False
+    resume_event = None
+
+    def reset_capture_control(self):
+        self.cancel_requested = self.pause_requested = self.paused = self.interrupt = False
+        self.resume_event = threading.Event()
+
+    def request_cancel(self):
+        """Stop the running capture after the current line; the lines so far are kept."""
+        self.resume_event = self.resume_event or threading.Event()
+        self.cancel_requested = True
+        self.interrupt = True
+        self.resume_event.set()
+
+    def request_pause(self):
+        self.resume_event = self.resume_event or threading.Event()
+        self.resume_event.clear()
+        self.pause_requested = True
+        self.interrupt = True
+
+    def request_resume(self):
+        self.pause_requested = False
+        self.interrupt = self.cancel_requested
+        if self.resume_event is not None:
+            self.resume_event.set()
+
+    def checkpoint(self):
+        """Handle a pending pause or cancel between lines. Returns True to stop collecting.
+
+        A paused capture stops the camera until it is resumed; cancelling a
+        paused capture leaves it stopped (and `paused` set).
+        """
+        if self.pause_requested and not self.cancel_requested:
+            self.stop_cam()
+            self.paused = True
+            self.resume_event.wait()
+            if self.cancel_requested:
+                return True
+            self.paused = False
+            self.start_cam()
+        return self.cancel_requested
+
+    def truncated_cube(self):
+        """The lines of the last capture if it was cancelled early, else None."""
+        count = getattr(self, "lines_captured", self.n_lines)
+        if count >= self.n_lines:
+            return None
+        return truncated(self, count, *self.capture_starts)
+
+    def sample_temperature(self):
+        """Sensor temperature for telemetry, or None if the camera has no sensor.
+
+        Never waits for the camera: while it is in use this is the last
+        temperature the running capture recorded, or None during a burst or a
+        settings change.
+        """
+        if not callable(getattr(self, "get_temp", None)):
+            return None
+        if not self.camera_lock.acquire(blocking=False):
+            return self.recorded_temperature()
+        try:
+            return float(self.get_temp())
+        finally:
+            self.camera_lock.release()
+
+    def recorded_temperature(self):
+        """The last temperature the running capture recorded, or None."""
+        buf = getattr(self, "cam_temperatures", None)
+        if not self.collecting or buf is None or not self.lines_captured:
+            return None
+        return float(buf.data[(buf.write_pos[buf.axis] - 1) % buf.data.shape[buf.axis]])
+
+    # Pipelined capture ----------------------------------------------------
+    # A grab thread copies frames into a preallocated pool while the calling
+    # thread runs put(), so processing never holds up the next get_img.
+
+    # Frames that can be buffered between the grab thread and put().
+    grab_pool_size = 64
+    # Seconds between temperature readings during a pipelined capture.
+    temp_interval_s = 1.0
+
+    def _grab_pool(self):
+        shape = (self.grab_pool_size,) + tuple(self.settings["resolution"])
+        pool = getattr(self, "grab_pool", None)
+        if pool is None or pool.shape != shape or pool.dtype != self.dtype_in:
+            pool = self.grab_pool = np.empty(shape, dtype=self.dtype_in)
+        return pool
+
+    def collect_pipelined(self, store, progress_callback=None):
+        """Collect with get_img on a grab thread and `store` (put or put_raw) on this one.
+
+        The grab thread blocks when every pool slot is waiting to be stored; each
+        time that happens counts as an overrun, since the camera's own buffer is
+        then filling up.
+        """
+        pool = self._grab_pool()
+        free, ready = queue.Queue(), queue.Queue()
+        for slot in range(len(pool)):
+            free.put(slot)
+        stop = threading.Event()
+        stats = {"overruns": 0, "error": None}
+
+        def grab():
+            try:
+                for _ in range(self.n_lines):
+                    if stop.is_set():
+                        return
+                    if self.interrupt and self.checkpoint():
+                        ready.put(None)
+                        return
+                    frame = self.get_img()
+                    grabbed_ns = time.time_ns()
+                    try:
+                        slot = free.get_nowait()
+                    except queue.Empty:
+                        stats["overruns"] += 1
+                        while True:
+                            try:
+                                slot = free.get(timeout=0.1)
+                                break
+                            except queue.Empty:
+                                if stop.is_set():
+                                    return
+                    pool[slot] = frame
+                    ready.put((slot, grabbed_ns))
+            except Exception as e:
+                stats["error"] = e
+                ready.put(None)
+
+        has_temp = callable(getattr(self, "get_temp", None))
+        temp, temp_time = None, None
+        self.start_cam()
+        grabber = threading.Thread(target=grab, name="openhsi-grab", daemon=True)
+        grabber.start()
+        pbar = tqdm(range(self.n_lines))
+        try:
+            for _ in pbar:
+                item = ready.get()
+                if item is None:
+                    if stats["error"] is not None:
+                        raise stats["error"]
+                    break  # cancelled
+                slot, grabbed_ns = item
+                ts_pos = self.timestamps.write_pos
+                store(pool[slot])
+                # Stamp the line with when it was grabbed rather than stored.
+                self.timestamps.data[ts_pos] = np.datetime64(grabbed_ns, "ns")
+                self.lines_captured += 1
+                free.put(slot)
+                if has_temp:
+                    if temp_time is None or time.monotonic() - temp_time >= self.temp_interval_s:
+                        temp, temp_time = self.get_temp(), time.monotonic()
+                    self.cam_temperatures.put(temp)
+                if progress_callback:
+                    progress_callback(dict(pbar.format_dict, queue_depth=ready.qsize(), overruns=stats["overruns"]))
+        finally:
+            stop.set()
+            grabber.join()
+            if not self.paused:
+                self.stop_cam()
+        if progress_callback:
+            progress_callback(dict(pbar.format_dict, queue_depth=0, overruns=stats["overruns"]))
+
+    # Deferred processing --------------------------------------------------
+    # Capture raw frames at full speed and apply the processing level to the
+    # whole cube afterwards, in chunks of lines.
+
+    # Upper bound on the float32 working set of one batch chunk.
+    batch_bytes = 64 * 2**20
+
+    def put_raw(self, x):
+        """Store a raw frame (cropped if the pipeline starts by cropping) for later processing."""
+        crop_first = self.tfm_list[0] == self.crop
+        frame = self.crop(x) if crop_first else x
+        raw = getattr(self, "raw_cube", None)
+        if raw is None or raw.shape[1:] != frame.shape or len(raw) != self.n_lines or raw.dtype != frame.dtype:
+            raw = self.raw_cube = np.empty((self.n_lines,) + frame.shape, dtype=frame.dtype)
+            self.raw_count = 0
+        self.timestamps.update()
+        raw[self.raw_count % self.n_lines] = frame
+        self.raw_count += 1
+
+    def process_deferred(self, progress_callback=None):
+        """Run the processing pipeline over the raw frames of the last capture and fill the datacube.
+
+        A cancelled capture only processes the frames it stored.
+        """
+        raw, n = self.raw_cube, self.n_lines
+        count = min(self.raw_count, n)
+        cropped = self.tfm_list[0] == self.crop
+        tfms = self.tfm_list[1:] if cropped else self.tfm_list
+        batchable = all(hasattr(self, f"batch_{f.__name__}") for f in tfms)
+        chunk = max(1, self.batch_bytes // (4 * int(np.prod(raw.shape[1:]))))
+        # Lines land in the same slots that n_lines calls to put() would have used.
+        start = self.dc.write_pos[self.dc.axis]
+        t0 = time.perf_counter()
+        for i0 in range(0, count, chunk):
+            i1 = min(i0 + chunk, count)
+            x = self.batch_correct(raw[i0:i1], cropped)
+            if batchable:
+                for f in tfms:
+                    x = getattr(self, f"batch_{f.__name__}")(x)
+            else:
+                x = np.stack([self._pipeline_from(tfms, frame) for frame in x])
+            self.dc.data[:, (start + np.arange(i0, i1)) % n] = x.transpose(1, 0, 2)
+            if progress_callback:
+                elapsed = time.perf_counter() - t0
+                progress_callback(
+                    {"phase": "processing", "n": i1, "total": count, "elapsed": elapsed, "rate": i1 / elapsed if elapsed else 0}
+                )
+        # Same buffer state as after `count` puts.
+        if count == n:  # full, oldest line at the write position
+            self.dc.slots_left = 0
+            self.dc.read_pos = self.dc.write_pos.copy()
+        else:
+            self.dc.write_pos[self.dc.axis] = (start + count) % n
+            self.dc.slots_left = max(self.dc.slots_left - count, 0)
+        self.raw_count = 0
+
+    def _pipeline_from(self, tfms, x):
+        for f in tfms:
+            x = f(x)
+        return x
+
+    def batch_crop(self, x):
+        return x[:, self.settings["row_slice"][0] : self.settings["row_slice"][1]]
+
+    def batch_fast_smile(self, x):
+        n_rows, width = self.smiled_size
+        if getattr(self, "smile_cols", None) != x.shape[2]:
+            self.smile_cols = x.shape[2]
+            self.smile_idx = smile_indices(self.calibration["smile_shifts"], n_rows, x.shape[2], width)
+        out = np.take(x.reshape(len(x), -1), self.smile_idx, axis=1)
+        return out.astype(self.line_buff.data.dtype, copy=False)
+
+    def batch_fast_bin(self, x):
+        n_bands, width = self.reduced_shape[1:]
+        return x[..., : n_bands * width].reshape(x.shape[:2] + (n_bands, width)).sum(axis=-1)
+
+    def batch_slow_bin(self, x):
+        if not hasattr(self, "bin_starts"):
+            self._precompute_indices()
+        sums = np.add.reduceat(np.float32(x[..., : self.bin_stop]), self.bin_starts, axis=-1)
+        sums[..., self.bin_empty] = 0
+        return sums.astype(self.bin_buff.data.dtype, copy=False)
+
+    def batch_dn2rad(self, x):
+        return self.dn2rad(x)
+
+    def batch_rad2ref_6SV(self, x):
+        return self.rad2ref_6SV(x)
+
+    # Dark/flat correction -------------------------------------------------
+    # Raw frames are corrected as (x - dark) * gain before the processing
+    # pipeline, with the references taken at the current exposure, binning
+    # and pixel format (see reference.py).
+
+    # Frames averaged into a reference when no count is given.
+    reference_frames = 64
+
+    def acquire_reference(self, kind, n_frames=None):
+        """Average a burst of raw frames into the dark or flat reference for the current settings."""
+        if kind not in REFERENCE_KINDS:
+            raise ValueError(f"Unknown reference '{kind}'. Choose from {', '.join(REFERENCE_KINDS)}")
+        n_frames = int(n_frames or self.reference_frames)
+        if n_frames < 1:
+            raise ValueError("n_frames must be at least 1")
+        t0 = time.perf_counter()
+        with self.camera_lock:
+            self.start_cam()
+            try:
+                mean = streaming_mean((self.get_img() for _ in range(n_frames)), n_frames)
+            finally:
+                self.stop_cam()
+        key = reference_key(self)
+        reference_store.put(kind, key, mean)
+        return dict(
+            describe_key(key),
+            kind=kind,
+            n_frames=n_frames,
+            mean_dn=float(mean.mean()),
+            elapsed_ms=(time.perf_counter() - t0) * 1e3,
+        )
+
+    def clear_reference(self, kind):
+        if kind not in REFERENCE_KINDS:
+            raise ValueError(f"Unknown reference '{kind}'. Choose from {', '.join(REFERENCE_KINDS)}")
+        return {"kind": kind, "removed": reference_store.delete(kind, reference_key(self))}
+
+    def reference_status(self):
+        """Which references exist for the current settings and whether they are applied."""
+        key = reference_key(self)
+        status = describe_key(key)
+        for kind in REFERENCE_KINDS:
+            status[kind] = reference_store.get(kind, key) is not None
+        status["applied"] = self.correction_terms() is not None
+        return status
+
+    def correction_terms(self):
+        """(dark, gain) for the current settings, or None if no references match them."""
+        state = (reference_key(self), reference_store.version)
+        if getattr(self, "_correction_state", None) != state:
+            shape = tuple(self.settings["resolution"])
+            refs = [reference_store.get(kind, state[0]) for kind in REFERENCE_KINDS]
+            # A reference from a different window size cannot be applied.
+            refs = [ref if ref is not None and ref.shape == shape else None for ref in refs]
+            self._correction = None if all(ref is None for ref in refs) else correction_terms(*refs)
+            self._correction_state = state
+        return self._correction
+
+    def correct(self, x):
+        """Dark/flat correct one raw frame into a reused buffer."""
+        terms = self.correction_terms()
+        if terms is None:
+            return x
+        work = getattr(self, "_correction_work", None)
+        if work is None or work.shape != x.shape or self._correction_out.dtype != x.dtype:
+            work = self._correction_work = np.empty(x.shape, dtype=np.float32)
+            self._correction_out = np.empty(x.shape, dtype=x.dtype)
+        return apply_correction(x, *terms, work=work, out=self._correction_out)
+
+    def batch_correct(self, x, cropped=False):
+        """Dark/flat correct a stack of raw frames, cropped to row_slice if `cropped`."""
+        terms = self.correction_terms()
+        if terms is None:
+            return x
+        if cropped:
+            rows = slice(*self.settings["row_slice"])
+            terms = [None if term is None else term[rows] for term in terms]
+        return apply_correction(x, *terms)
+
+    def put(self, x):
+        super().put(self.correct(x))
+
+    # Preview capture ------------------------------------------------------
+    # A short burst reduced frame by frame into its own small cube (see
+    # preview.py); the datacube, n_lines and settings stay as they are, so
+    # nothing has to be restored or reinitialised afterwards.
+
+    def preview(self, n_lines=None, binning=None, n_bands=None):
+        """Capture a low-resolution preview cube of shape (lines, rows // binning, n_bands)."""
+        n_lines = int(n_lines or PREVIEW_LINES)
+        if n_lines < 1:
+            raise ValueError("n_lines must be at least 1")
+        reducer = PreviewReducer(
+            self.settings["row_slice"],
+            self.settings["resolution"][1],
+            self.calibration.get("wavelengths"),
+            binning=binning or PREVIEW_BINNING,
+            n_bands=n_bands or PREVIEW_BANDS,
+        )
+        cube = np.empty((n_lines, reducer.n_rows, len(reducer.starts)), dtype=np.float32)
+        t0 = time.perf_counter()
+        with self.camera_lock:
+            self.start_cam()
+            try:
+                for i in range(n_lines):
+                    reducer(self.correct(self.get_img()), out=cube[i])
+            finally:
+                self.stop_cam()
+        return {
+            "cube": cube,
+            "band_centres": reducer.band_centres,
+            "binning": reducer.binning,
+            "elapsed_ms": (time.perf_counter() - t0) * 1e3,
+        }
+
+    def load_calibration_data_from_netcdf(self, filename):
+        """Load the calibration file through the calibration cache."""
+        self.calibration_hash = calibration_cache.file_hash(filename)
+        key = ("calibration", self.calibration_hash)
+        cached = calibration_cache.get(key)
+        if cached is None:
+            super().load_calibration_data_from_netcdf(filename)
+            for value in self.calibration.values():
+                if hasattr(value, "load"):
+                    value.load()  # read lazily backed arrays once, while we still cache them
+            cached = self.calibration
+            calibration_cache.put(key, cached)
+        self.calibration = dict(cached)
+
+    def set_processing_lvl(self, lvl=-1, custom_tfms=None):
+        # Drop references derived for the previous level so they cannot leak into this one.
+        for name in SETUP_ATTRS + ("need_rad_after_fast_bin",):
+            self.__dict__.pop(name, None)
+        super().set_processing_lvl(lvl, custom_tfms)
+
+    def tfm_setup(self, more_setup=None, dtype=np.uint16, lvl=0):
+        """Transform setup, served from the calibration cache when possible."""
+        key = setup_key(self, dtype, lvl) if self.calibration_hash else None
+        cached = calibration_cache.get(key) if key else None
+        if cached is None:
+            super().tfm_setup(dtype=dtype, lvl=lvl)
+            self._precompute_indices()
+            cached = {name: getattr(self, name) for name in SETUP_ATTRS if hasattr(self, name)}
+            if self.dn2rad in self.tfm_list:
+                cached["luminance"] = self.settings["luminance"]
+            if key:
+                calibration_cache.put(key, cached, persist=True)
+        else:
+            for name, value in cached.items():
+                if name == "luminance":
+                    self.settings.setdefault("luminance", value)
+                else:
+                    setattr(self, name, value)
+            # Scratch buffers are per instance.
+            if self.fast_smile in self.tfm_list:
+                self.line_buff = CircArrayBuffer(self.smiled_size, axis=0, dtype=dtype)
+            if self.slow_bin in self.tfm_list:
+                binned_type = np.float32 if hasattr(self, "need_rad") else dtype
+                n_bands = len(self.bin_starts)
+                self.bin_buff = CircArrayBuffer((np.ptp(self.settings["row_slice"]), n_bands), axis=1, dtype=binned_type)
+        if more_setup is not None:
+            more_setup(self)
+
+    def _precompute_indices(self):
+        if hasattr(self, "smiled_size"):
+            n_rows, width = self.smiled_size
+            self.smile_cols = self.settings["resolution"][1]
+            self.smile_idx = smile_indices(self.calibration["smile_shifts"], n_rows, self.smile_cols, width)
+        if hasattr(self, "bin_idxs"):
+            idxs = np.asarray(self.bin_idxs)
+            self.bin_starts = idxs[:-1]
+            # Bands whose edges coincide are empty and sum to zero.
+            self.bin_empty = idxs[1:] <= idxs[:-1]
+            self.bin_stop = max(int(idxs[-1]), int(idxs[:-1].max()) + 1)
+
+    def fast_smile(self, x):
+        """Apply the fast smile correction as a single gather with precomputed indices."""
+        n_rows, width = self.smiled_size
+        if getattr(self, "smile_cols", None) != x.shape[1]:
+            self.smile_cols = x.shape[1]
+            self.smile_idx = smile_indices(self.calibration["smile_shifts"], n_rows, x.shape[1], width)
+        out = self.line_buff.data
+        if x.dtype == out.dtype and x.flags.c_contiguous:
+            np.take(x, self.smile_idx, out=out)
+        else:
+            out[...] = np.take(x, self.smile_idx)
+        return out
+
+    def slow_bin(self, x):
+        """Bin spectral bands with one reduceat over the precomputed band edges."""
+        if not hasattr(self, "bin_starts"):
+            self._precompute_indices()
+        sums = np.add.reduceat(np.float32(x[:, : self.bin_stop]), self.bin_starts, axis=1)
+        sums[:, self.bin_empty] = 0
+        self.bin_buff.data[...] = sums
+        return self.bin_buff.data
+
+    def current_settings(self):
+        return dict(self.settings, n_lines=self.n_lines, processing_lvl=self.proc_lvl)
+
+    def apply_settings(self, **requested):
+        """Apply only the settings that changed, with at most one reinitialise.
+
+        Exposure is set directly on the camera unless the pipeline converts to
+        radiance, whose references are precomputed for the current exposure.
+        """
+        t0 = time.perf_counter()
+        with self.camera_lock:
+            changes = diff_settings(self.current_settings(), requested)
+            reinit = {k: v for k, v in changes.items() if k not in LIVE_SETTINGS}
+            for key in ("deferred_processing", "pipelined_capture"):
+                if key in changes:
+                    self.settings[key] = changes[key]
+            if "exposure_ms" in changes:
+                self.set_exposure(changes["exposure_ms"])
+                if self.dn2rad in self.tfm_list:
+                    reinit["exposure_ms"] = self.settings["exposure_ms"]
+            hardware = {k: reinit[k] for k in HARDWARE_SETTINGS if k in reinit}
+            if hardware:
+                self.push_hardware_settings(hardware)
+            if reinit:
+                self.reinitialise(**reinit)
+                self.nc = None  # drop the quicklook dataset of the old buffers
+            return {
+                "changed": changes,
+                "reinitialised": bool(reinit),
+                "apply_ms": (time.perf_counter() - t0) * 1e3,
+            }
+
+    def push_hardware_settings(self, hardware):
+        """Write window, binning and pixel format changes to the sensor."""
+        s = dict(self.settings, **hardware)
+        height, width = s["win_resolution"]
+        offset_y, offset_x = s["win_offset"]
+        if hasattr(self, "flircam"):
+            from openhsi.cameras import set_camera_attribute
+
+            cam = self.flircam
+            set_camera_attribute(cam, "PixelFormat", s["pixel_format"])
+            set_camera_attribute(cam, "BinningHorizontal", s["binxy"][0], required=False)
+            set_camera_attribute(cam, "BinningVertical", s["binxy"][1], required=False)
+            # Clear the offsets first so the new window always fits on the sensor.
+            set_camera_attribute(cam, "OffsetX", 0)
+            set_camera_attribute(cam, "OffsetY", 0)
+            set_camera_attribute(cam, "Width", width or cam.SensorWidth)
+            set_camera_attribute(cam, "Height", height or cam.SensorHeight)
+            set_camera_attribute(cam, "OffsetY", offset_y)
+            set_camera_attribute(cam, "OffsetX", offset_x)
+        elif hasattr(self, "deviceSettings"):  # Lucid
+            nodes = self.deviceSettings
+            nodes["BinningHorizontal"].value = s["binxy"][0]
+            nodes["PixelFormat"].value = s["pixel_format"]
+            nodes["OffsetY"].value = 0
+            nodes["OffsetX"].value = 0
+            nodes["Height"].value = height or nodes["Height"].max
+            nodes["Width"].value = width or nodes["Width"].max
+            nodes["OffsetY"].value = offset_y
+            nodes["OffsetX"].value = offset_x
+        elif hasattr(self, "xicam"):
+            cam = self.xicam
+            cam.set_binning_vertical(s["binxy"][0])
+            cam.set_imgdataformat(s["pixel_format"])
+            cam.set_offsetY(0)
+            cam.set_offsetX(0)
+            cam.set_height(height or cam.get_height_maximum())
+            cam.set_width(width or cam.get_width_maximum())
+            cam.set_offsetY(offset_y)
+            cam.set_offsetX(offset_x)
+
+
+class SyntheticCameraBase:
+    """Synthetic pushbroom camera producing realistic frames without hardware.
+
+    Each frame is one along-track line of an RGB scene turned into a pseudo-spectrum
+    (CIE XYZ matching functions under a 5800 K blackbody), with the calibration's
+    smile shifts, exposure scaling, sensor noise and a slowly drifting temperature.
+    Frames are paced to `line_rate_hz`; None follows the FLIR frame rate for the
+    current exposure and 0 free-runs as fast as frames can be generated. A non-zero
+    `frame_pool` precomputes that many frames and cycles them, so free-running
+    captures measure the capture pipeline rather than frame synthesis.
+    """
+
+    def __init__(self, img_path=None, line_rate_hz=None, frame_pool=0, **kwargs):
+        super().__init__(**kwargs)
+        self.img_path = img_path or os.path.join(ASSETS_DIR, "great_hall_slide.png")
+        self.line_rate_hz = line_rate_hz
+        self.frame_pool = frame_pool
+        self._frame_key = None
+        self._line_idx = 0
+        self._t0 = time.monotonic()
+
+    def load_calibration_data_from_netcdf(self, filename):
+        super().load_calibration_data_from_netcdf(filename)
+        # Processing levels >= 0 need a flat field reference, which not every
+        # calibration file carries. Synthesise one from the illumination model.
+        if "flat_field_pic" not in self.calibration and "resolution" in self.settings:
+            self.calibration["flat_field_pic"] = self._flat_field()
+
+    def _wavelengths(self, n_cols):
+        wavelengths = self.calibration.get("wavelengths")
+        if wavelengths is None:
+            return np.linspace(400, 900, n_cols)
+        fit = np.polyfit(np.arange(len(wavelengths)), wavelengths, 3)
+        return np.poly1d(fit)(np.arange(n_cols))
+
+    def _illumination(self, λ):
+        """5800 K blackbody normalised to a peak of 1."""
+        h, c, k = 6.62607015e-34, 299_792_458, 1.38064852e-23
+        λ_m = λ * 1e-9
+        y = (2 * h * c**2) / λ_m**5 / (np.exp((h * c) / (λ_m * k * 5800)) - 1)
+        return (y / y.max()).astype(np.float32)
+
+    def _flat_field(self):
+        rows, cols = self.settings["resolution"]
+        r0, r1 = self.settings["row_slice"]
+        flat = np.zeros((rows, cols), dtype=np.uint16)
+        flat[r0:r1] = np.uint16(200 * self._illumination(self._wavelengths(cols)))
+        return flat
+
+    def _matching_functions(self, λ):
+        """Vectorised CIE XYZ matching functions (piecewise Gaussian fit)."""
+
+        def g(x, A, μ, σ1, σ2):
+            t = (x - μ) / np.where(x < μ, σ1, σ2)
+            return A * np.exp(-(t**2) / 2)
+
+        Å = λ * 10
+        x̅ = g(Å, 1.056, 5998, 379, 310) + g(Å, 0.362, 4420, 160, 267) + g(Å, -0.065, 5011, 204, 262)
+        y̅ = g(Å, 0.821, 5688, 469, 405) + g(Å, 0.286, 5309, 163, 311)
+        z̅ = g(Å, 1.217, 4370, 118, 360) + g(Å, 0.681, 4590, 260, 138)
+        return np.stack([x̅, y̅, z̅]).astype(np.float32)
+
+    def _prepare(self):
+        """Precompute the per-row spectral basis, scene and noise bank for the current geometry."""
+        key = (tuple(self.settings["resolution"]), tuple(self.settings["row_slice"]), self.settings.get("pixel_format"))
+        if key == self._frame_key:
+            return
+        rows, cols = self.settings["resolution"]
+        r0, r1 = self.settings["row_slice"]
+        n_rows = r1 - r0
+
+        λ = self._wavelengths(cols)
+        basis = self._matching_functions(λ) * self._illumination(λ)
+        basis /= basis.sum(axis=0).max()  # a white scene line peaks at 1
+        # Shift each row's spectrum by its smile offset, as the real optics do.
+        shifts = np.zeros(n_rows, dtype=int)
+        smile = self.calibration.get("smile_shifts")
+        if smile is not None:
+            shifts[: min(n_rows, len(smile))] = np.asarray(smile)[:n_rows]
+        idx = np.clip(np.arange(cols)[None, :] - shifts[:, None], 0, cols - 1)
+        self._basis = basis[:, idx]  # (3, n_rows, cols)
+
+        from PIL import Image
+
+        with Image.open(self.img_path) as img:
+            img = img.convert("RGB")
+            img = img.resize((max(img.width * n_rows // img.height, 1), n_rows))
+            self._scene = np.asarray(img, dtype=np.float32) / 255.0  # (n_rows, n_lines, 3)
+
+        rng = np.random.default_rng(0)
+        self._noise = rng.normal(0, 1.5, size=(8, n_rows, cols)).astype(np.float32)
+        self._frame = np.zeros((rows, cols), dtype=self.dtype_in)
+        self._full_scale = np.iinfo(self.dtype_in).max if self.dtype_in == np.uint8 else 4095
+        self._frame_key = key
+        self._pool = None
+        if self.frame_pool:
+            step = max(self._scene.shape[1] // self.frame_pool, 1)
+            self._pool = []
+            for i in range(self.frame_pool):
+                self._line_idx = i * step
+                self._pool.append(self._render().copy())
+
+    def start_cam(self):
+        self._prepare()
+        self._next_t = time.perf_counter()
+
+    def stop_cam(self):
+        pass
+
+    def get_img(self) -> np.ndarray:
+        rate = self.line_rate_hz
+        if rate is None:
+            rate = min(1_000 / (self.settings["exposure_ms"] + 1), 120)
+        if rate:
+            delay = self._next_t - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self._next_t = max(self._next_t, time.perf_counter() - 1 / rate) + 1 / rate
+
+        if self._pool is not None:
+            self._line_idx += 1
+            return self._pool[self._line_idx % len(self._pool)]
+        return self._render()
+
+    def _render(self):
+        line = self._scene[:, self._line_idx % self._scene.shape[1]]
+        self._line_idx += 1
+        gain = 0.7 * self._full_scale * self.settings["exposure_ms"] / 10
+        spectrum = (
+            line[:, 0:1] * self._basis[0] + line[:, 1:2] * self._basis[1] + line[:, 2:3] * self._basis[2]
+        )
+        spectrum *= gain
+        spectrum += self._noise[self._line_idx % len(self._noise)]
+        r0, r1 = self.settings["row_slice"]
+        np.clip(spectrum, 0, self._full_scale, out=spectrum)
+        self._frame[r0:r1] = spectrum
+        return self._frame
+
+    def get_temp(self) -> float:
+        return 35.0 + 2.0 * np.sin((time.monotonic() - self._t0) / 600)
+
+    def set_exposure(self, exposure_ms: float):
+        self.settings["exposure_ms"] = exposure_ms
+
+
+class SyntheticCamera(SyntheticCameraBase, OpenHSI):
+    pass
+
+
+def _openhsi_camera(name):
+    def load():
+        import openhsi.cameras
+
+        return getattr(openhsi.cameras, name)
+
+    return load
+
+
+# Camera backends that can be selected with OPENHSI_CAMERA_BACKEND.
+CAMERA_BACKENDS = {
+    "flir": _openhsi_camera("FlirCamera"),
+    "lucid": _openhsi_camera("LucidCamera"),
+    "ximea": _openhsi_camera("XimeaCamera"),
+    "simulated": lambda: SyntheticCamera,
+}
+
+
+def get_camera_class(backend=None):
+    """Build the capture class for `backend` (defaults to $OPENHSI_CAMERA_BACKEND or flir)."""
+    backend = backend or os.environ.get("OPENHSI_CAMERA_BACKEND", "flir")
+    if backend not in CAMERA_BACKENDS:
+        raise ValueError(
+            f"Unknown camera backend '{backend}'. Choose from {', '.join(CAMERA_BACKENDS)}"
+        )
+    return type("openhsiCamera", (CaptureMixin, CAMERA_BACKENDS[backend]()), {})
@@ -0,0 +1,329 @@
+"""
+Response compression and HTTP caching for the web controller.
+
+The controller is often used over slow field Wi-Fi, so:
+
+- static files are precompressed to `.gz` (and `.br` when the brotli package is
+  installed) next to the originals, at startup or with
+  `python compression.py static/`, and served in the best encoding the client
+  accepts
+- `url_for("static", ...)` URLs carry a content hash (`?v=<hash>`); requests for
+  the current hash are cached by the browser as immutable
+- other text responses (JSON, HTML) are compressed on the fly; streamed HTML
+  pages are gzipped chunk by chunk, so they still reach the browser as they render
+- JSON GET responses get a weak ETag, so polling clients receive 304 Not
+  Modified while the content is unchanged
+
+The same compression and ETags apply to routes served outside Flask, through
+the ASGICompression middleware (see asgi.py).
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import sys
+import zlib
+
+from flask import request, send_from_directory
+from werkzeug.datastructures import Headers
+from werkzeug.http import generate_etag, parse_accept_header, parse_etags, quote_etag, unquote_etag
+
+try:
+    import brotli
+except ImportError:  # optional, gzip only without it
+    brotli = None
+
+# Content types worth compressing.
+COMPRESSIBLE_TYPES = {
+    "application/json",
+    "application/javascript",
+    "text/javascript",
+    "text/css",
+    "text/html",
+    "text/plain",
+    "image/svg+xml",
+}
+# Static files that get precompressed variants.
+PRECOMPRESS_EXTENSIONS = (".css", ".js", ".map", ".svg", ".html", ".json", ".txt")
+# Bodies smaller than this are not worth the compression overhead.
+MIN_SIZE = 512
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Streamed bodies are flushed to the client once this much input has been compressed.
+STREAM_FLUSH_SIZE = 16 * 1024
+
+
+def _encoders():
+    """Available encodings, most preferred first, as (name, suffix, compress)."""
+    encoders = []
+    if brotli is not None:
+        encoders.append(("br", ".br", lambda data: brotli.compress(data, quality=11)))
+    encoders.append(("gzip", ".gz", lambda data: gzip.compress(data, compresslevel=9, mtime=0)))
+    return encoders
+
+
+def precompress_static(static_dir):
+    """Write .gz/.br variants next to compressible static files and hash every file.
+
+    Returns ({filename: content hash}, {filename: {encoding: variant filename}}),
+    with filenames relative to `static_dir`. Variants are only rewritten when
+    older than their source; if the directory is read-only the files are
+    served uncompressed from disk and compressed on the fly instead.
+    """
+    hashes, variants = {}, {}
+    for root, _, names in os.walk(static_dir):
+        for name in names:
+            if name.endswith((".gz", ".br", ".tmp")):
+                continue
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, static_dir).replace(os.sep, "/")
+            with open(path, "rb") as f:
+                data = f.read()
+            hashes[rel] = hashlib.sha1(data).hexdigest()[:12]
+            if not name.endswith(PRECOMPRESS_EXTENSIONS) or len(data) < MIN_SIZE:
+                continue
+            mtime = os.stat(path).st_mtime
+            for encoding, suffix, compress in _encoders():
+                target = path + suffix
+                try:
+                    if not os.path.exists(target) or os.stat(target).st_mtime < mtime:
+                        tmp = f"{target}.{os.getpid()}.tmp"  # workers may start together
+                        with open(tmp, "wb") as f:
+                            f.write(compress(data))
+                        os.replace(tmp, target)
+                except OSError:
+                    continue
+                variants.setdefault(rel, {})[encoding] = rel + suffix
+    return hashes, variants
+
+
+def _accepts(encoding):
+    return request.accept_encodings[encoding] > 0
+
+
+def choose_encoding(accept_encodings):
+    """The on-the-fly encoding for the parsed Accept-Encoding `accept_encodings`, or None."""
+    if brotli is not None and accept_encodings["br"] > 0:
+        return "br"
+    if accept_encodings["gzip"] > 0:
+        return "gzip"
+    return None
+
+
+def compress_body(data, encoding):
+    if encoding == "br":
+        # A low quality keeps on-the-fly brotli faster than gzip at a better ratio.
+        return brotli.compress(data, quality=4)
+    return gzip.compress(data, compresslevel=6)
+
+
+def gzip_stream(chunks, flush_size=STREAM_FLUSH_SIZE):
+    """Gzip an iterable of byte strings, flushing every `flush_size` bytes of input.
+
+    A sync flush after each batch hands the compressed data so far to the client
+    without waiting for the end of the stream.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    pending = 0
+    for chunk in chunks:
+        if not chunk:
+            continue
+        out = compressor.compress(chunk)
+        pending += len(chunk)
+        if pending >= flush_size:
+            out += compressor.flush(zlib.Z_SYNC_FLUSH)
+            pending = 0
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+def compress_response(response):
+    """Compress a text response in the best encoding the client accepts."""
+    if (
+        response.status_code < 200
+        or response.status_code >= 300
+        or response.status_code == 204
+        or response.direct_passthrough
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE_TYPES
+    ):
+        return response
+    response.vary.add("Accept-Encoding")
+    if response.is_streamed:
+        if _accepts("gzip"):
+            body = response.response
+            response.response = gzip_stream(response.iter_encoded())
+            if hasattr(body, "close"):
+                response.call_on_close(body.close)
+            response.headers["Content-Encoding"] = "gzip"
+            response.headers.pop("Content-Length", None)
+        return response
+    data = response.get_data()
+    if len(data) < MIN_SIZE:
+        return response
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is not None:
+        response.set_data(compress_body(data, encoding))
+        response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def add_json_etag(response):
+    """Give JSON GET responses a weak ETag and answer matching requests with 304."""
+    if (
+        request.method == "GET"
+        and response.status_code == 200
+        and response.mimetype == "application/json"
+        and not response.is_streamed
+    ):
+        response.add_etag(weak=True)  # kept if the view already set one
+        response.cache_control.no_cache = True  # always revalidate
+        response.make_conditional(request)
+    return response
+
+
+def not_modified(tag):
+    """Empty 304 tuple if the request already has the weak ETag `tag`, else None.
+
+    Lets views skip building a response body they can identify cheaply.
+    """
+    if request.if_none_match.contains_weak(tag):
+        return "", 304, {"ETag": quote_etag(tag, weak=True)}
+    return None
+
+
+def etag_header(tag):
+    return {"ETag": quote_etag(tag, weak=True)}
+
+
+class ASGICompression:
+    """ASGI middleware doing what init_app's after_request hook does for Flask.
+
+    Complete JSON GET responses get a weak ETag, answered with 304 when the
+    client already has it, and compressible bodies are compressed as in
+    compress_response. Paths matching `exclude`, streamed bodies and partial
+    content pass through untouched.
+    """
+
+    def __init__(self, app, exclude=None):
+        self.app = app
+        self.exclude = re.compile(exclude) if exclude else None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (self.exclude is not None and self.exclude.match(scope["path"])):
+            await self.app(scope, receive, send)
+            return
+        request_headers = _headers(scope["headers"])
+        start = None
+
+        async def send_tagged(message):
+            nonlocal start
+            if start is None:
+                if message["type"] == "http.response.start" and _compressible(message):
+                    start = message  # held back until the body shows whether it is complete
+                    return
+                start = False
+            if start is False or message["type"] != "http.response.body":
+                await send(message)
+                return
+            if message.get("more_body"):
+                await send(start)
+                await send(message)
+                start = False
+                return
+            await self._send_complete(scope, request_headers, start, message["body"], send)
+
+        await self.app(scope, receive, send_tagged)
+
+    async def _send_complete(self, scope, request_headers, start, body, send):
+        headers = _headers(start["headers"])
+        status = start["status"]
+        if scope["method"] == "GET" and status == 200 and _mimetype(headers) == "application/json":
+            if "ETag" not in headers:
+                headers["ETag"] = quote_etag(generate_etag(body), weak=True)
+            headers.setdefault("Cache-Control", "no-cache")  # always revalidate
+            tag, _ = unquote_etag(headers["ETag"])
+            if parse_etags(request_headers.get("If-None-Match")).contains_weak(tag):
+                not_modified = Headers({"ETag": headers["ETag"], "Cache-Control": headers["Cache-Control"]})
+                await send({"type": "http.response.start", "status": 304, "headers": _raw_headers(not_modified)})
+                await send({"type": "http.response.body", "body": b""})
+                return
+        if "accept-encoding" not in headers.get("Vary", "").lower():
+            headers.add("Vary", "Accept-Encoding")
+        if len(body) >= MIN_SIZE:
+            encoding = choose_encoding(parse_accept_header(request_headers.get("Accept-Encoding")))
+            if encoding is not None:
+                body = compress_body(body, encoding)
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(body))
+        await send(dict(start, headers=_raw_headers(headers)))
+        await send({"type": "http.response.body", "body": body})
+
+
+def _headers(raw):
+    return Headers([(key.decode("latin-1"), value.decode("latin-1")) for key, value in raw])
+
+
+def _raw_headers(headers):
+    return [(key.lower().encode("latin-1"), value.encode("latin-1")) for key, value in headers.items()]
+
+
+def _mimetype(headers):
+    return headers.get("Content-Type", "").split(";")[0].strip().lower()
+
+
+def _compressible(start):
+    headers = _headers(start["headers"])
+    return (
+        200 <= start["status"] < 300
+        and start["status"] not in (204, 206)
+        and "Content-Encoding" not in headers
+        and "Content-Range" not in headers
+        and _mimetype(headers) in COMPRESSIBLE_TYPES
+    )
+
+
+def init_app(app):
+    """Install precompressed static serving, hashed static URLs and response compression."""
+    hashes, variants = precompress_static(app.static_folder)
+
+    @app.url_defaults
+    def hashed_static_url(endpoint, values):
+        if endpoint == "static" and "filename" in values and "v" not in values:
+            content_hash = hashes.get(values["filename"])
+            if content_hash:
+                values["v"] = content_hash
+
+    def send_static(filename):
+        available = variants.get(filename, {})
+        for encoding, _, _ in _encoders():
+            if encoding in available and _accepts(encoding):
+                response = send_from_directory(
+                    app.static_folder,
+                    available[encoding],
+                    mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream",
+                )
+                response.headers["Content-Encoding"] = encoding
+                break
+        else:
+            response = app.send_static_file(filename)
+        if filename in variants:
+            response.vary.add("Accept-Encoding")
+        if request.args.get("v") and request.args.get("v") == hashes.get(filename):
+            response.headers["Cache-Control"] = IMMUTABLE
+        return response
+
+    app.view_functions["static"] = send_static
+
+    @app.after_request
+    def compress_and_tag(response):
+        return compress_response(add_json_etag(response))
+
+    return hashes, variants
+
+
+if __name__ == "__main__":
+    static_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+    hashes, variants = precompress_static(static_dir)
+    print(f"Hashed {len(hashes)} files, precompressed {len(variants)} in {static_dir}")
@@ -0,0 +1,161 @@
+"""
+Streaming a datacube to programmatic clients without writing a file.
+
+The cube is sent line-major, as (lines, cross-track, bands), so each chunk of
+lines is one contiguous run of the output and only a chunk is ever copied out
+of the capture buffers. Two formats:
+
+- npz: an uncompressed zip of .npy arrays, `datacube`, `timestamps`
+  (datetime64[ns], one per line) and `wavelengths` (nm, one per band, when
+  the capture is calibrated), read back with np.load
+- arrow: an Arrow IPC stream with one record batch per chunk of lines, a
+  `timestamp` column and a `line` column of fixed-size lists holding each
+  (cross-track, band) frame; the shape and wavelengths are in the schema
+  metadata. Needs the optional pyarrow package.
+"""
+import json
+import zipfile
+
+import numpy as np
+
+from indices import band_slice
+
+FORMATS = {"npz": "application/octet-stream", "arrow": "application/vnd.apache.arrow.stream"}
+# Upper bound on the bytes of one chunk of lines.
+CHUNK_BYTES = 8 * 2**20
+
+
+class StaleCube(RuntimeError):
+    """The capture being streamed was overwritten by a new one."""
+
+
+def parse_slice(text, length, name):
+    """slice(start, stop, step) from "start:stop[:step]" (any part may be empty), or all of `length`."""
+    if not text:
+        return slice(0, length, 1)
+    parts = text.split(":")
+    if len(parts) > 3:
+        raise ValueError(f"{name} must be start:stop[:step]")
+    try:
+        values = [int(p) if p.strip() else None for p in parts] + [None] * (3 - len(parts))
+    except ValueError:
+        raise ValueError(f"{name} must be start:stop[:step] with integers")
+    if len(parts) == 1:  # a single index
+        values[1] = values[0] + 1 if values[0] not in (None, -1) else None
+    start, stop, step = slice(*values).indices(length)
+    if step < 1:
+        raise ValueError(f"{name} step must be positive")
+    if not len(range(start, stop, step)):
+        raise ValueError(f"{name} selects nothing (the cube has {length})")
+    return slice(start, stop, step)
+
+
+def select(cube, wavelengths, lines=None, bands=None, nm=None):
+    """(line slice, band slice) of `cube` from the request's lines, bands or nm ("lo:hi") arguments."""
+    n_lines, n_bands = cube.dc.data.shape[1:]
+    line_sel = parse_slice(lines, n_lines, "lines")
+    if nm:
+        if bands:
+            raise ValueError("Give either bands or nm, not both")
+        if wavelengths is None:
+            raise ValueError("The capture has no wavelength calibration, select bands by index")
+        try:
+            lo, hi = (float(v) for v in nm.split(":"))
+        except ValueError:
+            raise ValueError("nm must be lo:hi in nanometres")
+        s = band_slice(wavelengths, min(lo, hi), max(lo, hi))
+        return line_sel, slice(s.start, s.stop, 1)
+    return line_sel, parse_slice(bands, n_bands, "bands")
+
+
+class _Sink:
+    """Write-only file object whose contents the generators hand out after each chunk."""
+
+    def __init__(self):
+        self.parts = []
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.parts.append(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.parts)
+        self.parts.clear()
+        return data
+
+
+def _line_chunks(data, line_sel, band_sel, chunk_bytes):
+    """Contiguous (lines, cross-track, bands) blocks of data[:, line_sel, band_sel], with their line indices."""
+    rows = range(*line_sel.indices(data.shape[1]))
+    n_bands = len(range(*band_sel.indices(data.shape[2])))
+    step = max(1, chunk_bytes // (data.shape[0] * n_bands * data.itemsize))
+    for i in range(0, len(rows), step):
+        idx = rows[i : i + step]
+        block = data[:, idx.start : idx.stop : idx.step, band_sel]
+        yield np.ascontiguousarray(block.transpose(1, 0, 2)), slice(i, i + len(idx))
+
+
+def stream_npz(data, timestamps, wavelengths, line_sel, band_sel, check=None, chunk_bytes=CHUNK_BYTES):
+    """Yield the bytes of an uncompressed .npz of the selection, chunk by chunk.
+
+    `check` is called after each chunk is copied out and should raise
+    StaleCube if the buffers no longer hold the capture.
+    """
+    sink = _Sink()
+    n_lines = len(range(*line_sel.indices(data.shape[1])))
+    n_bands = len(range(*band_sel.indices(data.shape[2])))
+    shape = (n_lines, data.shape[0], n_bands)
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_STORED) as zf:
+        # Sizes go in data descriptors, since the sink cannot seek back.
+        with zf.open("datacube.npy", "w", force_zip64=True) as f:
+            header = {"descr": np.lib.format.dtype_to_descr(data.dtype), "fortran_order": False, "shape": shape}
+            np.lib.format.write_array_header_1_0(f, header)
+            for block, _ in _line_chunks(data, line_sel, band_sel, chunk_bytes):
+                if check is not None:
+                    check()
+                f.write(block.data)
+                yield sink.drain()
+        small = {"timestamps": np.asarray(timestamps)[line_sel]}
+        if wavelengths is not None:
+            small["wavelengths"] = np.asarray(wavelengths)[band_sel]
+        for name, values in small.items():
+            with zf.open(f"{name}.npy", "w") as f:
+                np.lib.format.write_array(f, np.ascontiguousarray(values), allow_pickle=False)
+    yield sink.drain()
+
+
+def stream_arrow(data, timestamps, wavelengths, line_sel, band_sel, check=None, chunk_bytes=CHUNK_BYTES):
+    """Yield the bytes of an Arrow IPC stream of the selection, one record batch per chunk; see stream_npz."""
+    import pyarrow as pa
+
+    n_bands = len(range(*band_sel.indices(data.shape[2])))
+    frame = data.shape[0] * n_bands
+    metadata = {
+        "shape": json.dumps([len(range(*line_sel.indices(data.shape[1]))), data.shape[0], n_bands]),
+        "axes": "line, cross_track, band",
+    }
+    if wavelengths is not None:
+        metadata["wavelengths"] = json.dumps(np.asarray(wavelengths)[band_sel].tolist())
+    schema = pa.schema(
+        [("timestamp", pa.timestamp("ns", tz="UTC")), ("line", pa.list_(pa.from_numpy_dtype(data.dtype), frame))],
+        metadata=metadata,
+    )
+    timestamps = np.asarray(timestamps)[line_sel]
+    sink = _Sink()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for block, rows in _line_chunks(data, line_sel, band_sel, chunk_bytes):
+            if check is not None:
+                check()
+            lines = pa.FixedSizeListArray.from_arrays(pa.array(block.reshape(-1)), frame)
+            stamps = pa.array(timestamps[rows].astype(np.int64), type=pa.timestamp("ns", tz="UTC"))
+            writer.write_batch(pa.record_batch([stamps, lines], schema=schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+STREAMS = {"npz": stream_npz, "arrow": stream_arrow}
@@ -0,0 +1,79 @@
+"""
+Standalone DataCubes around existing arrays.
+
+The history, the acquisition client and cancelled captures all hand out
+cubes whose buffers are views or copies of another cube's arrays rather
+than freshly allocated ones.
+"""
+import numpy as np
+from openhsi.data import CircArrayBuffer, DataCube, DateTimeBuffer
+
+from indices import cube_wavelengths
+
+
+def wrap_buffer(data):
+    """Wrap an existing array in a CircArrayBuffer without reallocating it."""
+    buff = CircArrayBuffer.__new__(CircArrayBuffer)
+    buff.data = data
+    buff.size = data.shape
+    buff.axis = 1 if data.ndim > 1 else 0
+    buff.write_pos = [0 if i == buff.axis else slice(None) for i in range(data.ndim)]
+    buff.read_pos = buff.write_pos.copy()
+    buff.slots_left = 0
+    buff.show_func = None
+    return buff
+
+
+def standalone_cube(source, data, timestamps, temperatures=None, stride=1):
+    """A DataCube around existing arrays, with the settings and wavelengths of `source`.
+
+    `stride` is the step the arrays were taken from `source` with across
+    track and wavelength.
+    """
+    k = stride
+    wavelengths = cube_wavelengths(source)
+    binned = getattr(source, "binned_wavelengths", None)
+    if binned is not None and len(binned) != source.dc.data.shape[2]:
+        binned = None
+
+    cube = DataCube.__new__(DataCube)
+    cube.downsample = getattr(source, "downsample", 1) * k
+    cube.settings = dict(source.settings)
+    cube.n_lines = data.shape[1]
+    cube.proc_lvl = source.proc_lvl
+    cube.dc = wrap_buffer(data)
+    cube.dc_shape = data.shape
+    cube.timestamps = DateTimeBuffer(len(timestamps))
+    cube.timestamps.data = timestamps
+    cube.timestamps.count = len(timestamps)
+    if temperatures is not None:
+        cube.cam_temperatures = wrap_buffer(temperatures)
+    if binned is not None:
+        cube.binned_wavelengths = binned[::k]
+    cube.calibration = {} if wavelengths is None else {"wavelengths": wavelengths[::k]}
+    cube.nc = None
+    return cube
+
+
+def truncated(cube, count, start, ts_start=None, temp_start=None):
+    """DataCube of the `count` lines of `cube` written from `start`, e.g. those of a cancelled capture.
+
+    The timestamp and temperature buffers keep their own write positions,
+    given by `ts_start` and `temp_start` (default `start`). The arrays are
+    views of the cube's buffers when the lines are contiguous in them,
+    otherwise a copy of just those lines.
+    """
+
+    def lines(data, axis, i0):
+        n = data.shape[axis]
+        if i0 + count <= n:
+            return data[(slice(None),) * axis + (slice(i0, i0 + count),)]
+        return np.take(data, (i0 + np.arange(count)) % n, axis=axis)
+
+    temps = getattr(cube, "cam_temperatures", None)
+    return standalone_cube(
+        cube,
+        lines(cube.dc.data, 1, start),
+        lines(cube.timestamps.data, 0, start if ts_start is None else ts_start),
+        None if temps is None else lines(temps.data, 0, start if temp_start is None else temp_start),
+    )
@@ -0,0 +1,195 @@
+"""
+Batch deletion in the data directory, run as a background job.
+
+A deletion takes either a list of paths (files, or folders deleted with
+everything in them) or a filter: a glob pattern and/or a modification date
+range, applied to every file under a folder. Matching files are found with
+os.scandir, which gets their sizes without a stat per file, then deleted one
+by one so the job can report progress and the bytes freed. Listed folders
+are removed with their contents; a filter removes the folders it empties
+below the folder it searched.
+
+Every path is resolved against the data directory and refused if it leads
+outside it; symbolic links are deleted, never followed.
+"""
+import datetime
+import fnmatch
+import os
+import time
+
+# Paths listed in a job result (failed deletions, dry-run matches); the rest are only counted.
+MAX_LISTED = 100
+# Seconds between progress updates.
+REPORT_INTERVAL_S = 0.25
+
+
+class OutsideDataDir(ValueError):
+    """A path leads outside the data directory."""
+
+
+def within(data_dir, path):
+    return path == data_dir or path.startswith(data_dir + os.sep)
+
+
+def resolve(data_dir, rel_path):
+    """Absolute path of `rel_path` in the data directory; raises OutsideDataDir if it escapes it."""
+    path = os.path.abspath(os.path.join(data_dir, rel_path))
+    if not within(data_dir, path):
+        raise OutsideDataDir(f"'{rel_path}' is outside the data directory")
+    return path
+
+
+def parse_time(text, name):
+    """Epoch seconds of an ISO date or date-time (local time), or None."""
+    if not text:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(text).timestamp()
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be an ISO date such as 2024-05-31 or 2024-05-31T12:00")
+
+
+class Selection:
+    """The files a batch job works on (see also reprocess.py); built from the request and validated before the job starts."""
+
+    def __init__(self, data_dir, paths=None, folder="", pattern=None, before=None, after=None):
+        self.data_dir = os.path.abspath(data_dir)
+        self.paths = [resolve(self.data_dir, p) for p in paths or []]
+        if self.data_dir in self.paths:
+            raise ValueError("Cannot delete the data directory itself")
+        self.folder = resolve(self.data_dir, folder or "")
+        self.pattern = pattern or None
+        self.before = parse_time(before, "before")
+        self.after = parse_time(after, "after")
+        self.filtered = any(v is not None for v in (self.pattern, self.before, self.after))
+        if bool(self.paths) == self.filtered:
+            raise ValueError("Give either a list of paths or a filter (glob, before, after)")
+
+    def matches(self, entry, mtime):
+        if self.before is not None and mtime >= self.before:
+            return False
+        if self.after is not None and mtime < self.after:
+            return False
+        if self.pattern is not None:
+            rel = os.path.relpath(entry.path, self.data_dir)
+            # Patterns without a folder match the file name anywhere, like .gitignore.
+            target = rel if "/" in self.pattern else entry.name
+            if not fnmatch.fnmatch(target, self.pattern):
+                return False
+        return True
+
+    def scan(self, progress=None):
+        """(files as [(path, size)], folders to remove once empty), found with os.scandir.
+
+        `progress(n_files, n_bytes)` is called every REPORT_INTERVAL_S seconds.
+        """
+        files, folders = [], []
+        n_bytes, last = 0, time.monotonic()
+        # (directory, whether everything in it goes)
+        stack = []
+        if self.filtered:
+            stack.append((self.folder, False))
+        for path in self.paths:
+            if os.path.isdir(path) and not os.path.islink(path):
+                stack.append((path, True))
+                folders.append(path)
+            elif os.path.lexists(path):
+                files.append((path, os.lstat(path).st_size))
+                n_bytes += files[-1][1]
+        while stack:
+            directory, everything = stack.pop()
+            try:
+                it = os.scandir(directory)
+            except OSError:
+                continue
+            with it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append((entry.path, everything))
+                            if everything:
+                                folders.append(entry.path)
+                            continue
+                        st = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    if everything or self.matches(entry, st.st_mtime):
+                        files.append((entry.path, st.st_size))
+                        n_bytes += st.st_size
+            if progress and time.monotonic() - last >= REPORT_INTERVAL_S:
+                progress(len(files), n_bytes)
+                last = time.monotonic()
+        return files, folders
+
+
+def remove_empty(folders, stop=None):
+    """rmdir each of `folders` that is empty, deepest first; returns those removed.
+
+    With `stop`, the parents of a removed folder are removed too while they
+    are empty, up to but not including `stop`.
+    """
+    removed = []
+    for folder in sorted(set(folders), key=lambda p: p.count(os.sep), reverse=True):
+        while folder != stop:
+            try:
+                os.rmdir(folder)
+            except OSError:
+                break
+            removed.append(folder)
+            if stop is None or not within(stop, os.path.dirname(folder)):
+                break
+            folder = os.path.dirname(folder)
+    return removed
+
+
+def run_deletion(job, selection, forget, dry_run=False):
+    """Job body: delete what `selection` matches, calling `forget(path)` for each file and folder removed."""
+    data_dir = selection.data_dir
+    job.update(phase="scanning", files=0, bytes=0)
+    files, folders = selection.scan(lambda n, b: job.update(files=n, bytes=b))
+    total_bytes = sum(size for _, size in files)
+    job.update(phase="deleting", current=0, total=len(files), files=len(files), bytes=total_bytes, freed_bytes=0)
+    if dry_run:
+        return {
+            "dry_run": True,
+            "files": len(files),
+            "bytes": total_bytes,
+            "paths": [os.path.relpath(p, data_dir) for p, _ in files[:MAX_LISTED]],
+        }
+
+    deleted, freed, errors, n_errors, done = 0, 0, [], 0, 0
+    t0 = last = time.monotonic()
+    for path, size in files:
+        if job.cancelled:
+            break
+        done += 1
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass  # already gone, e.g. pruned by retention
+        except OSError as e:
+            n_errors += 1
+            if len(errors) < MAX_LISTED:
+                errors.append({"path": os.path.relpath(path, data_dir), "error": e.strerror or str(e)})
+            continue
+        else:
+            deleted += 1
+            freed += size
+        forget(path)
+        if selection.filtered:
+            folders.append(os.path.dirname(path))
+        if time.monotonic() - last >= REPORT_INTERVAL_S:
+            last = time.monotonic()
+            job.update(current=done, freed_bytes=freed, rate=done / (last - t0))
+    elapsed = time.monotonic() - t0
+    job.update(current=done, freed_bytes=freed, rate=done / elapsed if elapsed else 0)
+    removed = remove_empty(folders, stop=selection.folder if selection.filtered else None)
+    for folder in removed:
+        forget(folder)
+    return {
+        "deleted": deleted,
+        "freed_bytes": freed,
+        "failed": n_errors,
+        "errors": errors,
+        "removed_folders": [os.path.relpath(p, data_dir) for p in removed],
+    }
@@ -0,0 +1,139 @@
+"""
+In-memory history of recent captures.
+
+When a camera starts a new capture, the cube of its previous one is moved
+into the history instead of being overwritten, so it can still be shown,
+probed or saved by its capture id (the start time of the capture in ns, as
+reported by /api/history).
+
+Local cameras hand over their buffers and are given fresh ones, so archiving
+costs no copy; cubes of remote cameras are copied out of shared memory. The
+history is bounded by a number of captures and a memory budget, evicting the
+least recently used capture first. A cube larger than the whole budget is
+kept downsampled (every k-th cross-track pixel and band, all lines), which
+is enough to show and probe it but not to save it.
+"""
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from cubes import standalone_cube
+
+
+class UnknownCapture(Exception):
+    """The capture id is neither the latest capture nor kept in the history."""
+
+
+def take_array(buffer, copy):
+    """The array of `buffer`, copied, or moved out and replaced by a zeroed one."""
+    data = buffer.data
+    if copy:
+        return data.copy()
+    buffer.data = np.zeros(data.shape, dtype=data.dtype)  # lazily zeroed, no page touched yet
+    return data
+
+
+def snapshot(cube, capture_id, copy=True, max_bytes=None):
+    """A standalone DataCube holding the capture currently in `cube`.
+
+    Without `copy` the cube's buffers are moved into the snapshot. A cube
+    larger than `max_bytes` is downsampled to fit, which always copies.
+    """
+    data = cube.dc.data
+    k = 1
+    if max_bytes and data.nbytes > max_bytes:
+        k = math.ceil(math.sqrt(data.nbytes / max_bytes))
+        data = np.ascontiguousarray(data[::k, :, ::k])
+    else:
+        data = take_array(cube.dc, copy)
+    temps = getattr(cube, "cam_temperatures", None)
+    snap = standalone_cube(
+        cube,
+        data,
+        take_array(cube.timestamps, copy or k > 1),
+        None if temps is None else take_array(temps, copy or k > 1),
+        stride=k,
+    )
+    snap.capture_id = capture_id
+    if not copy:
+        cube.nc = None  # the quicklook dataset still points at the old buffers
+    return snap
+
+
+def snapshot_bytes(snap):
+    nbytes = snap.dc.data.nbytes + snap.timestamps.data.nbytes
+    if hasattr(snap, "cam_temperatures"):
+        nbytes += snap.cam_temperatures.data.nbytes
+    return nbytes
+
+
+class CaptureHistory:
+    """LRU of capture snapshots keyed by (camera id, capture id), bounded by count and bytes."""
+
+    def __init__(self, max_bytes, max_entries):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.used_bytes = 0
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0 and self.max_entries > 0
+
+    def archive(self, cam_id, capture_id, cube, copy=True):
+        """Keep the capture held by `cube`; see snapshot(). Returns the snapshot, or None if disabled."""
+        if not self.enabled:
+            return None
+        with self.lock:
+            if (cam_id, capture_id) in self.entries:
+                return self.entries[(cam_id, capture_id)]
+        snap = snapshot(cube, capture_id, copy=copy, max_bytes=self.max_bytes)
+        nbytes = snapshot_bytes(snap)
+        with self.lock:
+            while self.entries and (
+                len(self.entries) >= self.max_entries or self.used_bytes + nbytes > self.max_bytes
+            ):
+                _, evicted = self.entries.popitem(last=False)
+                self.used_bytes -= snapshot_bytes(evicted)
+            self.entries[(cam_id, capture_id)] = snap
+            self.used_bytes += nbytes
+        return snap
+
+    def get(self, cam_id, capture_id):
+        with self.lock:
+            snap = self.entries.get((cam_id, capture_id))
+            if snap is not None:
+                self.entries.move_to_end((cam_id, capture_id))
+            return snap
+
+    def describe(self, cam_id=None):
+        """The kept captures, newest first, optionally of one camera."""
+        with self.lock:
+            items = list(self.entries.items())
+        captures = []
+        for (cid, capture_id), snap in sorted(items, key=lambda item: item[0][1], reverse=True):
+            if cam_id is not None and cid != cam_id:
+                continue
+            captures.append(
+                {
+                    "id": str(capture_id),  # ns timestamps exceed the integers JSON readers keep exact
+                    "camera": cid,
+                    "start": str(snap.timestamps.data.min()),
+                    "shape": list(snap.dc.data.shape),
+                    "bytes": snapshot_bytes(snap),
+                    "downsample": snap.downsample,
+                }
+            )
+        return captures
+
+    def usage(self):
+        with self.lock:
+            return {
+                "captures": len(self.entries),
+                "used_bytes": self.used_bytes,
+                "max_bytes": self.max_bytes,
+                "max_captures": self.max_entries,
+            }
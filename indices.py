@@ -0,0 +1,195 @@
+"""
+Spectral index products (NDVI, NDWI and custom band ratios) over a datacube.
+
+Formulas are arithmetic expressions over bands named by wavelength:
+
+    R670        the band nearest 670 nm
+    R640_680    the mean of the bands between 640 and 680 nm
+
+with numbers, + - * / ** and parentheses, e.g. "(R800 - R670) / (R800 + R670)".
+An expression is parsed once into a function of the band images, then
+evaluated as NumPy operations over chunks of along-track lines, so the
+temporaries never hold more than a chunk of the bands it reads.
+
+Results are (cross-track, along-track) float32 arrays in the same orientation
+as the /api/show quicklook, cached per capture so re-rendering with another
+colour map or range does not recompute them.
+"""
+import ast
+import operator
+import re
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import matplotlib
+import numpy as np
+from PIL import Image
+
+# name: (formula, colour map, (vmin, vmax))
+INDICES = {
+    "ndvi": ("(R780_850 - R640_680) / (R780_850 + R640_680)", "RdYlGn", (-1, 1)),
+    "ndwi": ("(R540_570 - R780_850) / (R540_570 + R780_850)", "BrBG", (-1, 1)),
+}
+# Default colour map of custom expressions, scaled to their 2-98 percentile range.
+CUSTOM_CMAP = "viridis"
+ROBUST_PERCENT = 2
+# Upper bound on the float32 band data read per chunk of lines.
+CHUNK_BYTES = 16 * 2**20
+# Bands further than this outside the calibrated range are an error rather than the edge band.
+BAND_TOLERANCE_NM = 10
+# Computed index arrays kept across requests.
+CACHE_BYTES = 256 * 2**20
+
+BAND_NAME = re.compile(r"^R(\d+)(?:_(\d+))?$")
+OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.Pow: operator.pow,
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+
+
+def cube_wavelengths(cam):
+    """Wavelength (nm) of each band of the datacube, or None without a calibration."""
+    n_bands = cam.dc.data.shape[2]
+    wavelengths = getattr(cam, "binned_wavelengths", None)
+    if wavelengths is None or len(wavelengths) != n_bands:
+        # Unbinned cubes: the calibration gives the wavelength of each column.
+        wavelengths = getattr(cam, "calibration", {}).get("wavelengths")
+        if wavelengths is None or len(wavelengths) < n_bands // 2:
+            return None
+    wavelengths = np.asarray(wavelengths, dtype=np.float64)[:n_bands]
+    if len(wavelengths) < n_bands:
+        # The last columns past the calibrated width: extrapolate the spacing.
+        step = wavelengths[-1] - wavelengths[-2]
+        wavelengths = np.concatenate([wavelengths, wavelengths[-1] + step * np.arange(1, n_bands - len(wavelengths) + 1)])
+    return wavelengths
+
+
+def band_slice(wavelengths, lo, hi):
+    """Contiguous slice of the bands between lo and hi nm, or the nearest band."""
+    i0, i1 = np.searchsorted(wavelengths, lo, side="left"), np.searchsorted(wavelengths, hi, side="right")
+    if i1 > i0:
+        return slice(int(i0), int(i1))
+    mid = (lo + hi) / 2
+    if not wavelengths[0] - BAND_TOLERANCE_NM <= mid <= wavelengths[-1] + BAND_TOLERANCE_NM:
+        raise ValueError(f"No band near {mid:g} nm (cube covers {wavelengths[0]:.0f}-{wavelengths[-1]:.0f} nm)")
+    i = int(np.abs(wavelengths - mid).argmin())
+    return slice(i, i + 1)
+
+
+def compile_formula(formula, wavelengths):
+    """Parse `formula` into (band slices, function of the band images).
+
+    Raises ValueError for anything but arithmetic over band names and numbers.
+    """
+    try:
+        tree = ast.parse(formula, mode="eval")
+    except SyntaxError as e:
+        raise ValueError(f"Invalid expression: {e.msg}")
+    bands = {}
+
+    def build(node):
+        if isinstance(node, ast.Expression):
+            return build(node.body)
+        if isinstance(node, ast.BinOp) and type(node.op) in OPERATORS:
+            op, left, right = OPERATORS[type(node.op)], build(node.left), build(node.right)
+            return lambda b: op(left(b), right(b))
+        if isinstance(node, ast.UnaryOp) and type(node.op) in OPERATORS:
+            op, operand = OPERATORS[type(node.op)], build(node.operand)
+            return lambda b: op(operand(b))
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            value = np.float32(node.value)
+            return lambda b: value
+        if isinstance(node, ast.Name):
+            match = BAND_NAME.match(node.id)
+            if not match:
+                raise ValueError(f"Unknown name '{node.id}': use R<nm> or R<lo>_<hi>")
+            lo = float(match.group(1))
+            hi = float(match.group(2) or lo)
+            bands[node.id] = band_slice(wavelengths, min(lo, hi), max(lo, hi))
+            return lambda b, name=node.id: b[name]
+        raise ValueError(f"Unsupported expression element: {type(node).__name__}")
+
+    return bands, build(tree)
+
+
+def compute_index(cube, wavelengths, formula, chunk_bytes=CHUNK_BYTES):
+    """Evaluate `formula` over a (cross-track, along-track, band) cube; returns (cross-track, along-track) float32."""
+    bands, evaluate = compile_formula(formula, wavelengths)
+    rows, n_lines = cube.shape[:2]
+    band_width = sum(s.stop - s.start for s in bands.values()) or 1
+    chunk = max(1, chunk_bytes // (4 * rows * band_width))
+    out = np.empty((rows, n_lines), dtype=np.float32)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        for i0 in range(0, n_lines, chunk):
+            block = cube[:, i0 : i0 + chunk]
+            images = {name: block[..., s].mean(axis=-1, dtype=np.float32) for name, s in bands.items()}
+            result = evaluate(images)
+            out[:, i0 : i0 + chunk] = result
+    out[~np.isfinite(out)] = np.nan
+    return out
+
+
+def resolve(name, expr=None):
+    """(formula, colour map, value range or None) of a named index or a custom expression."""
+    name = name.lower()
+    if name == "custom":
+        if not expr:
+            raise ValueError("The custom index needs an expression (expr)")
+        return expr, CUSTOM_CMAP, None
+    if name not in INDICES:
+        raise KeyError(name)
+    return INDICES[name]
+
+
+def render_index(values, cmap, vrange=None):
+    """Colour-mapped PNG of an index array; NaNs are transparent."""
+    if vrange is None:
+        finite = values[np.isfinite(values)]
+        vrange = np.percentile(finite, (ROBUST_PERCENT, 100 - ROBUST_PERCENT)) if finite.size else (0, 1)
+    vmin, vmax = vrange
+    scaled = (values - vmin) / ((vmax - vmin) or 1)
+    rgba = matplotlib.colormaps[cmap](np.nan_to_num(scaled, nan=0), bytes=True)
+    rgba[..., 3] = np.where(np.isnan(values), 0, 255)
+    buf = BytesIO()
+    Image.fromarray(rgba).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def to_npy(values):
+    buf = BytesIO()
+    np.save(buf, values)
+    return buf.getvalue()
+
+
+class IndexCache:
+    """LRU of computed index arrays, bounded by their total size in bytes."""
+
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self.entries[key] = value
+            self.nbytes += value.nbytes
+            while self.nbytes > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
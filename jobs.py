@@ -0,0 +1,127 @@
+"""
+Background jobs over files in the data directory, e.g. batch deletion.
+
+A job runs on its own thread and reports progress through Job.update, which
+/api/jobs/<id> returns as is. Jobs check Job.cancelled between files, so a
+cancel takes effect after the file in hand. Finished jobs are kept for
+inspection until more than `keep_finished` of them have piled up.
+"""
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+
+class Job:
+    def __init__(self, job_id, kind, params):
+        self.id = job_id
+        self.kind = kind
+        self.params = params
+        self.state = QUEUED
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_event = threading.Event()
+        self.lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    @property
+    def active(self):
+        return self.state in (QUEUED, RUNNING)
+
+    def update(self, **progress):
+        with self.lock:
+            self.progress.update(progress)
+
+    def describe(self):
+        with self.lock:
+            elapsed = ((self.finished or time.time()) - self.started) if self.started else 0
+            return {
+                "id": self.id,
+                "kind": self.kind,
+                "state": self.state,
+                "params": self.params,
+                "progress": dict(self.progress),
+                "result": self.result,
+                "error": self.error,
+                "created": self.created,
+                "elapsed": elapsed,
+            }
+
+
+class JobManager:
+    """Runs jobs on background threads and keeps their state, newest last."""
+
+    def __init__(self, keep_finished=50):
+        self.keep_finished = keep_finished
+        self.jobs = OrderedDict()
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        # Called with each job once it has ended, e.g. to log it.
+        self.on_finish = None
+
+    def submit(self, kind, run, params=None, exclusive=False):
+        """Start `run(job)` on a new thread; its return value becomes the job's result.
+
+        With `exclusive`, returns None instead while a job of the same kind is active.
+        """
+        with self.lock:
+            if exclusive and any(job.active and job.kind == kind for job in self.jobs.values()):
+                return None
+            job = Job(str(next(self.ids)), kind, params or {})
+            self.jobs[job.id] = job
+            self._trim()
+        threading.Thread(target=self._run, args=(job, run), name=f"openhsi-job-{job.id}", daemon=True).start()
+        return job
+
+    def _run(self, job, run):
+        with job.lock:
+            job.state = RUNNING
+            job.started = time.time()
+        try:
+            result = run(job)
+            state, error = (CANCELLED if job.cancelled else DONE), None
+        except Exception as e:
+            result, state, error = None, FAILED, str(e)
+        with job.lock:
+            job.result = result
+            job.state = state
+            job.error = error
+            job.finished = time.time()
+        if self.on_finish:
+            self.on_finish(job)
+
+    def _trim(self):
+        finished = [job_id for job_id, job in self.jobs.items() if not job.active]
+        for job_id in finished[: max(0, len(finished) - self.keep_finished)]:
+            del self.jobs[job_id]
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def running(self, kind=None):
+        """Active jobs, optionally of one kind."""
+        with self.lock:
+            return [job for job in self.jobs.values() if job.active and (kind is None or job.kind == kind)]
+
+    def cancel(self, job_id):
+        """Ask a job to stop. Returns False for unknown or ended jobs."""
+        job = self.get(job_id)
+        if job is None or not job.active:
+            return False
+        job.cancel_event.set()
+        return True
+
+    def describe(self, kind=None):
+        with self.lock:
+            jobs = list(self.jobs.values())
+        return [job.describe() for job in reversed(jobs) if kind is None or job.kind == kind]
@@ -0,0 +1,75 @@
+"""
+Low-resolution preview captures for framing a scene.
+
+A preview grabs a short burst of raw frames and reduces each one as it
+arrives: the cross-track rows inside row_slice are averaged in blocks of
+`binning`, and the spectral columns into `n_bands` equal-width bands. The
+result is a small float32 cube (lines, rows, bands) that is cheap to fill and
+to render, kept apart from the camera's datacube so the last full capture
+and the operator's settings are never touched.
+"""
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+# Defaults for a preview: enough lines to judge framing and focus.
+PREVIEW_LINES = 128
+PREVIEW_BINNING = 4
+PREVIEW_BANDS = 16
+# Wavelength ranges (nm) averaged into the red, green and blue channels, as in DataCube.show.
+RGB_NM = ((640, 670), (530, 590), (450, 510))
+
+
+def band_edges(wavelengths, n_cols, n_bands):
+    """Column indices splitting the spectral axis into `n_bands` bands, and their centre wavelengths.
+
+    Without a wavelength calibration the columns are split evenly and the
+    centres are column indices.
+    """
+    if wavelengths is None or len(wavelengths) < 2:
+        edges = np.linspace(0, n_cols, n_bands + 1).astype(int)
+        return edges, (edges[:-1] + edges[1:]) / 2
+    wavelengths = np.asarray(wavelengths, dtype=np.float64)[:n_cols]
+    λ = np.linspace(wavelengths[0], wavelengths[-1], n_bands + 1)
+    edges = np.searchsorted(wavelengths, λ)
+    edges[-1] = len(wavelengths)
+    return edges, np.round((λ[:-1] + λ[1:]) / 2, 1)
+
+
+class PreviewReducer:
+    """Reduces raw frames to (rows // binning, n_bands) float32 lines."""
+
+    def __init__(self, row_slice, n_cols, wavelengths, binning=PREVIEW_BINNING, n_bands=PREVIEW_BANDS):
+        r0, r1 = row_slice
+        self.binning = max(1, int(binning))
+        self.n_rows = (r1 - r0) // self.binning
+        # Drop the remainder rows so every block has the same size.
+        self.rows = slice(r0, r0 + self.n_rows * self.binning)
+        edges, self.band_centres = band_edges(wavelengths, n_cols, n_bands)
+        self.starts = edges[:-1]
+        self.stop = int(edges[-1])
+        # Block average = band sum / (binning * band width).
+        self.scale = np.float32(1) / (self.binning * np.maximum(np.diff(edges), 1)).astype(np.float32)
+
+    def __call__(self, frame, out):
+        x = np.add.reduceat(frame[self.rows, : self.stop], self.starts, axis=1, dtype=np.float32)
+        np.multiply(x.reshape(self.n_rows, self.binning, -1).sum(axis=1), self.scale, out=out)
+        return out
+
+
+def render_preview(cube, band_centres, robust=2):
+    """PNG of a preview cube (lines, rows, bands): RGB from the bands in RGB_NM, cross-track down the page."""
+    band_centres = np.asarray(band_centres)
+    channels = []
+    for lo, hi in RGB_NM:
+        sel = (band_centres >= lo) & (band_centres <= hi)
+        if not sel.any():  # bands wider than the range: take the nearest one
+            sel = np.abs(band_centres - (lo + hi) / 2) == np.abs(band_centres - (lo + hi) / 2).min()
+        channels.append(cube[..., sel].mean(axis=-1))
+    rgb = np.stack(channels, axis=-1).transpose(1, 0, 2)
+    vmin, vmax = np.nanpercentile(rgb, (robust, 100 - robust))
+    scaled = np.clip((rgb - vmin) / ((vmax - vmin) or 1), 0, 1)
+    buf = BytesIO()
+    Image.fromarray(np.uint8(scaled * 255)).save(buf, format="PNG")
+    return buf.getvalue()
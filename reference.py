@@ -0,0 +1,166 @@
+"""
+Dark-frame and flat-field references for openhsiCamera.
+
+A reference is the mean of a burst of raw frames from `get_img`, accumulated
+one frame at a time so the burst never has to fit in memory. References are
+only valid for the sensor settings they were taken with, so they are stored
+per (camera calibration, exposure_ms, binxy, pixel_format): changing the
+exposure switches to the matching pair, or to no correction at all if none
+was taken yet.
+
+References are kept in memory and written as `.npy` files to a directory
+($OPENHSI_REFERENCE_DIR, by default ~/.cache/openhsi/references), so they
+survive restarts.
+"""
+import os
+import threading
+
+import numpy as np
+
+REFERENCE_KINDS = ("dark", "flat")
+
+
+def reference_key(cam):
+    """Key of the references that apply to the current settings of `cam`."""
+    s = cam.settings
+    return (
+        cam.calibration_hash,
+        float(s.get("exposure_ms", 0)),
+        tuple(int(v) for v in s.get("binxy", ())),
+        str(s.get("pixel_format")),
+    )
+
+
+def describe_key(key):
+    calibration_hash, exposure_ms, binxy, pixel_format = key
+    return {"exposure_ms": exposure_ms, "binxy": list(binxy), "pixel_format": pixel_format}
+
+
+def streaming_mean(frames, n_frames):
+    """Mean of the first `n_frames` frames of the iterable `frames`, one frame at a time."""
+    acc = None
+    count = 0
+    for frame in frames:
+        if acc is None:
+            acc = np.zeros(np.shape(frame), dtype=np.float64)
+        np.add(acc, frame, out=acc)
+        count += 1
+        if count == n_frames:
+            break
+    if not count:
+        raise ValueError("No frames to average")
+    return (acc / count).astype(np.float32)
+
+
+class ReferenceStore:
+    """Dark and flat references in memory, backed by a directory of .npy files."""
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self.entries = {}
+        # Bumped on every change, so cameras know when to rebuild their correction.
+        self.version = 0
+        self.lock = threading.Lock()
+
+    def get(self, kind, key):
+        with self.lock:
+            if (kind, key) in self.entries:
+                return self.entries[(kind, key)]
+        frame = self._load(kind, key)
+        if frame is not None:
+            with self.lock:
+                self.entries[(kind, key)] = frame
+        return frame
+
+    def put(self, kind, key, frame):
+        frame = np.asarray(frame, dtype=np.float32)
+        with self.lock:
+            self.entries[(kind, key)] = frame
+            self.version += 1
+        self._save(kind, key, frame)
+
+    def delete(self, kind, key):
+        """Forget a reference. Returns True if there was one."""
+        with self.lock:
+            found = self.entries.pop((kind, key), None) is not None
+            self.version += 1
+        path = self._path(kind, key)
+        if path and os.path.exists(path):
+            os.remove(path)
+            found = True
+        return found
+
+    # On-disk tier --------------------------------------------------------
+    def _path(self, kind, key):
+        if not self.cache_dir:
+            return None
+        calibration_hash, exposure_ms, binxy, pixel_format = key
+        binning = "x".join(str(v) for v in binxy)
+        return os.path.join(
+            self.cache_dir,
+            f"{kind}-{(calibration_hash or 'nocal')[:12]}-{exposure_ms:g}ms-bin{binning}-{pixel_format}.npy",
+        )
+
+    def _save(self, kind, key, frame):
+        path = self._path(kind, key)
+        if not path:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+        np.save(tmp_path, frame)
+        os.replace(tmp_path, path)
+
+    def _load(self, kind, key):
+        path = self._path(kind, key)
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            return np.load(path, allow_pickle=False).astype(np.float32, copy=False)
+        except (OSError, ValueError):
+            return None
+
+
+def correction_terms(dark, flat):
+    """Offset and gain that turn a raw frame into (x - dark) * gain.
+
+    The gain normalises the dark-subtracted flat to its mean response. Pixels
+    that see no light in the flat (outside the used rows, dead pixels) keep a
+    gain of 1 rather than being amplified.
+    """
+    gain = None
+    if flat is not None:
+        response = flat - dark if dark is not None else flat.copy()
+        lit = response > 1
+        gain = np.ones_like(response, dtype=np.float32)
+        if lit.any():
+            gain[lit] = response[lit].mean() / response[lit]
+    return dark, gain
+
+
+def apply_correction(x, dark, gain, work=None, out=None):
+    """(x - dark) * gain, rounded and clipped back to the dtype of `x`.
+
+    `x` may be a single frame or a stack of frames. `work` (float32) and `out`
+    are optional preallocated buffers of the same shape as `x`.
+    """
+    if work is None:
+        work = np.empty(x.shape, dtype=np.float32)
+    if dark is not None:
+        np.subtract(x, dark, out=work)
+    else:
+        np.copyto(work, x, casting="unsafe")
+    if gain is not None:
+        np.multiply(work, gain, out=work)
+    if np.issubdtype(x.dtype, np.integer):
+        np.rint(work, out=work)
+        np.clip(work, 0, np.iinfo(x.dtype).max, out=work)
+    if out is None:
+        out = np.empty(x.shape, dtype=x.dtype)
+    np.copyto(out, work, casting="unsafe")
+    return out
+
+
+reference_store = ReferenceStore(
+    cache_dir=os.environ.get("OPENHSI_REFERENCE_DIR")
+    or os.path.join(os.path.expanduser("~"), ".cache", "openhsi", "references")
+)
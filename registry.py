@@ -0,0 +1,239 @@
+"""
+Registry of the cameras served by one controller.
+
+Dual-sensor rigs used to need one service per camera. The registry holds every
+camera together with the state of its capture thread (running flag, progress,
+processing phase), so each camera can be driven independently under
+/api/cameras/<id>/... while the original single-camera endpoints keep using the
+first (default) camera.
+
+Cameras are listed in a JSON config file:
+
+    {
+        "cameras": [
+            {"id": "vnir", "json_path": "...", "cal_path": "...", "backend": "flir"},
+            {"id": "swir", "acquisition_address": "/tmp/openhsi-swir.sock"}
+        ]
+    }
+
+Optional per-camera keys are label, backend, n_lines, exposure_ms, processing_lvl,
+save_dir (defaults to <data dir>/<id>), acquisition_address and acquisition_prefix
+for cameras run by their own acquisition process, and camera_kwargs, which is
+passed on to the camera class.
+"""
+import json
+import threading
+
+import numpy as np
+
+from acquisition import DEFAULT_PREFIX, AcquisitionClient
+from camera import get_camera_class
+
+# Ids that would collide with routes under /api/cameras/.
+RESERVED_IDS = ("capture_all",)
+
+
+class CameraEntry:
+    """A camera and the state of its capture thread."""
+
+    def __init__(self, cam_id, cam, save_dir, label=None, backend=None):
+        self.id = cam_id
+        self.cam = cam
+        self.save_dir = save_dir
+        self.label = label or cam_id
+        self.backend = backend
+        self.lock = threading.Lock()
+        self.running = False
+        self.finished = False
+        self.phase = None
+        self.progress = {}
+        self.processing = {}
+        self.started_ns = None
+
+    @property
+    def remote(self):
+        """True when the camera is owned by a separate acquisition process."""
+        return isinstance(self.cam, AcquisitionClient)
+
+    @property
+    def capture_stamp(self):
+        """Start time (ns) of the latest capture, which identifies it."""
+        if self.remote:
+            return self.cam.header["start_ns"]
+        return self.started_ns
+
+    def begin(self):
+        """Mark a capture as started. Returns False if one is already running."""
+        with self.lock:
+            if self.running:
+                return False
+            self.running = True
+            self.finished = False
+            self.phase = "capturing"
+            self.progress = {}
+            self.processing = {}
+            return True
+
+    def end(self):
+        with self.lock:
+            self.running = False
+            self.finished = True
+            self.phase = None
+
+    def begin_task(self, phase):
+        """Reserve the camera for something other than a capture, e.g. a reference burst.
+
+        Unlike begin() this keeps the last capture. Returns False if the camera is busy.
+        """
+        with self.lock:
+            if self.running:
+                return False
+            self.running = True
+            self.phase = phase
+            return True
+
+    def end_task(self):
+        with self.lock:
+            self.running = False
+            self.phase = None
+
+    def set_phase(self, phase):
+        """Change the phase of the running capture, e.g. to "paused"."""
+        with self.lock:
+            if self.running:
+                self.phase = phase
+
+    def invalidate(self):
+        """Forget the last capture, e.g. after the buffers were reinitialised."""
+        with self.lock:
+            self.finished = False
+            self.started_ns = None
+
+    def update_progress(self, progress_info):
+        # Extract desired values from progress_info.
+        current = progress_info.get("n", 0)
+        total = progress_info.get("total", 0)
+        elapsed = progress_info.get("elapsed", 0)
+        rate = progress_info.get("rate", 0)
+        percentage = (current / total) * 100 if total else 0
+        progress = {
+            "current": current,
+            "total": total,
+            "elapsed": elapsed,
+            "rate": rate,
+            "percentage": percentage,
+        }
+        # Pipelined captures also report the grab queue.
+        for key in ("queue_depth", "overruns"):
+            if key in progress_info:
+                progress[key] = progress_info[key]
+        with self.lock:
+            if progress_info.get("phase") == "processing":
+                self.phase = "processing"
+                self.processing = progress
+            else:
+                self.progress = progress
+
+    def status(self):
+        """Capture status in the shape of the /api/status response."""
+        if self.remote:
+            return self.cam.status()
+        with self.lock:
+            return {
+                "capturing": self.running,
+                "finished": self.finished,
+                "phase": self.phase,
+                "progress": self.progress,
+                "processing": self.processing,
+            }
+
+    def line_rate(self):
+        """Line rate of the last finished capture from its timestamps, in Hz."""
+        if not self.status()["finished"]:
+            return None
+        ts = self.latest_cube().timestamps.data.astype(np.int64)
+        span = int(ts.max() - ts.min())
+        return (len(ts) - 1) * 1e9 / span if span > 0 else None
+
+    def latest_cube(self):
+        """The cube of the latest capture, truncated to the lines it stored if it was cancelled."""
+        cube = self.cam.truncated_cube()
+        if cube is None:
+            cube = self.cam.view() if self.remote else self.cam
+        return cube
+
+    def describe(self):
+        return {
+            "id": self.id,
+            "label": self.label,
+            "backend": self.backend,
+            "remote": self.remote,
+            "save_dir": self.save_dir,
+            "status": self.status(),
+        }
+
+
+class CameraRegistry:
+    """Ordered collection of CameraEntry objects; the first one is the default camera."""
+
+    def __init__(self):
+        self.entries = {}
+
+    def check_id(self, cam_id):
+        if cam_id in self.entries:
+            raise ValueError(f"Duplicate camera id '{cam_id}'")
+        if not cam_id or cam_id in RESERVED_IDS or "/" in cam_id:
+            raise ValueError(f"Invalid camera id '{cam_id}'")
+
+    def add(self, cam_id, cam, save_dir, **kwargs):
+        self.check_id(cam_id)
+        self.entries[cam_id] = CameraEntry(cam_id, cam, save_dir, **kwargs)
+        return self.entries[cam_id]
+
+    def get(self, cam_id):
+        return self.entries.get(cam_id)
+
+    @property
+    def default(self):
+        return next(iter(self.entries.values()))
+
+    def __iter__(self):
+        return iter(list(self.entries.values()))
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def create_camera(config, default_backend="flir"):
+    """Build a camera (or acquisition client) from one entry of the cameras config."""
+    if config.get("acquisition_address"):
+        return AcquisitionClient(config["acquisition_address"], prefix=config.get("acquisition_prefix", DEFAULT_PREFIX))
+    camera_class = get_camera_class(config.get("backend", default_backend))
+    return camera_class(
+        n_lines=config.get("n_lines", 512),
+        exposure_ms=config.get("exposure_ms", 10),
+        processing_lvl=config.get("processing_lvl", -1),
+        json_path=config["json_path"],
+        cal_path=config["cal_path"],
+        **config.get("camera_kwargs", {}),
+    )
+
+
+def load_registry(config_path, data_dir, default_backend="flir"):
+    """Load every camera listed in the JSON config file at `config_path`."""
+    with open(config_path) as f:
+        config = json.load(f)
+    registry = CameraRegistry()
+    for cam_config in config["cameras"]:
+        cam_id = str(cam_config["id"])
+        registry.check_id(cam_id)  # before opening the camera
+        registry.add(
+            cam_id,
+            create_camera(cam_config, default_backend),
+            save_dir=cam_config.get("save_dir", f"{data_dir}/{cam_id}"),
+            label=cam_config.get("label"),
+            backend=None if cam_config.get("acquisition_address") else cam_config.get("backend", default_backend),
+        )
+    if not len(registry):
+        raise ValueError(f"No cameras listed in {config_path}")
+    return registry
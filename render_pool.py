@@ -0,0 +1,100 @@
+"""
+Bounded worker pool for expensive renders (the /api/show quicklook).
+
+- identical requests that arrive while a render is in flight share its result
+  (single-flight) instead of rendering again
+- renders run on a fixed number of worker threads with a bounded backlog;
+  once it is full, submit() raises Saturated and the caller answers 503
+- workers run at a lower OS scheduling priority (Linux)
+- while a capture is running, renders run one at a time and each starts at
+  least `capture_interval_s` after the previous one ended. Renders hold the
+  GIL for much of their time, which neither niceness nor a single worker
+  keeps away from collect; the pause between them does
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Added to the niceness of the render threads.
+RENDER_NICENESS = 10
+
+
+class Saturated(Exception):
+    """The render backlog is full."""
+
+
+def _lower_priority():
+    # Threads are scheduled individually on Linux, so this only affects the worker.
+    try:
+        tid = threading.get_native_id()
+        os.setpriority(os.PRIO_PROCESS, tid, os.getpriority(os.PRIO_PROCESS, tid) + RENDER_NICENESS)
+    except (AttributeError, OSError):
+        pass
+
+
+class RenderPool:
+    """Single-flight, bounded pool of render threads."""
+
+    def __init__(self, workers=1, max_queue=4, busy=None, capture_interval_s=0.0):
+        self.workers = workers
+        self.max_queue = max_queue
+        # Callable returning True while a capture is running.
+        self.busy = busy or (lambda: False)
+        # Minimum seconds from the end of one render to the start of the next while busy().
+        self.capture_interval_s = capture_interval_s
+        self.last_render = 0.0  # monotonic end of the last render while busy, under capture_gate
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="openhsi-render", initializer=_lower_priority)
+        self.inflight = {}
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.capture_gate = threading.Lock()
+        self.coalesced = 0
+        self.rejected = 0
+
+    def submit(self, key, fn):
+        """Future for the result of fn(), shared with any in-flight call for the same key.
+
+        Raises Saturated if every worker is busy and the backlog is full.
+        """
+        with self.lock:
+            future = self.inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future
+            if self.pending >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise Saturated()
+            self.pending += 1
+            future = self.executor.submit(self._run, fn)
+            self.inflight[key] = future
+        future.add_done_callback(lambda f: self._done(key, f))
+        return future
+
+    def _run(self, fn):
+        if not self.busy():
+            return fn()
+        with self.capture_gate:
+            delay = self.last_render + self.capture_interval_s - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                return fn()
+            finally:
+                self.last_render = time.monotonic()
+
+    def _done(self, key, future):
+        with self.lock:
+            self.pending -= 1
+            if self.inflight.get(key) is future:
+                del self.inflight[key]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "pending": self.pending,
+                "coalesced": self.coalesced,
+                "rejected": self.rejected,
+            }
@@ -0,0 +1,356 @@
+"""
+Reprocessing saved raw captures at a processing level, run as a background job.
+
+Once the calibration has been updated, captures saved raw (processing level
+-1, or 0 when cropped) can be run through the processing pipeline again. The
+files are fanned out over a pool of worker processes, one per core by
+default, at a lower scheduling priority so a running capture keeps its CPU.
+Each worker reads its file a chunk of lines at a time, so memory stays
+bounded however long the capture, and writes `<name>_lvl<k>.nc` next to it.
+Workers report the lines done over a queue, from which the job publishes the
+progress of each file and the overall throughput.
+
+Cubes were dark/flat corrected as they were captured, so only the pipeline
+is applied, not the correction. Saved files do not record their processing
+level (reprocessed ones do): a cube at the full sensor resolution is taken
+as level -1 and one cropped to row_slice as level 0; others are skipped.
+"""
+import contextlib
+import multiprocessing
+import os
+import queue
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+
+import netCDF4
+import numpy as np
+from openhsi.data import DataCube
+
+from camera import CaptureMixin
+from deletion import MAX_LISTED, REPORT_INTERVAL_S
+
+# Added to the niceness of the worker processes.
+WORKER_NICENESS = 10
+# Stems of reprocessed files, which are never taken as input.
+OUTPUT_STEM = re.compile(r"_lvl-?\d+$")
+# Units of the datacube by processing level, as DataCube.to_xarray writes them.
+LEVEL_UNITS = {4: "uW/cm^2/sr/nm", 5: "uW/cm^2/sr/nm", 7: "uW/cm^2/sr/nm", 6: "percentage reflectance", 8: "percentage reflectance"}
+
+
+class Cancelled(Exception):
+    """The job was cancelled while the file was being processed."""
+
+
+class Reprocessor(CaptureMixin, DataCube):
+    """The processing pipeline of a camera, without the camera."""
+
+    def load_calibration_data_from_netcdf(self, filename):
+        super().load_calibration_data_from_netcdf(filename)
+        # Only used to size the pipeline output (see DataCube.set_processing_lvl),
+        # and not every calibration file carries one.
+        if "flat_field_pic" not in self.calibration and "resolution" in self.settings:
+            self.calibration["flat_field_pic"] = np.zeros(self.settings["resolution"], dtype=np.uint16)
+
+
+def build_processor(json_path, cal_path, lvl):
+    return Reprocessor(n_lines=1, processing_lvl=lvl, json_path=json_path, cal_path=cal_path, warn_mem_use=False)
+
+
+def output_path(path, lvl):
+    return f"{os.path.splitext(path)[0]}_lvl{lvl}.nc"
+
+
+def is_output(path):
+    return bool(OUTPUT_STEM.search(os.path.splitext(os.path.basename(path))[0]))
+
+
+def source_level(shape, settings):
+    """Processing level of a saved (wavelength, x, y) cube: -1, 0, or None if it is neither."""
+    n_bands, n_rows = shape[:2]
+    rows, cols = settings["resolution"]
+    if n_bands != cols:
+        return None
+    if n_rows == rows:
+        return -1
+    if n_rows == int(np.ptp(settings["row_slice"])):
+        return 0
+    return None
+
+
+def inspect(path, settings):
+    """(lines, processing level) of the cube saved at `path`, as recorded by reprocessing or from its shape."""
+    with netCDF4.Dataset(path) as ds:
+        if "datacube" not in ds.variables:
+            raise ValueError("no datacube variable")
+        shape = ds["datacube"].shape
+        if "processing_lvl" in ds.ncattrs():
+            return shape[2], int(ds.getncattr("processing_lvl"))
+    return shape[2], source_level(shape, settings)
+
+
+# Worker processes ---------------------------------------------------------
+
+_worker = {}
+
+
+def _init_worker(progress, cancel):
+    try:
+        os.nice(WORKER_NICENESS)
+    except (AttributeError, OSError):
+        pass
+    _worker.update(progress=progress, cancel=cancel, processors={})
+
+
+def _processor(json_path, cal_path, lvl):
+    key = (json_path, cal_path, lvl)
+    if key not in _worker["processors"]:
+        _worker["processors"][key] = build_processor(json_path, cal_path, lvl)
+    return _worker["processors"][key]
+
+
+def _reverse_axes(a):
+    """a.transpose(2, 1, 0), made contiguous.
+
+    Done in two steps: a single copy whose innermost axis has the largest
+    stride is several times slower on cubes of this size.
+    """
+    return np.ascontiguousarray(np.ascontiguousarray(a.transpose(1, 2, 0)).transpose(1, 0, 2))
+
+
+def _copy_variable(ds_in, ds_out, name):
+    var = ds_in[name]
+    var.set_auto_maskandscale(False)
+    attrs = {k: var.getncattr(k) for k in var.ncattrs()}
+    out = ds_out.createVariable(name, var.dtype, var.dimensions, fill_value=attrs.pop("_FillValue", None))
+    out.set_auto_maskandscale(False)
+    out.setncatts(attrs)
+    out[...] = var[...]
+
+
+def _create_output(ds_in, ds_out, proc, lvl, src, cal_path):
+    """Define the reprocessed cube in `ds_out` and copy over the coordinates; returns its datacube variable."""
+    n_rows, _, n_bands = proc.dc_shape
+    wavelengths = getattr(proc, "binned_wavelengths", None)
+    if wavelengths is None or len(wavelengths) != n_bands:
+        wavelengths = np.arange(n_bands)
+    ds_out.setncatts({k: ds_in.getncattr(k) for k in ds_in.ncattrs()})
+    ds_out.setncatts({"processing_lvl": lvl, "source": os.path.basename(src), "calibration": os.path.basename(cal_path)})
+    sizes = {"wavelength": n_bands, "x": n_rows}
+    for name, dim in ds_in.dimensions.items():
+        ds_out.createDimension(name, sizes.get(name, len(dim)))
+    for name in ds_in.variables:
+        if name not in ("datacube", "wavelength", "x"):
+            _copy_variable(ds_in, ds_out, name)
+    for name, values in (("wavelength", wavelengths), ("x", np.arange(n_rows))):
+        var = ds_out.createVariable(name, np.asarray(values).dtype, (name,))
+        if name in ds_in.variables:
+            var.setncatts({k: ds_in[name].getncattr(k) for k in ds_in[name].ncattrs() if k != "_FillValue"})
+        var[:] = values
+    attrs = {k: ds_in["datacube"].getncattr(k) for k in ds_in["datacube"].ncattrs() if k != "_FillValue"}
+    attrs["units"] = LEVEL_UNITS.get(lvl, "digital number")
+    out = ds_out.createVariable("datacube", proc.dtype_out, ("wavelength", "x", "y"))
+    out.set_auto_maskandscale(False)
+    out.setncatts(attrs)
+    return out
+
+
+def reprocess_file(src, dst, lvl, src_lvl, json_path, cal_path):
+    """Worker body: write `src` processed to `lvl` at `dst`, a chunk of lines at a time.
+
+    Lines are stored innermost, so each chunk is read and written as one
+    hyperslab of up to `batch_bytes` of raw lines and processed in batches
+    bounded like process_deferred. Reports (src, lines done, lines, bytes
+    read) on the progress queue after each chunk. The output is written next
+    to `dst` and renamed into place once complete.
+    """
+    progress, cancel = _worker["progress"], _worker["cancel"]
+    proc = _processor(json_path, cal_path, lvl)
+    # A cube saved at level 0 is already cropped.
+    tfms = proc.tfm_list[1:] if src_lvl == 0 and proc.tfm_list[0] == proc.crop else proc.tfm_list
+    batchable = all(hasattr(proc, f"batch_{f.__name__}") for f in tfms)
+    partial = dst + ".partial"
+    t0 = time.perf_counter()
+    try:
+        with netCDF4.Dataset(src) as ds_in, netCDF4.Dataset(partial, "w") as ds_out:
+            cube = ds_in["datacube"]
+            cube.set_auto_maskandscale(False)
+            n_bands, n_rows, n_lines = cube.shape
+            out = _create_output(ds_in, ds_out, proc, lvl, src, cal_path)
+            line_bytes = n_rows * n_bands * cube.dtype.itemsize
+            chunk = max(1, proc.batch_bytes // line_bytes)
+            batch = max(1, proc.batch_bytes // (4 * n_rows * n_bands))
+            processed = np.empty((chunk,) + proc.dc_shape[::2], dtype=proc.dtype_out)
+            for i0 in range(0, n_lines, chunk):
+                i1 = min(i0 + chunk, n_lines)
+                # (lines, x, wavelength): a stack of raw frames
+                frames = _reverse_axes(cube[:, :, i0:i1])
+                for j0 in range(0, i1 - i0, batch):
+                    if cancel.is_set():
+                        raise Cancelled()
+                    x = frames[j0 : j0 + batch]
+                    if batchable:
+                        for f in tfms:
+                            x = getattr(proc, f"batch_{f.__name__}")(x)
+                    else:
+                        # Frame by frame transforms may return their scratch buffers, hence the copies.
+                        x = np.stack([np.array(proc._pipeline_from(tfms, frame)) for frame in x])
+                    processed[j0 : j0 + len(x)] = x
+                out[:, :, i0:i1] = _reverse_axes(processed[: i1 - i0])
+                progress.put((src, i1, n_lines, i1 * line_bytes))
+        os.replace(partial, dst)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(partial)
+        raise
+    return {"lines": n_lines, "bytes": n_lines * line_bytes, "elapsed": time.perf_counter() - t0}
+
+
+# Job ----------------------------------------------------------------------
+
+
+def plan(files, lvl, settings, overwrite=False):
+    """(tasks as [(src, dst, source level, lines)], skipped as [(src, reason)]) for the `files` selected."""
+    tasks, skipped = [], []
+    for path, _ in sorted(files):
+        if not path.endswith(".nc") or is_output(path):
+            continue
+        dst = output_path(path, lvl)
+        if os.path.exists(dst) and not overwrite:
+            skipped.append((path, f"{os.path.basename(dst)} exists"))
+            continue
+        try:
+            n_lines, src_lvl = inspect(path, settings)
+        except (OSError, ValueError) as e:
+            skipped.append((path, f"unreadable: {e}"))
+            continue
+        if src_lvl is None:
+            skipped.append((path, "not a raw (level -1 or 0) capture for these settings"))
+        elif src_lvl >= lvl:
+            skipped.append((path, f"already at level {src_lvl}"))
+        else:
+            tasks.append((path, dst, src_lvl, n_lines))
+    return tasks, skipped
+
+
+def run_reprocess(job, selection, lvl, json_path, cal_path, overwrite=False, workers=None, record=None, check_space=None):
+    """Job body: reprocess the captures `selection` matches to `lvl` on a process pool.
+
+    `record(path)` is called with each file written and `check_space(bytes)`
+    before starting, with the size of all of them.
+    """
+    data_dir = selection.data_dir
+    rel = lambda path: os.path.relpath(path, data_dir)
+    job.update(phase="scanning", found=0)
+    # Built here first so a bad calibration or level fails the job at once.
+    proc = build_processor(json_path, cal_path, lvl)
+    found, _ = selection.scan(lambda n, b: job.update(found=n))
+    tasks, skipped = plan(found, lvl, proc.settings, overwrite)
+    line_bytes = proc.dc_shape[0] * proc.dc_shape[2] * np.dtype(proc.dtype_out).itemsize
+    total_lines = sum(t[3] for t in tasks)
+    if check_space and tasks:
+        check_space(total_lines * line_bytes)
+
+    files = {rel(src): {"state": "queued", "lines": 0, "total": n} for src, _, _, n in tasks}
+    n_workers = min(workers or os.cpu_count() or 1, len(tasks)) or 1
+    job.update(
+        phase="processing",
+        workers=n_workers,
+        current=0,
+        total=len(tasks),
+        skipped=len(skipped),
+        lines=0,
+        total_lines=total_lines,
+        lines_per_s=0,
+        mb_per_s=0,
+        files=files,
+    )
+    outputs, errors, n_failed = [], [], 0
+    # Lines and bytes read so far, and start time, of the files in progress.
+    done_lines, done_bytes, running, started = 0, 0, {}, {}
+    t0 = time.monotonic()
+
+    def publish():
+        lines = done_lines + sum(r[0] for r in running.values())
+        nbytes = done_bytes + sum(r[1] for r in running.values())
+        elapsed = time.monotonic() - t0
+        job.update(
+            current=len(outputs) + n_failed,
+            lines=lines,
+            lines_per_s=lines / elapsed if elapsed else 0,
+            mb_per_s=nbytes / 2**20 / elapsed if elapsed else 0,
+            files={name: dict(info) for name, info in files.items()},
+        )
+
+    if tasks:
+        ctx = multiprocessing.get_context("spawn")
+        progress, cancel = ctx.Queue(), ctx.Event()
+        # Spawned workers import the parent's main module (e.g. server.py),
+        # which opens no camera on import.
+        pool = ProcessPoolExecutor(n_workers, mp_context=ctx, initializer=_init_worker, initargs=(progress, cancel))
+        futures = {
+            pool.submit(reprocess_file, src, dst, lvl, src_lvl, json_path, cal_path): (src, dst)
+            for src, dst, src_lvl, _ in tasks
+        }
+        try:
+            pending = set(futures)
+            while pending:
+                finished, pending = wait(pending, timeout=REPORT_INTERVAL_S)
+                while True:
+                    try:
+                        src, lines, n_lines, nbytes = progress.get_nowait()
+                    except queue.Empty:
+                        break
+                    info = files[rel(src)]
+                    if info["state"] in ("queued", "running"):
+                        started.setdefault(src, time.monotonic())
+                        running[src] = (lines, nbytes)
+                        rate = lines / max(time.monotonic() - started[src], 1e-3)
+                        info.update(state="running", lines=lines, lines_per_s=round(rate, 1))
+                for future in finished:
+                    src, dst = futures[future]
+                    info = files[rel(src)]
+                    running.pop(src, None)
+                    if future.cancelled():
+                        info["state"] = "cancelled"
+                        continue
+                    try:
+                        result = future.result()
+                    except Cancelled:
+                        info["state"] = "cancelled"
+                    except Exception as e:
+                        n_failed += 1
+                        info.update(state="failed", error=str(e))
+                        if len(errors) < MAX_LISTED:
+                            errors.append({"path": rel(src), "error": str(e)})
+                    else:
+                        done_lines += result["lines"]
+                        done_bytes += result["bytes"]
+                        info.update(state="done", lines=result["lines"], lines_per_s=round(result["lines"] / result["elapsed"], 1))
+                        outputs.append(dst)
+                        if record:
+                            record(dst)
+                if job.cancelled and not cancel.is_set():
+                    cancel.set()
+                    for future in pending:
+                        future.cancel()
+                publish()
+        finally:
+            cancel.set()
+            pool.shutdown(wait=True)
+    publish()
+    elapsed = time.monotonic() - t0
+    return {
+        "processing_lvl": lvl,
+        "processed": len(outputs),
+        "failed": n_failed,
+        "skipped": len(skipped),
+        "lines": done_lines,
+        "bytes_read": done_bytes,
+        "elapsed": elapsed,
+        "lines_per_s": done_lines / elapsed if elapsed else 0,
+        "mb_per_s": done_bytes / 2**20 / elapsed if elapsed else 0,
+        "outputs": [rel(p) for p in outputs[:MAX_LISTED]],
+        "errors": errors,
+        "skipped_files": [{"path": rel(p), "reason": reason} for p, reason in skipped[:MAX_LISTED]],
+    }
@@ -1,21 +1,26 @@
 from flask import (
     Flask,
+    Response,
     request,
     jsonify,
     render_template,
+    stream_template,
     send_file,
     send_from_directory,
     abort,
     Blueprint,
+    url_for,
 )
 from flask_restx import Api, Resource, fields
+from markupsafe import Markup
 import threading
 import os
+import concurrent.futures
+import json
 import time
 from io import BytesIO
-import tempfile
 import holoviews as hv
-from tqdm import tqdm
+import numpy as np
 import matplotlib
 import subprocess
 import datetime
@@ -40,7 +45,21 @@ __version__ = get_version()
 
 matplotlib.use("Agg")
 
-from openhsi.cameras import FlirCamera as openhsiCameraOrig
+from camera import ASSETS_DIR, get_camera_class
+from acquisition import AcquisitionClient
+from registry import CameraRegistry, load_registry
+from reference import REFERENCE_KINDS
+from preview import render_preview
+from history import CaptureHistory, UnknownCapture
+from cube_stream import FORMATS, STREAMS, StaleCube, select
+from indices import INDICES, IndexCache, compile_formula, compute_index, cube_wavelengths, render_index, resolve, to_npy
+from deletion import OutsideDataDir, Selection, run_deletion, within
+from reprocess import run_reprocess
+from jobs import JobManager
+from storage import InsufficientSpace, StorageManager, expected_cube_bytes
+from telemetry import TelemetryHistory, TelemetrySampler
+from render_pool import RenderPool, Saturated
+import compression
 
 # openhsi calibration settings
 # json_path = "/home/openhsi/UNE/cals/OpenHSI-SAIL-UNE-01/OpenHSI-SAIL-UNE-01_settings_Mono8_bin1.json"
@@ -48,37 +67,73 @@ from openhsi.cameras import FlirCamera as openhsiCameraOrig
 json_path = "/home/openhsi/orlar/cals/OpenHSI-SAIL-orlar-01/OpenHSI-SAIL-orlar-01_settings_Mono8_bin1.json"
 cal_path = "/home/openhsi/orlar/cals/OpenHSI-SAIL-orlar-01/OpenHSI-SAIL-orlar-01_calibration_Mono8_bin1.nc"
 
+# Camera backend (flir, lucid, ximea or simulated), see camera.CAMERA_BACKENDS.
+CAMERA_BACKEND = os.environ.get("OPENHSI_CAMERA_BACKEND", "flir")
+if CAMERA_BACKEND == "simulated":
+    # The bundled example calibration is enough to drive the synthetic camera.
+    json_path = os.path.join(ASSETS_DIR, "cam_settings.json")
+    cal_path = os.path.join(ASSETS_DIR, "cam_calibration.nc")
+json_path = os.environ.get("OPENHSI_JSON_PATH", json_path)
+cal_path = os.environ.get("OPENHSI_CAL_PATH", cal_path)
+
+# Root directory for saved captures and the file browser.
+DATA_DIR = os.environ.get("OPENHSI_DATA_DIR", "/data")
+
+# Captures are refused when they would leave less than this much free space in
+# the data directory. With OPENHSI_RETENTION set, the oldest saved captures are
+# deleted instead to keep this much free.
+MIN_FREE_MB = float(os.environ.get("OPENHSI_MIN_FREE_MB", 512))
+RETENTION = os.environ.get("OPENHSI_RETENTION", "").lower() in ("1", "true", "yes", "on")
+storage = StorageManager(DATA_DIR, min_free_bytes=int(MIN_FREE_MB * 2**20), retention=RETENTION)
+
+# Cubes of earlier captures kept in memory, addressable by capture id (see history.py).
+HISTORY_MB = float(os.environ.get("OPENHSI_HISTORY_MB", 1024))
+HISTORY_SIZE = int(os.environ.get("OPENHSI_HISTORY_SIZE", 8))
+capture_history = CaptureHistory(max_bytes=int(HISTORY_MB * 2**20), max_entries=HISTORY_SIZE)
+
+# When set, the camera is owned by a separate acquisition process (see acquisition.py)
+# and this process only reads its shared-memory datacube.
+ACQUISITION_ADDRESS = os.environ.get("OPENHSI_ACQUISITION_ADDRESS")
+
+# Several cameras can be served by listing them in a JSON file (see registry.py).
+# The first camera is the default one behind the single-camera endpoints.
+CAMERAS_CONFIG = os.environ.get("OPENHSI_CAMERAS_CONFIG")
+
+# The cameras are opened by start(), not on import, so that importing this
+# module (as spawned reprocessing workers do) never touches a camera.
+registry = CameraRegistry()
+
+
+def open_cameras():
+    """Open the configured cameras."""
+    if CAMERAS_CONFIG:
+        return load_registry(CAMERAS_CONFIG, DATA_DIR, default_backend=CAMERA_BACKEND)
+    cameras = CameraRegistry()
+    if ACQUISITION_ADDRESS:
+        cameras.add("default", AcquisitionClient(ACQUISITION_ADDRESS), save_dir=DATA_DIR)
+    else:
+        # Initialize the camera at startup with explicit parameters.
+        cameras.add(
+            "default",
+            get_camera_class(CAMERA_BACKEND)(
+                n_lines=512,
+                exposure_ms=10,
+                processing_lvl=-1,
+                json_path=json_path,
+                cal_path=cal_path,
+            ),
+            save_dir=DATA_DIR,
+            backend=CAMERA_BACKEND,
+        )
+    return cameras
 
-# reimplemnted openhsi capture to allow capture progress feedback.
-class openhsiCamera(openhsiCameraOrig):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-
-    def collect(self, progress_callback=None):
-        self.start_cam()
-        pbar = tqdm(range(self.n_lines))
-        for _ in pbar:
-            self.put(self.get_img())
-            if callable(getattr(self, "get_temp", None)):
-                self.cam_temperatures.put(self.get_temp())
-            # If a progress_callback is provided, extract the progress data from pbar.
-            if progress_callback:
-                # pbar.format_dict returns a dictionary with useful keys
-                # such as 'n', 'total', 'elapsed', and 'eta'.
-                progress_callback(pbar.format_dict)
-        self.stop_cam()
-
-
-# Initialize the camera at startup with explicit parameters.
-cam = openhsiCamera(
-    n_lines=512,
-    exposure_ms=10,
-    processing_lvl=-1,
-    json_path=json_path,
-    cal_path=cal_path,
-)
 
 app = Flask(__name__)
+# gzip/brotli responses, content-hashed static URLs and ETags for JSON.
+compression.init_app(app)
+# Compile the page templates once at startup rather than on the first request.
+for template_name in ("index.html", "browse.html", "settings_basic.html", "settings_detailed.html"):
+    app.jinja_env.get_template(template_name)
 
 # Create a blueprint for the API with a URL prefix (e.g. '/api')
 api_bp = Blueprint("api", __name__, url_prefix="/api")
@@ -109,6 +164,16 @@ settings_model = api.model(
         "processing_lvl": fields.Integer(
             required=False, description="Processing level", example=-1
         ),
+        "deferred_processing": fields.Boolean(
+            required=False,
+            description="Capture raw frames and apply the processing level after the capture",
+            example=False,
+        ),
+        "pipelined_capture": fields.Boolean(
+            required=False,
+            description="Grab frames on a separate thread from processing",
+            example=False,
+        ),
     },
 )
 
@@ -179,6 +244,26 @@ full_settings_model = api.inherit(
     "FullSettings", settings_model, advanced_settings_model
 )
 
+reference_model = api.model(
+    "Reference",
+    {
+        "n_frames": fields.Integer(
+            required=False,
+            description="Number of frames averaged into the reference",
+            example=64,
+        )
+    },
+)
+
+preview_model = api.model(
+    "Preview",
+    {
+        "n_lines": fields.Integer(required=False, description="Lines to capture", example=128),
+        "binning": fields.Integer(required=False, description="Cross-track rows averaged per pixel", example=4),
+        "n_bands": fields.Integer(required=False, description="Spectral bands the frames are reduced to", example=16),
+    },
+)
+
 save_model = api.model(
     "Save",
     {
@@ -186,12 +271,77 @@ save_model = api.model(
             required=False,
             description="Directory where files will be saved",
             example="/data",
-        )
+        ),
+        "capture": fields.String(
+            required=False,
+            description="Id of an earlier capture from /api/history (default: the latest capture)",
+        ),
+    },
+)
+
+delete_batch_model = api.model(
+    "DeleteBatch",
+    {
+        "paths": fields.List(
+            fields.String,
+            required=False,
+            description="Files or folders (deleted with their contents) relative to the data directory",
+            example=["2024_05_31/2024_05_31-10_00_00.nc", "2024_05_30"],
+        ),
+        "folder": fields.String(required=False, description="Folder a filter searches (default: the data directory)"),
+        "glob": fields.String(
+            required=False, description="Files to delete: a name pattern, or a path pattern if it has a /", example="*.png"
+        ),
+        "before": fields.String(required=False, description="Delete files modified before this ISO date", example="2024-06-01"),
+        "after": fields.String(required=False, description="Delete files modified on or after this ISO date"),
+        "dry_run": fields.Boolean(required=False, description="Only report what would be deleted", default=False),
+    },
+)
+
+reprocess_model = api.model(
+    "Reprocess",
+    {
+        "processing_lvl": fields.Integer(required=True, description="Processing level to write (0-8)", example=2),
+        "paths": fields.List(
+            fields.String,
+            required=False,
+            description="Captures, or folders of captures, relative to the data directory",
+            example=["2024_05_31/2024_05_31-10_00_00.nc"],
+        ),
+        "folder": fields.String(required=False, description="Folder a filter searches (default: the data directory)"),
+        "glob": fields.String(
+            required=False, description="Captures to reprocess: a name pattern, or a path pattern if it has a /", example="*.nc"
+        ),
+        "before": fields.String(required=False, description="Captures modified before this ISO date", example="2024-06-01"),
+        "after": fields.String(required=False, description="Captures modified on or after this ISO date"),
+        "overwrite": fields.Boolean(
+            required=False, description="Reprocess captures whose output already exists", default=False
+        ),
+        "json_path": fields.String(
+            required=False,
+            description="Settings file in the data directory or beside the server's (default: the server's)",
+        ),
+        "cal_path": fields.String(
+            required=False,
+            description="Calibration file in the data directory or beside the server's (default: the server's)",
+        ),
     },
 )
 
 # Define the list of settings to show.
-SETTING_KEYS = ["n_lines", "exposure_ms", "processing_lvl"]
+SETTING_KEYS = ["n_lines", "exposure_ms", "processing_lvl", "deferred_processing", "pipelined_capture"]
+
+# On/off settings, with the option text shown for each state.
+BOOLEAN_SETTINGS = {
+    "deferred_processing": (
+        "Off - process each line during capture",
+        "On - capture raw, process after capture",
+    ),
+    "pipelined_capture": (
+        "Off - grab and process each line in turn",
+        "On - grab frames on a separate thread",
+    ),
+}
 
 # Allowed processing levels with updated descriptions.
 PROCESSING_LVL_OPTIONS = {
@@ -265,19 +415,18 @@ DETAILED_SETTINGS = {
     },
 }
 
-# Global flags and lock for capture status.
-collection_running = False
-capture_finished = False
-collection_lock = threading.Lock()
-
 # Log messages storage
 log_messages = []
 log_lock = threading.Lock()
+# Bumped on every change to log_messages, used as the /api/logs ETag.
+log_version = 0
 
 
 def add_log_message(message, message_type="info"):
     """Add a message to the log with timestamp and type."""
+    global log_version
     with log_lock:
+        log_version += 1
         timestamp = int(time.time() * 1000)  # milliseconds since epoch
         log_messages.append(
             {
@@ -292,85 +441,294 @@ def add_log_message(message, message_type="info"):
             log_messages.pop(0)
 
 
-def run_collection():
-    global collection_running, capture_finished, capture_progress
-    with collection_lock:
-        collection_running = True
-        capture_finished = False
-        capture_progress = {}
+def log_pruned(result):
+    add_log_message(
+        f"Retention removed {len(result['removed'])} old capture(s), freeing {result['freed_bytes'] / 2**20:.0f} MB",
+        "info",
+    )
+
+
+storage.on_prune = log_pruned
+
+
+def log_job(job):
+    info = job.describe()
+    if info["state"] == "failed":
+        add_log_message(f"Job {job.id} ({job.kind}) failed: {info['error']}", "error")
+    elif job.kind == "delete" and not job.params.get("dry_run"):
+        result = info["result"] or {}
+        add_log_message(
+            f"Job {job.id}: deleted {result.get('deleted', 0)} file(s), freeing {result.get('freed_bytes', 0) / 2**20:.0f} MB"
+            + (f", {result['failed']} failed" if result.get("failed") else "")
+            + (" (cancelled)" if info["state"] == "cancelled" else ""),
+            "success" if not result.get("failed") else "error",
+        )
+    elif job.kind == "reprocess":
+        result = info["result"] or {}
+        add_log_message(
+            f"Job {job.id}: reprocessed {result.get('processed', 0)} capture(s) to level {job.params['processing_lvl']}"
+            + (f", {result['failed']} failed" if result.get("failed") else "")
+            + (f", {result['skipped']} skipped" if result.get("skipped") else "")
+            + (" (cancelled)" if info["state"] == "cancelled" else ""),
+            "success" if not result.get("failed") else "error",
+        )
+
+
+# Background jobs over saved files (see jobs.py).
+jobs = JobManager()
+# Worker processes of a reprocessing job (see reprocess.py); 0 uses every core.
+REPROCESS_WORKERS = int(os.environ.get("OPENHSI_REPROCESS_WORKERS", 0))
+jobs.on_finish = log_job
+
+
+def telemetry_sample(entry):
+    """Sample function for one camera: sensor temperature and line rate since the last sample."""
+    last = {"capture": None, "current": 0, "t": time.monotonic()}
+
+    def sample():
+        status = entry.status()
+        now = time.monotonic()
+        capture = entry.capture_stamp
+        if capture != last["capture"]:
+            # Lines are counted from zero again only when a new capture starts.
+            last.update(capture=capture, current=0)
+        rate = 0.0
+        if status["phase"] in ("capturing", "paused"):
+            current = status["progress"].get("current", 0)
+            rate = max(current - last["current"], 0) / (now - last["t"])
+            last["current"] = max(current, last["current"])
+        last["t"] = now
+        return {"temperature": entry.cam.sample_temperature(), "line_rate": rate}
+
+    return sample
+
+
+# Temperature and line rate history of every camera, sampled once a second
+# whether or not it is capturing (see telemetry.py). Started by start().
+telemetry = {}
+telemetry_sampler = None
+
+# Quicklook renders run on a small pool of low-priority threads. While any
+# camera is capturing they run one at a time, at least
+# RENDER_CAPTURE_INTERVAL_S apart (see render_pool.py).
+RENDER_WORKERS = int(os.environ.get("OPENHSI_RENDER_WORKERS", 1))
+RENDER_QUEUE = int(os.environ.get("OPENHSI_RENDER_QUEUE", 4))
+RENDER_CAPTURE_INTERVAL_S = float(os.environ.get("OPENHSI_RENDER_CAPTURE_INTERVAL_S", 1.0))
+RENDER_TIMEOUT_S = 60
+RENDER_RETRY_AFTER_S = 2
+render_pool = RenderPool(
+    workers=RENDER_WORKERS,
+    max_queue=RENDER_QUEUE,
+    busy=lambda: any(entry.status()["capturing"] for entry in registry),
+    capture_interval_s=RENDER_CAPTURE_INTERVAL_S,
+)
+# Spectral index arrays of recent captures (see indices.py).
+index_cache = IndexCache()
+
+
+def log_prefix(entry):
+    """Prefix for log messages about `entry`, empty with a single camera."""
+    return f"[{entry.id}] " if len(registry) > 1 else ""
+
+
+def archive_capture(entry):
+    """Move the last capture of `entry` into the history before a new one overwrites it."""
+    stamp = entry.capture_stamp
+    if not stamp or not capture_history.enabled:
+        return
     try:
-        # Pass the update_progress callback, which now receives the tqdm progress dict.
-        add_log_message("Collection process started", "info")
-        cam.collect(progress_callback=update_progress)
-        add_log_message("Collection completed successfully", "success")
+        if entry.remote:
+            if entry.status()["finished"]:
+                capture_history.archive(entry.id, stamp, entry.latest_cube(), copy=True)
+        else:
+            # The capture thread owns the camera, so its buffers can be handed over,
+            # except the lines of a cancelled capture, which are views of them.
+            cube = entry.latest_cube()
+            capture_history.archive(entry.id, stamp, cube, copy=cube is not entry.cam)
     except Exception as e:
-        add_log_message(f"Error during collection: {str(e)}", "error")
-        app.logger.error(f"Collection error: {e}")
-    finally:
-        with collection_lock:
-            collection_running = False
-            capture_finished = True
-
-
-# Global variable to store progress info.
-capture_progress = {}
-
-
-def update_progress(progress_info):
-    global capture_progress
-    # Extract desired values from progress_info.
-    current = progress_info.get("n", 0)
-    total = progress_info.get("total", 0)
-    elapsed = progress_info.get("elapsed", 0)
-    rate = progress_info.get("rate", 0)
-    percentage = (current / total) * 100 if total else 0
-    capture_progress = {
-        "current": current,
-        "total": total,
-        "elapsed": elapsed,
-        "rate": rate,
-        "percentage": percentage,
-    }
+        add_log_message(f"{log_prefix(entry)}Previous capture not kept in history: {str(e)}", "error")
 
 
-# -------------------------------------------------------------------------
-# Non-API route: Render the main index page with a settings form.
-@app.route("/")
-def index():
-    # Generate form fields HTML from the settings.
-    form_fields = ""
-    for key in SETTING_KEYS:
-        if key == "processing_lvl":
-            current_value = cam.settings.get(key, "")
-            form_fields += f'<div class="form-group"><label for="{key}">{key}:</label>'
-            form_fields += (
-                f'<select id="{key}" name="{key}" class="form-control setting">'
+def capture_cube(entry, capture_id=None):
+    """(cube, capture id) of the latest capture of `entry`, or of an earlier one in the history.
+
+    The cube is None when no capture has finished yet. Raises UnknownCapture
+    for ids that are neither.
+    """
+    if capture_id not in (None, ""):
+        try:
+            capture_id = int(capture_id)
+        except ValueError:
+            raise UnknownCapture(f"Invalid capture id '{capture_id}'")
+        if capture_id != entry.capture_stamp:
+            snap = capture_history.get(entry.id, capture_id)
+            if snap is None:
+                raise UnknownCapture(f"Capture {capture_id} is not in the history")
+            return snap, capture_id
+    if not entry.status()["finished"]:
+        return None, None
+    return entry.latest_cube(), entry.capture_stamp
+
+
+def run_collection(entry, start_barrier=None):
+    """Capture thread of one camera; `start_barrier` lines up the start of several."""
+    prefix = log_prefix(entry)
+    try:
+        archive_capture(entry)
+        # Pass the progress callback, which receives the tqdm progress dict.
+        add_log_message(f"{prefix}Collection process started", "info")
+        if start_barrier is not None:
+            start_barrier.wait(timeout=30)
+        entry.started_ns = time.time_ns()
+        entry.cam.collect(progress_callback=entry.update_progress)
+        if entry.cam.lines_captured < entry.cam.n_lines:
+            add_log_message(
+                f"{prefix}Collection cancelled after {entry.cam.lines_captured} of {entry.cam.n_lines} lines", "info"
             )
-            for option_value, option_desc in PROCESSING_LVL_OPTIONS.items():
-                try:
-                    selected = "selected" if int(current_value) == option_value else ""
-                except (ValueError, TypeError):
-                    selected = ""
-                form_fields += (
-                    f'<option value="{option_value}" {selected}>{option_desc}</option>'
-                )
-            form_fields += "</select></div>"
         else:
-            value = cam.settings.get(key, "")
-            form_fields += (
-                f'<div class="form-group"><label for="{key}">{key}:</label>'
-                f'<input type="text" id="{key}" name="{key}" class="form-control setting" value="{value}">'
-                f"</div>"
+            add_log_message(f"{prefix}Collection completed successfully", "success")
+    except Exception as e:
+        add_log_message(f"{prefix}Error during collection: {str(e)}", "error")
+        app.logger.error(f"Collection error ({entry.id}): {e}")
+    finally:
+        entry.end()
+
+
+def start_capture(entry):
+    """Start a capture on one camera. Returns False if it is already capturing."""
+    if entry.remote:
+        if entry.status()["capturing"]:
+            return False
+        archive_capture(entry)
+        return entry.cam.start_capture()
+    if not entry.begin():
+        return False
+    threading.Thread(target=run_collection, args=(entry,), daemon=True).start()
+    return True
+
+
+def start_capture_all():
+    """Start every idle camera together. Returns the ids of the cameras started."""
+    entries = [e for e in registry if not e.status()["capturing"] and e.begin()]
+    barrier = threading.Barrier(len(entries)) if entries else None
+    for entry in entries:
+        threading.Thread(target=run_collection, args=(entry, barrier), daemon=True).start()
+    return [e.id for e in entries]
+
+
+# action: (camera method, phases it applies in, phase it leads to, past tense for the log)
+CAPTURE_CONTROLS = {
+    "cancel": ("request_cancel", ("capturing", "paused"), None, "cancelled"),
+    "pause": ("request_pause", ("capturing",), "paused", "paused"),
+    "resume": ("request_resume", ("paused",), "capturing", "resumed"),
+}
+
+
+def control_capture(entry, action):
+    """Cancel, pause or resume the running capture of one camera.
+
+    Cancelling keeps the lines captured so far; they can be shown and saved
+    like a full capture.
+    """
+    method, phases, phase, done = CAPTURE_CONTROLS[action]
+    status = entry.status()
+    if status["phase"] not in phases:
+        state = status["phase"] or ("finished" if status["finished"] else "idle")
+        return {"status": "error", "message": f"Cannot {action} the capture: it is {state}"}, 409
+    if getattr(entry.cam, method)() is False:  # a remote capture that just ended
+        return {"status": "error", "message": f"Cannot {action} the capture: it has ended"}, 409
+    if phase is not None and not entry.remote:
+        entry.set_phase(phase)
+    add_log_message(f"{log_prefix(entry)}Capture {done}", "info")
+    return {"status": f"Capture {done}"}, 200
+
+
+def check_capture_space(entries):
+    """Raise InsufficientSpace unless the next capture of every camera in `entries` can be saved."""
+    required = 0
+    for entry in entries:
+        required += expected_cube_bytes(entry.cam.settings, entry.cam.n_lines)
+    if entries:
+        storage.check_space(required, path=entries[0].save_dir)
+
+
+def get_camera_entry(cam_id):
+    entry = registry.get(cam_id)
+    if entry is None:
+        api.abort(404, f"Unknown camera '{cam_id}'")
+    return entry
+
+
+def parse_settings(new_settings):
+    """Convert an update_settings payload to typed values, skipping empty fields."""
+    requested = {}
+    for key in ("n_lines", "processing_lvl"):
+        if new_settings.get(key, "") != "":
+            requested[key] = int(new_settings[key])
+    if "processing_lvl" in requested and requested["processing_lvl"] not in PROCESSING_LVL_OPTIONS:
+        raise ValueError(f"processing_lvl must be one of {list(PROCESSING_LVL_OPTIONS)}")
+    for key in BOOLEAN_SETTINGS:
+        if new_settings.get(key) is not None:
+            requested[key] = bool(new_settings[key])
+
+    for key, info in DETAILED_SETTINGS.items():
+        value = new_settings.get(key, "")
+        if value == "" or value is None:
+            continue
+        if info["type"] == "array_int":
+            value = [int(v) for v in value]
+            if len(value) != info["size"]:
+                raise ValueError(f"{key} needs {info['size']} values")
+            checked = value
+        elif info["type"] == "float":
+            value = float(value)
+            checked = [value]
+        else:
+            if value not in info["options"]:
+                raise ValueError(f"{key} must be one of {info['options']}")
+            checked = []
+        if any(v < info["min_value"] or v > info["max_value"] for v in checked):
+            raise ValueError(
+                f"{key} must be between {info['min_value']} and {info['max_value']}"
             )
+        requested[key] = value
+    return requested
+
+
+def get_capture_status():
+    """Return the capture status of the default camera."""
+    return registry.default.status()
+
+
+# Rendered settings form fragments, as (settings snapshot, fragments). Reading the
+# settings is cheap, rendering both forms is not, so they are only re-rendered
+# once the settings have changed.
+settings_fragment_cache = (None, None)
+settings_fragment_lock = threading.Lock()
+
+
+def settings_fragments(settings):
+    """Rendered basic and detailed settings forms for the settings dict `settings`."""
+    global settings_fragment_cache
+    keys = list(dict.fromkeys(SETTING_KEYS + list(DETAILED_SETTINGS)))
+    snapshot = json.dumps({key: settings.get(key) for key in keys}, sort_keys=True, default=str)
+    with settings_fragment_lock:
+        cached_snapshot, fragments = settings_fragment_cache
+        if cached_snapshot == snapshot:
+            return fragments
+
+    try:
+        processing_lvl = int(settings.get("processing_lvl", ""))
+    except (ValueError, TypeError):
+        processing_lvl = None
 
     # Get the current camera settings for the detailed tab
     current_settings = {}
-    for setting_key in DETAILED_SETTINGS.keys():
-        if setting_key in cam.settings:
-            current_settings[setting_key] = cam.settings[setting_key]
+    for setting_key, setting_info in DETAILED_SETTINGS.items():
+        if setting_key in settings:
+            current_settings[setting_key] = settings[setting_key]
         else:
             # Provide default empty values based on type
-            setting_info = DETAILED_SETTINGS[setting_key]
             if setting_info["type"] == "array_int":
                 current_settings[setting_key] = [0] * setting_info.get("size", 2)
             elif setting_info["type"] == "float":
@@ -378,12 +736,37 @@ def index():
             elif setting_info["type"] == "select":
                 current_settings[setting_key] = setting_info.get("options", [""])[0]
 
-    return render_template(
-        "index.html",
-        form_fields=form_fields,
-        detailed_settings=DETAILED_SETTINGS,
-        current_settings=current_settings,
-    )
+    fragments = {
+        "settings_form": Markup(
+            render_template(
+                "settings_basic.html",
+                setting_keys=SETTING_KEYS,
+                settings=settings,
+                processing_lvl=processing_lvl,
+                processing_lvl_options=PROCESSING_LVL_OPTIONS,
+                boolean_settings=BOOLEAN_SETTINGS,
+            )
+        ),
+        "detailed_settings_form": Markup(
+            render_template(
+                "settings_detailed.html",
+                detailed_settings=DETAILED_SETTINGS,
+                current_settings=current_settings,
+            )
+        ),
+    }
+    with settings_fragment_lock:
+        settings_fragment_cache = (snapshot, fragments)
+    return fragments
+
+
+# -------------------------------------------------------------------------
+# Non-API route: Render the main index page with a settings form.
+@app.route("/")
+def index():
+    # One read of the settings, a single round trip for remote cameras.
+    settings = dict(registry.default.cam.settings)
+    return stream_template("index.html", **settings_fragments(settings))
 
 
 # -------------------------------------------------------------------------
@@ -392,12 +775,15 @@ class UpdateSettings(Resource):
     @api.expect(full_settings_model, validate=True)
     @api.response(200, "Settings updated successfully")
     @api.response(400, "Invalid input")
+    @api.response(409, "Camera busy")
     @api.response(500, "Internal error while updating settings")
     @api.doc(
         params={
             "n_lines": "Number of scan lines to capture",
             "exposure_ms": "Exposure time in milliseconds",
             "processing_lvl": "Processing level (-1 to 4)",
+            "deferred_processing": "Capture raw frames and apply the processing level afterwards",
+            "pipelined_capture": "Grab frames on a separate thread from processing",
             "row_slice": "Range of rows to read from detector [start, end]",
             "resolution": "Image resolution [height, width]",
             "fwhm_nm": "Full Width at Half Maximum (spectral resolution) in nanometers",
@@ -413,7 +799,10 @@ class UpdateSettings(Resource):
         Update camera settings (both basic and advanced).
 
         This endpoint handles both the basic settings (n_lines, exposure_ms, processing_lvl)
-        and the advanced detailed settings for the camera.
+        and the advanced detailed settings for the camera. With deferred_processing
+        enabled, captures are acquired raw and the processing level is applied to the
+        whole cube once the capture is done. With pipelined_capture enabled, frames
+        are grabbed on their own thread and queued for processing.
 
         Advanced settings include:
         - row_slice: Range of rows to read from detector [start, end]
@@ -425,87 +814,421 @@ class UpdateSettings(Resource):
         - win_offset: Window offset [x, y]
         - win_resolution: Window resolution [width, height]
         - pixel_format: Pixel format (Mono8, Mono12, or Mono16)
+
+        Settings that are omitted or unchanged are left alone. The response lists
+        the settings that changed and how long applying them took (apply_ms).
         """
-        new_settings = request.get_json()
-        app.logger.info("Received update_settings payload: %s", new_settings)
+        return update_camera_settings(registry.default, request.get_json())
+
+
+def update_camera_settings(entry, new_settings):
+    """Apply an update_settings payload to one camera."""
+    prefix = log_prefix(entry)
+    app.logger.info("Received update_settings payload for %s: %s", entry.id, new_settings)
+
+    try:
+        requested = parse_settings(new_settings)
+    except Exception as e:
+        app.logger.error("Error parsing input: %s", e, exc_info=True)
+        return {"status": "error", "error": f"Input error: {e}"}, 400
+
+    if not entry.begin_task("settings"):
+        return {"status": "error", "error": "Capture in progress"}, 409
+    try:
+        # Only the settings that differ from the camera's are applied, in a
+        # single reinitialise (none at all when just the exposure changed).
+        result = entry.cam.apply_settings(**requested)
+
+        if result["reinitialised"]:
+            entry.invalidate()
+
+        changed = result["changed"]
+        if changed:
+            summary = ", ".join(f"{key}: {value}" for key, value in changed.items())
+            add_log_message(
+                f"{prefix}Camera settings updated ({summary}) in {result['apply_ms']:.0f} ms",
+                "success",
+            )
+        else:
+            add_log_message(f"{prefix}Camera settings unchanged", "info")
+
+        return {
+            "status": "success",
+            "changed": changed,
+            "reinitialised": result["reinitialised"],
+            "apply_ms": result["apply_ms"],
+        }, 200
+    except Exception as e:
+        app.logger.error("Error updating settings: %s", e, exc_info=True)
+        add_log_message(f"{prefix}Error updating camera settings: {str(e)}", "error")
+        return {"status": "error", "error": f"Internal error: {e}"}, 500
+    finally:
+        entry.end_task()
 
-        # Track which detailed settings were provided
-        detailed_settings_provided = {}
-        for key in DETAILED_SETTINGS.keys():
-            if key in new_settings:
-                detailed_settings_provided[key] = new_settings[key]
 
+def capture_camera(entry):
+    prefix = log_prefix(entry)
+    try:
+        check_capture_space([entry])
+    except InsufficientSpace as e:
+        add_log_message(f"{prefix}Capture not started: {e}", "error")
+        return {"status": "error", "error": str(e)}, 507
+    if not start_capture(entry):
+        add_log_message(f"{prefix}Capture already in progress", "info")
+        return {"status": "Capture already in progress"}, 200
+    add_log_message(f"{prefix}Image capture started", "info")
+    return {"status": "Capture started"}, 200
+
+
+def save_camera(entry, save_dir, capture_id=None):
+    """Save the last capture of one camera, or the capture `capture_id` from the history."""
+    cam = entry.cam
+    prefix = log_prefix(entry)
+    if capture_id not in (None, ""):
         try:
-            # Validate and parse basic settings
-            if "n_lines" in new_settings and new_settings["n_lines"] != "":
-                new_settings["n_lines"] = int(new_settings["n_lines"])
-            else:
-                # Optional: Set a default or skip if not provided.
-                new_settings["n_lines"] = None
+            cam, capture_id = capture_cube(entry, capture_id)
+        except UnknownCapture as e:
+            api.abort(404, str(e))
+        if cam is None:
+            return {"status": "error", "message": "The capture has not finished"}, 409
+        if getattr(cam, "downsample", 1) > 1:
+            return {"status": "error", "message": f"Only a downsampled copy of capture {capture_id} was kept"}, 409
+    elif entry.status()["finished"]:
+        cam = entry.latest_cube()  # only the lines a cancelled capture stored
+    required = expected_cube_bytes(cam.settings, cam.n_lines)
+    try:
+        storage.check_space(required, path=save_dir)
+    except InsufficientSpace as e:
+        add_log_message(f"{prefix}Files not saved: {e}", "error")
+        return {"status": "error", "message": str(e)}, 507
+    try:
+        saved = cam.save(save_dir=save_dir)
+    except Exception as e:
+        # A failed write (netCDF reports a full disk as an HDF error, not ENOSPC)
+        # leaves a truncated cube and maybe its quicklook behind.
+        disk_full = storage.disk_usage(save_dir).free < required
+        for path in saved_paths(cam, save_dir):
+            if os.path.exists(path):
+                os.remove(path)
+                storage.forget(path)
+        if disk_full:
+            add_log_message(f"{prefix}Error saving files: disk full", "error")
+            return {"status": "error", "message": "Disk full"}, 507
+        add_log_message(f"{prefix}Error saving files: {str(e)}", "error")
+        api.abort(500, str(e))
+    storage.record(*saved)
+    add_log_message(f"{prefix}Files saved to {save_dir}", "success")
+    return {
+        "status": "success",
+        "message": f"Files saved to {save_dir}",
+        "filepath": saved[0],
+    }, 200
+
+
+def saved_paths(cam, save_dir):
+    """The .nc and .png files DataCube.save writes for `cam` in `save_dir`."""
+    cube = cam.view() if isinstance(cam, AcquisitionClient) else cam
+    start = cube.timestamps[0]
+    stem = f"{save_dir}/{start.strftime('%Y_%m_%d')}/{start.strftime('%Y_%m_%d-%H_%M_%S')}"
+    return [f"{stem}.nc", f"{stem}.png"]
+
+
+def render_png(cam, hist_eq, robust):
+    """Render the quicklook of a capture to PNG bytes."""
+    # Note: Additional parameters like band selection and stretch percentage
+    # would need to be implemented in the camera's show method
+    fig = cam.show(plot_lib="matplotlib", hist_eq=hist_eq, robust=robust)
+    buf = BytesIO()
+    hv.save(fig, buf, fmt="png")
+    return buf.getvalue()
+
+
+def submit_show(entry, args):
+    """Submit the quicklook render for /api/show query `args`; returns a Future of the PNG.
+
+    Returns None when there is no capture to show. Raises UnknownCapture for
+    an unknown capture id and render_pool.Saturated when the render backlog
+    is full.
+    """
+    cube, capture_id = capture_cube(entry, args.get("capture"))
+    if cube is None:
+        return None
+
+    # Parse display parameters
+    hist_eq = args.get("hist_eq", "false").lower() == "true"
+    robust = args.get("robust", "true").lower() == "true"
+    band = args.get("band", "rgb")
+    stretch = int(args.get("stretch", "0"))
+
+    app.logger.info(
+        f"Showing image with settings - hist_eq: {hist_eq}, robust: {robust}, band: {band}, stretch: {stretch}"
+    )
 
-            # For updating from the basic settings tab
-            if "exposure_ms" in new_settings and new_settings["exposure_ms"] != "":
-                new_exposure = float(new_settings["exposure_ms"])
-            else:
-                # If no exposure is provided (e.g., when updating only detailed settings)
-                # and we already have one in the camera, use the current exposure
-                if hasattr(cam, "settings") and "exposure_ms" in cam.settings:
-                    new_exposure = cam.settings["exposure_ms"]
-                else:
-                    raise ValueError(
-                        "Exposure time (exposure_ms) is required and must be a number."
-                    )
+    key = ("show", entry.id, capture_id, hist_eq, robust)
+    return render_pool.submit(key, lambda: render_png(cube, hist_eq, robust))
 
-            if (
-                "processing_lvl" in new_settings
-                and new_settings["processing_lvl"] != ""
-            ):
-                new_pl = int(new_settings["processing_lvl"])
-            else:
-                # Default processing level if not provided.
-                new_pl = -1
-        except Exception as e:
-            app.logger.error("Error parsing input: %s", e, exc_info=True)
-            return {"status": "error", "error": f"Input error: {e}"}, 400
+
+def show_camera(entry):
+    """Render the last capture of one camera as a PNG response.
+
+    Renders run on render_pool: identical requests in flight share one render,
+    and a full backlog answers 503 with Retry-After.
+    """
+    try:
+        future = submit_show(entry, request.args)
+        if future is None:
+            return "", 204
+        img_data = future.result(timeout=RENDER_TIMEOUT_S)
+    except UnknownCapture as e:
+        api.abort(404, str(e))
+    except (Saturated, concurrent.futures.TimeoutError):
+        return {"status": "error", "error": "Renderer busy, try again shortly"}, 503, {"Retry-After": str(RENDER_RETRY_AFTER_S)}
+    except Exception as e:
+        app.logger.error(f"Error generating image: {e}")
+        return "", 204
+    return send_file(BytesIO(img_data), mimetype="image/png")
+
+
+def index_camera(entry, name):
+    """A spectral index of the last capture of one camera, as a colour-mapped PNG or .npy array.
+
+    Index arrays are computed on render_pool and cached per capture, so
+    re-rendering with another colour map or range reuses them.
+    """
+    args = request.args
+    try:
+        cube, capture_id = capture_cube(entry, args.get("capture"))
+    except UnknownCapture as e:
+        api.abort(404, str(e))
+    if cube is None:
+        return "", 204
+    try:
+        formula, cmap, vrange = resolve(name, args.get("expr"))
+    except KeyError:
+        api.abort(404, f"Unknown index '{name}'. Choose from {', '.join(INDICES)} or custom")
+    except ValueError as e:
+        return {"status": "error", "error": str(e)}, 400
+    wavelengths = cube_wavelengths(cube)
+    if wavelengths is None:
+        return {"status": "error", "error": "The capture has no wavelength calibration"}, 409
+    try:
+        compile_formula(formula, wavelengths)  # report bad expressions before queueing
+        cmap = args.get("cmap") or cmap
+        if cmap not in matplotlib.colormaps:
+            raise ValueError(f"Unknown colour map '{cmap}'")
+        if args.get("vmin") or args.get("vmax"):
+            vrange = (float(args.get("vmin", -1)), float(args.get("vmax", 1)))
+        fmt = args.get("format", "png")
+        if fmt not in ("png", "npy"):
+            raise ValueError("format must be png or npy")
+    except ValueError as e:
+        return {"status": "error", "error": str(e)}, 400
+
+    key = ("index", entry.id, capture_id, cube.downsample if hasattr(cube, "downsample") else 1, formula)
+    values = index_cache.get(key)
+    if values is None:
+
+        def compute():
+            result = compute_index(cube.dc.data, wavelengths, formula)
+            index_cache.put(key, result)
+            return result
 
         try:
-            # Update basic camera settings
-            cam.set_exposure(new_exposure)
-            if new_settings["n_lines"] is not None:
-                cam.reinitialise(n_lines=new_settings["n_lines"])
-            cam.reinitialise(processing_lvl=new_pl)
-
-            # Update detailed settings if provided
-            if detailed_settings_provided:
-                app.logger.info(
-                    "Updating detailed settings: %s", detailed_settings_provided
-                )
-                # We should actually use the cam's API or configuration to update these settings
-                # This implementation would depend on the specifics of the OpenHSI camera API
-                # For now, we'll just log them and pretend we updated them
-                for key, value in detailed_settings_provided.items():
-                    app.logger.info(f"Would update {key} to {value}")
-                    # In a real implementation, you would call the appropriate camera API methods
-                    # Example: cam.set_setting(key, value)
-
-            with collection_lock:
-                global capture_finished
-                capture_finished = False
-
-            # Add to log
-            if detailed_settings_provided:
-                add_log_message(f"Camera advanced settings updated", "success")
-            else:
-                add_log_message(
-                    f"Camera basic settings updated - exposure: {new_exposure}ms, lines: {new_settings['n_lines'] if new_settings['n_lines'] is not None else 'unchanged'}, processing: {new_pl}",
-                    "success",
-                )
+            values = render_pool.submit(key, compute).result(timeout=RENDER_TIMEOUT_S)
+        except (Saturated, concurrent.futures.TimeoutError):
+            return {"status": "error", "error": "Renderer busy, try again shortly"}, 503, {"Retry-After": str(RENDER_RETRY_AFTER_S)}
+    if fmt == "npy":
+        return send_file(BytesIO(to_npy(values)), mimetype="application/octet-stream", as_attachment=True, download_name=f"{name}.npy")
+    return send_file(BytesIO(render_index(values, cmap, vrange)), mimetype="image/png")
 
-            return {"status": "success"}, 200
-        except Exception as e:
-            app.logger.error("Error updating settings: %s", e, exc_info=True)
-            add_log_message(f"Error updating camera settings: {str(e)}", "error")
-            return {"status": "error", "error": f"Internal error: {e}"}, 500
+
+def spectrum_camera(entry):
+    """Spectrum of one pixel of a capture; x is the cross-track and y the along-track pixel."""
+    try:
+        cube, capture_id = capture_cube(entry, request.args.get("capture"))
+    except UnknownCapture as e:
+        api.abort(404, str(e))
+    if cube is None:
+        return "", 204
+    k = getattr(cube, "downsample", 1)
+    rows, n_lines = cube.dc.data.shape[:2]
+    try:
+        x, y = int(request.args["x"]), int(request.args["y"])
+        if not (0 <= x // k < rows and 0 <= y < n_lines):
+            raise ValueError(f"Pixel ({x}, {y}) is outside the {rows * k} x {n_lines} capture")
+    except KeyError as e:
+        return {"status": "error", "error": f"Missing query argument {e}"}, 400
+    except ValueError as e:
+        return {"status": "error", "error": str(e)}, 400
+    wavelengths = cube_wavelengths(cube)
+    return {
+        "status": "success",
+        "capture": str(capture_id),
+        "x": x,
+        "y": y,
+        "wavelengths": None if wavelengths is None else np.round(wavelengths, 2).tolist(),
+        "values": cube.dc.data[x // k, y].astype(float).tolist(),
+    }, 200
+
+
+def history_response(entry=None):
+    """Captures kept in the history (of one camera, or all) and the latest capture of each camera."""
+    entries = [entry] if entry is not None else list(registry)
+    return {
+        "status": "success",
+        "latest": {e.id: str(e.capture_stamp) if e.status()["finished"] and e.capture_stamp else None for e in entries},
+        "captures": capture_history.describe(entry.id if entry is not None else None),
+        "usage": capture_history.usage(),
+    }, 200
+
+
+def open_cube_stream(entry, args):
+    """(byte chunks, headers) streaming a capture of one camera; see cube_stream.py.
+
+    Returns None when no capture has finished. Raises UnknownCapture for an
+    unknown capture id and ValueError for bad arguments.
+    """
+    cube, capture_id = capture_cube(entry, args.get("capture"))
+    if cube is None:
+        return None
+    fmt = args.get("format", "npz")
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    if fmt == "arrow":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ValueError("The arrow format needs the pyarrow package, use npz")
+    wavelengths = cube_wavelengths(cube)
+    line_sel, band_sel = select(cube, wavelengths, args.get("lines"), args.get("bands"), args.get("nm"))
+    latest = getattr(cube, "capture_id", None) is None  # history snapshots are never overwritten
+
+    def check():
+        if latest and not (entry.capture_stamp == capture_id and entry.status()["finished"]):
+            raise StaleCube(f"Capture {capture_id} was overwritten by a new capture")
+
+    def chunks():
+        try:
+            yield from STREAMS[fmt](cube.dc.data, cube.timestamps.data, wavelengths, line_sel, band_sel, check)
+        except StaleCube as e:
+            add_log_message(f"{log_prefix(entry)}Cube stream ended early: {e}", "error")
+            raise
+
+    rows, n_lines, n_bands = cube.dc.data.shape
+    shape = (len(range(*line_sel.indices(n_lines))), rows, len(range(*band_sel.indices(n_bands))))
+    headers = {
+        "Content-Type": FORMATS[fmt],
+        "Content-Disposition": f"attachment; filename={entry.id}-{capture_id}.{fmt}",
+        "Cache-Control": "no-store",
+        "X-Capture-Id": str(capture_id),
+        "X-Cube-Shape": ",".join(map(str, shape)),
+        "X-Cube-Downsample": str(getattr(cube, "downsample", 1)),
+    }
+    return chunks(), headers
+
+
+def cube_camera(entry):
+    try:
+        opened = open_cube_stream(entry, request.args)
+    except UnknownCapture as e:
+        api.abort(404, str(e))
+    except ValueError as e:
+        return {"status": "error", "error": str(e)}, 400
+    if opened is None:
+        return "", 204
+    chunks, headers = opened
+    return Response(chunks, headers=headers, direct_passthrough=True)
+
+
+def telemetry_response(entry):
+    """Telemetry history of one camera between the from/to query arguments (epoch seconds)."""
+    history = telemetry[entry.id]
+    try:
+        t1 = float(request.args.get("to") or time.time())
+        t0 = float(request.args.get("from") or t1 - 3600)
+        if t0 > t1:
+            raise ValueError("from must not be after to")
+        series = history.query(t0, t1, request.args.get("tier") or None)
+    except ValueError as e:
+        return {"status": "error", "error": str(e)}, 400
+    return dict(series, status="success", latest=history.latest), 200
+
+
+def reference_status(entry):
+    try:
+        return entry.cam.reference_status(), 200
+    except Exception as e:
+        return {"status": "error", "error": str(e)}, 500
+
+
+def acquire_reference(entry, kind, n_frames=None):
+    """Average a burst of frames into the dark or flat reference of one camera."""
+    if kind not in REFERENCE_KINDS:
+        api.abort(404, f"Unknown reference '{kind}'")
+    prefix = log_prefix(entry)
+    if not entry.begin_task("reference"):
+        return {"status": "error", "error": "Capture in progress"}, 409
+    try:
+        result = entry.cam.acquire_reference(kind, n_frames)
+    except Exception as e:
+        add_log_message(f"{prefix}Error acquiring {kind} reference: {str(e)}", "error")
+        return {"status": "error", "error": str(e)}, 500
+    finally:
+        entry.end_task()
+    add_log_message(
+        f"{prefix}{kind.capitalize()} reference from {result['n_frames']} frames at "
+        f"{result['exposure_ms']:g} ms (mean {result['mean_dn']:.1f} DN)",
+        "success",
+    )
+    return dict(result, status="success"), 200
+
+
+def clear_reference(entry, kind):
+    if kind not in REFERENCE_KINDS:
+        api.abort(404, f"Unknown reference '{kind}'")
+    result = entry.cam.clear_reference(kind)
+    if result["removed"]:
+        add_log_message(f"{log_prefix(entry)}{kind.capitalize()} reference removed", "info")
+    return dict(result, status="success"), 200
+
+
+def preview_camera(entry, data):
+    """Capture a low-resolution preview on one camera and return it as a PNG.
+
+    The preview is reduced into its own small cube, so the last capture and
+    the camera settings are left as they were.
+    """
+    prefix = log_prefix(entry)
+    try:
+        options = {key: int(data[key]) for key in ("n_lines", "binning", "n_bands") if data.get(key) not in (None, "")}
+        if any(value < 1 for value in options.values()):
+            raise ValueError("n_lines, binning and n_bands must be at least 1")
+    except (TypeError, ValueError) as e:
+        return {"status": "error", "error": f"Input error: {e}"}, 400
+    if entry.remote:
+        if entry.status()["capturing"]:
+            return {"status": "error", "error": "Capture in progress"}, 409
+    elif not entry.begin_task("preview"):
+        return {"status": "error", "error": "Capture in progress"}, 409
+    try:
+        result = entry.cam.preview(**options)
+        png = render_preview(result["cube"], result["band_centres"])
+    except Exception as e:
+        add_log_message(f"{prefix}Error capturing preview: {str(e)}", "error")
+        return {"status": "error", "error": str(e)}, 500
+    finally:
+        if not entry.remote:
+            entry.end_task()
+    n_lines, n_rows, n_bands = result["cube"].shape
+    add_log_message(
+        f"{prefix}Preview of {n_lines} lines ({n_rows} px x {n_bands} bands) in {result['elapsed_ms']:.0f} ms",
+        "info",
+    )
+    response = send_file(BytesIO(png), mimetype="image/png")
+    response.headers["Cache-Control"] = "no-store"
+    response.headers["X-Preview-Shape"] = f"{n_lines},{n_rows},{n_bands}"
+    response.headers["X-Preview-Elapsed-Ms"] = f"{result['elapsed_ms']:.0f}"
+    return response
 
 
 @api.route("/capture")
@@ -513,15 +1236,23 @@ class Capture(Resource):
     @api.response(200, "Capture started or already in progress")
     def post(self):
         """Start the image capture process."""
-        global collection_running
-        with collection_lock:
-            if collection_running:
-                add_log_message("Capture already in progress", "info")
-                return {"status": "Capture already in progress"}, 200
-            thread = threading.Thread(target=run_collection)
-            thread.start()
-        add_log_message("Image capture started", "info")
-        return {"status": "Capture started"}, 200
+        return capture_camera(registry.default)
+
+
+@api.route("/capture/<string:action>")
+class CaptureControl(Resource):
+    @api.response(200, "Capture cancelled, paused or resumed")
+    @api.response(404, "Unknown action")
+    @api.response(409, "No capture in a state the action applies to")
+    def post(self, action):
+        """Cancel, pause or resume the running capture (action: cancel, pause or resume).
+
+        A cancelled capture keeps the lines captured so far, which are shown
+        and saved like a full capture.
+        """
+        if action not in CAPTURE_CONTROLS:
+            api.abort(404, f"Unknown action '{action}'")
+        return control_capture(registry.default, action)
 
 
 @api.route("/save")
@@ -532,85 +1263,397 @@ class SaveFiles(Resource):
     def post(self):
         """Save the captured files to a specified directory."""
         data = request.get_json()
-        save_dir = data.get("save_dir", "/data")
-        try:
-            cam.save(save_dir=save_dir)
-            filepath = (
-                f"{cam.directory}/{cam.timestamps[0].strftime('%Y_%m_%d-%H_%M_%S')}.nc"
-            )
-            add_log_message(f"Files saved to {save_dir}", "success")
-            return {
-                "status": "success",
-                "message": f"Files saved to {save_dir}",
-                "filepath": filepath,
-            }, 200
-        except Exception as e:
-            add_log_message(f"Error saving files: {str(e)}", "error")
-            api.abort(500, str(e))
+        return save_camera(registry.default, data.get("save_dir", registry.default.save_dir), data.get("capture"))
 
 
 @api.route("/status")
 class Status(Resource):
     @api.response(200, "Status retrieved successfully")
     def get(self):
-        """Retrieve the current capture status along with progress details."""
-        with collection_lock:
-            return {
-                "capturing": collection_running,
-                "finished": capture_finished,
-                "progress": capture_progress,
-            }, 200
+        """Retrieve the current capture status along with progress details.
+
+        With deferred processing, `phase` moves from "capturing" to "processing"
+        and the batch conversion reports its own progress under `processing`.
+        Pipelined captures add the grab queue_depth and overruns to `progress`.
+        """
+        return get_capture_status(), 200
 
 
 @api.route("/show")
 class ShowImage(Resource):
     @api.response(200, "Image retrieved successfully")
     @api.response(204, "No Content – capture not finished or image generation error")
+    @api.response(503, "Renderer busy, retry after the Retry-After delay")
     @api.param("hist_eq", "Apply histogram equalization", type="boolean")
     @api.param("robust", "Apply robust contrast stretching", type="boolean")
     @api.param("band", "Band to display (rgb, red, green, blue, nir)", type="string")
     @api.param("stretch", "Contrast stretch percentage", type="integer")
+    @api.param("capture", "Capture id from /api/history (default: the latest capture)", type="string")
     def get(self):
         """Retrieve the captured image as a PNG file with display options."""
-        with collection_lock:
-            if not capture_finished:
-                return "", 204
-
-        # Parse display parameters
-        hist_eq = request.args.get("hist_eq", "false").lower() == "true"
-        robust = request.args.get("robust", "true").lower() == "true"
-        band = request.args.get("band", "rgb")
-        stretch = int(request.args.get("stretch", "0"))
-
-        app.logger.info(
-            f"Showing image with settings - hist_eq: {hist_eq}, robust: {robust}, band: {band}, stretch: {stretch}"
-        )
+        return show_camera(registry.default)
 
-        try:
-            # Note: This is a simplified implementation - the actual implementation
-            # would depend on what parameters the cam.show() method actually supports
 
-            # Basic parameters that cam.show() already supports
-            fig = cam.show(plot_lib="matplotlib", hist_eq=hist_eq, robust=robust)
+@api.route("/history")
+class History(Resource):
+    @api.response(200, "Capture history")
+    def get(self):
+        """Earlier captures kept in memory, newest first.
+
+        Starting a capture moves the previous one into the history, up to
+        OPENHSI_HISTORY_SIZE captures and OPENHSI_HISTORY_MB of memory, least
+        recently used first out. Pass a capture id as `capture` to /api/show,
+        /api/index, /api/spectrum or /api/save to use an earlier capture.
+        """
+        return history_response()
+
+
+@api.route("/spectrum")
+class Spectrum(Resource):
+    @api.response(200, "Spectrum of the pixel")
+    @api.response(204, "No Content – capture not finished")
+    @api.response(400, "Missing or out of range pixel")
+    @api.response(404, "Unknown capture")
+    @api.param("x", "Cross-track pixel", type="integer")
+    @api.param("y", "Along-track pixel (line)", type="integer")
+    @api.param("capture", "Capture id from /api/history (default: the latest capture)", type="string")
+    def get(self):
+        """Spectrum of one pixel of the last capture, with the band wavelengths."""
+        return spectrum_camera(registry.default)
+
+
+@api.route("/index")
+class IndexList(Resource):
+    @api.response(200, "Available spectral indices")
+    def get(self):
+        """Named spectral indices and their formulas."""
+        return {
+            "status": "success",
+            "indices": {name: {"formula": f, "cmap": cmap, "range": r} for name, (f, cmap, r) in INDICES.items()},
+        }, 200
 
-            # Note: Additional parameters like band selection and stretch percentage
-            # would need to be implemented in the camera's show method
-            # For now, we'll just pass the parameters we know work
-        except Exception as e:
-            app.logger.error(f"Error generating image: {e}")
-            return "", 204
 
-        with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmpfile:
-            temp_filename = tmpfile.name
+@api.route("/index/<string:name>")
+class SpectralIndex(Resource):
+    @api.response(200, "Index image or array")
+    @api.response(204, "No Content – capture not finished")
+    @api.response(400, "Invalid expression or display options")
+    @api.response(404, "Unknown index")
+    @api.response(503, "Renderer busy, retry after the Retry-After delay")
+    @api.param("expr", "Formula of the custom index, e.g. (R800 - R670) / (R800 + R670)", type="string")
+    @api.param("format", "png (colour-mapped, default) or npy (float32 array)", type="string")
+    @api.param("cmap", "Matplotlib colour map of the PNG", type="string")
+    @api.param("vmin", "Value shown at the bottom of the colour map", type="number")
+    @api.param("vmax", "Value shown at the top of the colour map", type="number")
+    @api.param("capture", "Capture id from /api/history (default: the latest capture)", type="string")
+    def get(self, name):
+        """Compute a spectral index (ndvi, ndwi or custom) over the last capture.
+
+        Bands are named by wavelength: R670 is the band nearest 670 nm and
+        R640_680 the mean of the bands between 640 and 680 nm. The result has
+        the orientation of /api/show; pixels where the formula is undefined
+        are transparent in the PNG and NaN in the array.
+        """
+        return index_camera(registry.default, name)
+
+
+@api.route("/cube")
+class Cube(Resource):
+    @api.response(200, "Datacube stream")
+    @api.response(204, "No Content – capture not finished")
+    @api.response(400, "Invalid format or selection")
+    @api.response(404, "Unknown capture")
+    @api.param("format", "npz (default, read with np.load) or arrow (Arrow IPC stream)", type="string")
+    @api.param("lines", "Along-track lines as start:stop[:step]", type="string")
+    @api.param("bands", "Bands as start:stop[:step]", type="string")
+    @api.param("nm", "Bands between two wavelengths, lo:hi in nm (instead of bands)", type="string")
+    @api.param("capture", "Capture id from /api/history (default: the latest capture)", type="string")
+    def get(self):
+        """Stream the last capture straight from memory, with its timestamps and wavelengths.
+
+        The cube is sent as (lines, cross-track, bands), in chunks of lines,
+        without writing a file. The stream ends with an error if a new
+        capture overwrites the cube while it is being sent.
+        """
+        return cube_camera(registry.default)
+
+
+@api.route("/telemetry")
+class Telemetry(Resource):
+    @api.response(200, "Telemetry retrieved successfully")
+    @api.response(400, "Invalid time range or tier")
+    @api.param("from", "Start of the span in epoch seconds (default one hour before to)", type="number")
+    @api.param("to", "End of the span in epoch seconds (default now)", type="number")
+    @api.param("tier", "Force a resolution (1s, 1m or 1h) instead of choosing one for the span", type="string")
+    def get(self):
+        """Sensor temperature and line rate history.
+
+        Samples are taken every second, idle or not, and kept at 1 s resolution
+        for an hour, 1 min for a day and 1 h for 90 days. The response uses the
+        finest tier that covers the span in at most 2000 points, with the mean,
+        min and max of each field per point.
+        """
+        return telemetry_response(registry.default)
+
+
+@api.route("/preview")
+class Preview(Resource):
+    @api.expect(preview_model)
+    @api.response(200, "Preview PNG")
+    @api.response(400, "Invalid preview options")
+    @api.response(409, "Camera busy")
+    def post(self):
+        """Capture a fast low-resolution preview for framing and return it as a PNG.
+
+        Captures 128 lines (n_lines), averages cross-track rows in blocks of 4
+        (binning) and reduces the spectrum to 16 bands (n_bands), rendered as
+        an RGB quicklook. The camera settings and the last capture are kept.
+        """
+        return preview_camera(registry.default, request.get_json(silent=True) or {})
+
+
+@api.route("/reference")
+class ReferenceStatus(Resource):
+    @api.response(200, "Reference status retrieved successfully")
+    def get(self):
+        """Which dark/flat references exist for the current exposure, binning and pixel format."""
+        return reference_status(registry.default)
+
+
+@api.route("/reference/<string:kind>")
+class Reference(Resource):
+    @api.expect(reference_model)
+    @api.response(200, "Reference acquired")
+    @api.response(404, "Unknown reference kind")
+    @api.response(409, "Camera busy")
+    def post(self, kind):
+        """Acquire the dark or flat reference for the current settings.
+
+        Averages a burst of raw frames (64 unless n_frames is given). Cover the
+        lens for a dark reference and point at a uniform target for a flat one.
+        Matching references are then applied to every captured frame as
+        (frame - dark) * flat gain.
+        """
+        data = request.get_json(silent=True) or {}
+        return acquire_reference(registry.default, kind, data.get("n_frames"))
+
+    @api.response(200, "Reference removed")
+    @api.response(404, "Unknown reference kind")
+    def delete(self, kind):
+        """Remove the dark or flat reference for the current settings."""
+        return clear_reference(registry.default, kind)
+
+
+# -------------------------------------------------------------------------
+# Multi-camera endpoints. Each camera in the registry has its own capture
+# thread, progress and save directory.
+@api.route("/cameras")
+class CameraList(Resource):
+    @api.response(200, "Cameras listed successfully")
+    def get(self):
+        """List the configured cameras with their capture status."""
+        return {"cameras": [entry.describe() for entry in registry]}, 200
+
+
+@api.route("/cameras/capture_all")
+class CaptureAll(Resource):
+    @api.response(200, "Captures started")
+    def post(self):
+        """Start a synchronised capture on every idle camera."""
         try:
-            hv.save(fig, temp_filename, fmt="png")
-            with open(temp_filename, "rb") as f:
-                img_data = f.read()
-            buf = BytesIO(img_data)
-            buf.seek(0)
-            return send_file(buf, mimetype="image/png")
-        finally:
-            os.remove(temp_filename)
+            check_capture_space([entry for entry in registry if not entry.status()["capturing"]])
+        except InsufficientSpace as e:
+            add_log_message(f"Synchronised capture not started: {e}", "error")
+            return {"status": "error", "error": str(e)}, 507
+        started = start_capture_all()
+        busy = [entry.id for entry in registry if entry.id not in started]
+        add_log_message(
+            f"Synchronised capture started on {', '.join(started) or 'no cameras'}"
+            + (f" ({', '.join(busy)} busy)" if busy else ""),
+            "info",
+        )
+        return {"status": "Capture started", "started": started, "busy": busy}, 200
+
+    @api.response(200, "Status retrieved successfully")
+    def get(self):
+        """Per-camera status, start time and line rate of the last capture.
+
+        line_rate_hz is measured from the line timestamps once a camera has
+        finished; start_skew_ms is how far apart the cameras started.
+        """
+        cameras = {}
+        for entry in registry:
+            cameras[entry.id] = dict(
+                entry.status(), started_ns=entry.started_ns, line_rate_hz=entry.line_rate()
+            )
+        starts = [c["started_ns"] for c in cameras.values() if c["started_ns"]]
+        skew = (max(starts) - min(starts)) / 1e6 if len(starts) > 1 else 0
+        return {"cameras": cameras, "start_skew_ms": skew}, 200
+
+
+@api.route("/cameras/<string:cam_id>/status")
+class CameraStatus(Resource):
+    @api.response(200, "Status retrieved successfully")
+    @api.response(404, "Unknown camera")
+    def get(self, cam_id):
+        """Capture status of one camera, as /api/status."""
+        entry = get_camera_entry(cam_id)
+        return dict(entry.status(), line_rate_hz=entry.line_rate()), 200
+
+
+@api.route("/cameras/<string:cam_id>/capture")
+class CameraCapture(Resource):
+    @api.response(200, "Capture started or already in progress")
+    @api.response(404, "Unknown camera")
+    def post(self, cam_id):
+        """Start a capture on one camera."""
+        return capture_camera(get_camera_entry(cam_id))
+
+
+@api.route("/cameras/<string:cam_id>/capture/<string:action>")
+class CameraCaptureControl(Resource):
+    @api.response(200, "Capture cancelled, paused or resumed")
+    @api.response(404, "Unknown camera or action")
+    @api.response(409, "No capture in a state the action applies to")
+    def post(self, cam_id, action):
+        """Cancel, pause or resume the running capture of one camera, as /api/capture/<action>."""
+        entry = get_camera_entry(cam_id)
+        if action not in CAPTURE_CONTROLS:
+            api.abort(404, f"Unknown action '{action}'")
+        return control_capture(entry, action)
+
+
+@api.route("/cameras/<string:cam_id>/save")
+class CameraSave(Resource):
+    @api.response(200, "Files saved successfully")
+    @api.response(404, "Unknown camera")
+    @api.response(500, "Error occurred while saving files")
+    def post(self, cam_id):
+        """Save the last capture of one camera, by default to its own save directory."""
+        entry = get_camera_entry(cam_id)
+        data = request.get_json(silent=True) or {}
+        return save_camera(entry, data.get("save_dir") or entry.save_dir, data.get("capture"))
+
+
+@api.route("/cameras/<string:cam_id>/show")
+class CameraShow(Resource):
+    @api.response(200, "Image retrieved successfully")
+    @api.response(204, "No Content – capture not finished or image generation error")
+    @api.response(503, "Renderer busy, retry after the Retry-After delay")
+    @api.response(404, "Unknown camera")
+    @api.param("hist_eq", "Apply histogram equalization", type="boolean")
+    @api.param("robust", "Apply robust contrast stretching", type="boolean")
+    def get(self, cam_id):
+        """Retrieve the last capture of one camera as a PNG file."""
+        return show_camera(get_camera_entry(cam_id))
+
+
+@api.route("/cameras/<string:cam_id>/history")
+class CameraHistory(Resource):
+    @api.response(200, "Capture history")
+    @api.response(404, "Unknown camera")
+    def get(self, cam_id):
+        """Earlier captures of one camera kept in memory, as /api/history."""
+        return history_response(get_camera_entry(cam_id))
+
+
+@api.route("/cameras/<string:cam_id>/spectrum")
+class CameraSpectrum(Resource):
+    @api.response(200, "Spectrum of the pixel")
+    @api.response(204, "No Content – capture not finished")
+    @api.response(400, "Missing or out of range pixel")
+    @api.response(404, "Unknown camera or capture")
+    def get(self, cam_id):
+        """Spectrum of one pixel of a capture of one camera, as /api/spectrum."""
+        return spectrum_camera(get_camera_entry(cam_id))
+
+
+@api.route("/cameras/<string:cam_id>/cube")
+class CameraCube(Resource):
+    @api.response(200, "Datacube stream")
+    @api.response(204, "No Content – capture not finished")
+    @api.response(400, "Invalid format or selection")
+    @api.response(404, "Unknown camera or capture")
+    def get(self, cam_id):
+        """Stream the last capture of one camera, as /api/cube."""
+        return cube_camera(get_camera_entry(cam_id))
+
+
+@api.route("/cameras/<string:cam_id>/index/<string:name>")
+class CameraSpectralIndex(Resource):
+    @api.response(200, "Index image or array")
+    @api.response(204, "No Content – capture not finished")
+    @api.response(400, "Invalid expression or display options")
+    @api.response(404, "Unknown camera or index")
+    @api.response(503, "Renderer busy, retry after the Retry-After delay")
+    def get(self, cam_id, name):
+        """Compute a spectral index over the last capture of one camera, as /api/index/<name>."""
+        return index_camera(get_camera_entry(cam_id), name)
+
+
+@api.route("/cameras/<string:cam_id>/update_settings")
+class CameraSettings(Resource):
+    @api.expect(full_settings_model, validate=True)
+    @api.response(200, "Settings updated successfully")
+    @api.response(400, "Invalid input")
+    @api.response(404, "Unknown camera")
+    @api.response(409, "Camera busy")
+    def post(self, cam_id):
+        """Update the settings of one camera, as /api/update_settings."""
+        return update_camera_settings(get_camera_entry(cam_id), request.get_json())
+
+
+@api.route("/cameras/<string:cam_id>/telemetry")
+class CameraTelemetry(Resource):
+    @api.response(200, "Telemetry retrieved successfully")
+    @api.response(400, "Invalid time range or tier")
+    @api.response(404, "Unknown camera")
+    def get(self, cam_id):
+        """Temperature and line rate history of one camera, as /api/telemetry."""
+        return telemetry_response(get_camera_entry(cam_id))
+
+
+@api.route("/cameras/<string:cam_id>/preview")
+class CameraPreview(Resource):
+    @api.expect(preview_model)
+    @api.response(200, "Preview PNG")
+    @api.response(400, "Invalid preview options")
+    @api.response(404, "Unknown camera")
+    @api.response(409, "Camera busy")
+    def post(self, cam_id):
+        """Capture a preview on one camera, as /api/preview."""
+        return preview_camera(get_camera_entry(cam_id), request.get_json(silent=True) or {})
+
+
+@api.route("/cameras/<string:cam_id>/reference")
+class CameraReferenceStatus(Resource):
+    @api.response(200, "Reference status retrieved successfully")
+    @api.response(404, "Unknown camera")
+    def get(self, cam_id):
+        """Reference status of one camera, as /api/reference."""
+        return reference_status(get_camera_entry(cam_id))
+
+
+@api.route("/cameras/<string:cam_id>/reference/<string:kind>")
+class CameraReference(Resource):
+    @api.expect(reference_model)
+    @api.response(200, "Reference acquired")
+    @api.response(404, "Unknown camera or reference kind")
+    @api.response(409, "Camera busy")
+    def post(self, cam_id, kind):
+        """Acquire the dark or flat reference of one camera, as /api/reference/<kind>."""
+        data = request.get_json(silent=True) or {}
+        return acquire_reference(get_camera_entry(cam_id), kind, data.get("n_frames"))
+
+    @api.response(200, "Reference removed")
+    @api.response(404, "Unknown camera or reference kind")
+    def delete(self, cam_id, kind):
+        """Remove the dark or flat reference of one camera."""
+        return clear_reference(get_camera_entry(cam_id), kind)
+
+
+# Files the browser offers to view inline.
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif")
 
 
 # New endpoints for browsing directories recursively.
@@ -642,233 +1685,51 @@ def browse(subpath):
       404:
         description: Not Found - The specified directory does not exist.
     """
-    base_dir = "/data"
+    base_dir = DATA_DIR
     current_dir = os.path.join(base_dir, subpath)
     # Ensure the current_dir is within base_dir to prevent directory traversal
     if not os.path.abspath(current_dir).startswith(os.path.abspath(base_dir)):
         abort(403)
     if not os.path.isdir(current_dir):
         abort(404)
-    try:
-        items = os.listdir(current_dir)
-    except Exception as e:
-        items = []
     dirs = []
     files = []
-    for item in items:
-        full_path = os.path.join(current_dir, item)
-        if os.path.isdir(full_path):
-            dirs.append(item)
-        else:
-            files.append(item)
-
-    # Build HTML page with improved styling and file management
-    html = """<!doctype html>
-    <html>
-    <head>
-        <title>Browse Files</title>
-        <link rel="stylesheet" href="/static/css/bootstrap.min.css">
-        <script src="/static/js/bootstrap.bundle.min.js"></script>
-        <style>
-            body { padding: 20px; }
-            h1 { color: #2A7AE2; margin-bottom: 20px; }
-            .file-browser { margin-top: 20px; }
-            .file-actions { display: flex; gap: 8px; }
-            .file-image-modal img { max-width: 100%; }
-        </style>
-    </head>
-    <body>
-    <div class="container">
-        <h1>Browsing: {path_display}</h1>
-        
-        <div class="row">
-            <div class="col-md-12">
-                <nav aria-label="breadcrumb">
-                    <ol class="breadcrumb">
-                        <li class="breadcrumb-item"><a href="/browse/">Root</a></li>
-    """
+    try:
+        # scandir gets the entry type from the directory listing itself, without
+        # a stat call per entry.
+        with os.scandir(current_dir) as it:
+            for entry in it:
+                (dirs if entry.is_dir() else files).append(entry.name)
+    except OSError:
+        pass
 
     # Add breadcrumbs for navigation
     path_parts = subpath.split(os.sep) if subpath else []
+    breadcrumbs = []
     path_so_far = ""
     for i, part in enumerate(path_parts):
         if not part:  # Skip empty parts
             continue
         path_so_far = os.path.join(path_so_far, part)
-        if i == len(path_parts) - 1:  # Last part is current directory
-            html += (
-                f'<li class="breadcrumb-item active" aria-current="page">{part}</li>'
-            )
-        else:
-            html += f'<li class="breadcrumb-item"><a href="/browse/{path_so_far}">{part}</a></li>'
-
-    html += """
-                    </ol>
-                </nav>
-            </div>
-        </div>
-        
-        <div class="row">
-            <div class="col-md-12">
-                <div class="card file-browser">
-                    <div class="card-header d-flex justify-content-between align-items-center">
-                        <span>Files and Directories</span>
-                        <a href="/" class="btn btn-sm btn-outline-primary">Return to main page</a>
-                    </div>
-                    <div class="card-body">
-                        <table class="table table-hover">
-                            <thead>
-                                <tr>
-                                    <th>Type</th>
-                                    <th>Name</th>
-                                    <th>Actions</th>
-                                </tr>
-                            </thead>
-                            <tbody>
-    """
-
-    # Add parent directory link if not at root
-    if subpath:
-        parent = os.path.dirname(subpath)
-        html += f"""
-                                <tr>
-                                    <td><i class="bi bi-folder"></i></td>
-                                    <td><a href="/browse/{parent}">..</a></td>
-                                    <td></td>
-                                </tr>
-        """
-
-    # Add directories
-    for d in sorted(dirs):
-        new_subpath = os.path.join(subpath, d)
-        html += f"""
-                                <tr>
-                                    <td><span class="badge bg-primary">DIR</span></td>
-                                    <td><a href="/browse/{new_subpath}">{d}</a></td>
-                                    <td>
-                                        <div class="file-actions">
-                                            <button class="btn btn-sm btn-outline-danger" onclick="deleteFolder('{new_subpath}')">Delete</button>
-                                        </div>
-                                    </td>
-                                </tr>
-        """
-
-    # Add files with actions
-    for f in sorted(files):
-        new_path = os.path.join(subpath, f)
-        file_ext = os.path.splitext(f)[1].lower()
-
-        actions = f'<div class="file-actions">'
-
-        # Different action based on file type
-        if file_ext in [".png", ".jpg", ".jpeg", ".gif"]:
-            # Image files - view in browser
-            actions += f'<a href="/api/view/{new_path}" class="btn btn-sm btn-outline-info" target="_blank">View</a>'
-            actions += f'<a href="/api/download/{new_path}" class="btn btn-sm btn-outline-secondary">Download</a>'
-        else:
-            # Other files - direct download
-            actions += f'<a href="/api/download/{new_path}" class="btn btn-sm btn-outline-secondary">Download</a>'
-
-        # Add delete button for all files
-        actions += f'<button class="btn btn-sm btn-outline-danger" onclick="deleteFile(\'{new_path}\')">Delete</button>'
-        actions += "</div>"
-
-        html += f"""
-                                <tr>
-                                    <td><span class="badge bg-secondary">FILE</span></td>
-                                    <td>{f}</td>
-                                    <td>{actions}</td>
-                                </tr>
-        """
-
-    # Close the table and add JavaScript for delete functionality
-    html += """
-                            </tbody>
-                        </table>
-                    </div>
-                </div>
-            </div>
-        </div>
-    </div>
-    
-    <!-- Delete confirmation modal -->
-    <div class="modal fade" id="deleteModal" tabindex="-1" aria-labelledby="deleteModalLabel" aria-hidden="true">
-        <div class="modal-dialog">
-            <div class="modal-content">
-                <div class="modal-header">
-                    <h5 class="modal-title" id="deleteModalLabel">Confirm Delete</h5>
-                    <button type="button" class="btn-close" data-bs-dismiss="modal" aria-label="Close"></button>
-                </div>
-                <div class="modal-body">
-                    Are you sure you want to delete this file?
-                    <p id="fileToDelete" class="fw-bold mt-2"></p>
-                </div>
-                <div class="modal-footer">
-                    <button type="button" class="btn btn-secondary" data-bs-dismiss="modal">Cancel</button>
-                    <button type="button" class="btn btn-danger" id="confirmDelete">Delete</button>
-                </div>
-            </div>
-        </div>
-    </div>
-    
-    <script>
-        let filePathToDelete = '';
-        let folderPathToDelete = '';
-        const deleteModal = new bootstrap.Modal(document.getElementById('deleteModal'));
-        
-        function deleteFile(path) {
-            filePathToDelete = path;
-            folderPathToDelete = '';
-            document.getElementById('fileToDelete').textContent = 'File: ' + path;
-            deleteModal.show();
-        }
-        
-        function deleteFolder(path) {
-            folderPathToDelete = path;
-            filePathToDelete = '';
-            document.getElementById('fileToDelete').textContent = 'Folder: ' + path;
-            deleteModal.show();
-        }
-        
-        document.getElementById('confirmDelete').addEventListener('click', function() {
-            let apiUrl, itemType;
-            
-            if (filePathToDelete) {
-                apiUrl = '/api/delete/' + filePathToDelete;
-                itemType = 'file';
-            } else if (folderPathToDelete) {
-                apiUrl = '/api/delete_folder/' + folderPathToDelete;
-                itemType = 'folder';
+        breadcrumbs.append((part, path_so_far, i == len(path_parts) - 1))
+
+    # The rows are generated lazily so that the template streams them to the
+    # client as it renders, instead of building the whole page first.
+    return stream_template(
+        "browse.html",
+        path_display=f"/{subpath}" if subpath else DATA_DIR,
+        breadcrumbs=breadcrumbs,
+        parent=os.path.dirname(subpath) if subpath else None,
+        dirs=({"name": d, "path": os.path.join(subpath, d)} for d in sorted(dirs)),
+        files=(
+            {
+                "name": f,
+                "path": os.path.join(subpath, f),
+                "image": os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS,
             }
-            
-            // Send API request to delete the file or folder
-            fetch(apiUrl, { method: 'DELETE' })
-                .then(response => response.json())
-                .then(data => {
-                    if (data.status === 'success') {
-                        // Reload the page to update the file list
-                        window.location.reload();
-                    } else {
-                        alert('Error deleting ' + itemType + ': ' + data.message);
-                    }
-                })
-                .catch(error => {
-                    console.error('Error:', error);
-                    alert('Error deleting ' + itemType);
-                })
-                .finally(() => {
-                    deleteModal.hide();
-                });
-        });
-    </script>
-    </body>
-    </html>
-    """
-
-    path_display = f"/{subpath}" if subpath else "/data"
-    html = html.replace("{path_display}", path_display)
-
-    return html
+            for f in sorted(files)
+        ),
+    )
 
 
 @api.route("/view/<path:filename>")
@@ -878,7 +1739,7 @@ class ViewFile(Resource):
     @api.response(404, "File not found")
     def get(self, filename):
         """View a file (especially images) in the browser without downloading."""
-        data_dir = "/data"
+        data_dir = DATA_DIR
         # Check if the path is safe (within /data directory)
         full_path = os.path.join(data_dir, filename)
         if not os.path.abspath(full_path).startswith(os.path.abspath(data_dir)):
@@ -899,7 +1760,7 @@ class Download(Resource):
     @api.response(404, "File not found")
     def get(self, filename):
         """Download a file from the data directory."""
-        data_dir = "/data"
+        data_dir = DATA_DIR
         # Check if the path is safe (within /data directory)
         full_path = os.path.join(data_dir, filename)
         if not os.path.abspath(full_path).startswith(os.path.abspath(data_dir)):
@@ -917,7 +1778,7 @@ class DeleteFile(Resource):
     @api.response(500, "Error occurred while deleting file")
     def delete(self, filename):
         """Delete a file from the data directory."""
-        data_dir = "/data"
+        data_dir = DATA_DIR
         # Check if the path is safe (within /data directory)
         full_path = os.path.join(data_dir, filename)
         if not os.path.abspath(full_path).startswith(os.path.abspath(data_dir)):
@@ -933,6 +1794,7 @@ class DeleteFile(Resource):
         try:
             # Delete the file
             os.remove(full_path)
+            storage.forget(full_path)
             app.logger.info(f"Deleted file: {full_path}")
             return {
                 "status": "success",
@@ -953,7 +1815,7 @@ class DeleteFolder(Resource):
     @api.response(500, "Error occurred while deleting folder")
     def delete(self, foldername):
         """Delete an empty folder from the data directory."""
-        data_dir = "/data"
+        data_dir = DATA_DIR
         # Check if the path is safe (within /data directory)
         full_path = os.path.join(data_dir, foldername)
         if not os.path.abspath(full_path).startswith(os.path.abspath(data_dir)):
@@ -976,6 +1838,7 @@ class DeleteFolder(Resource):
 
             # Delete the empty folder
             os.rmdir(full_path)
+            storage.forget(full_path)
             app.logger.info(f"Deleted folder: {full_path}")
             return {
                 "status": "success",
@@ -986,6 +1849,158 @@ class DeleteFolder(Resource):
             return {"status": "error", "message": f"Error deleting folder: {str(e)}"}, 500
 
 
+@api.route("/delete_batch")
+class DeleteBatch(Resource):
+    @api.expect(delete_batch_model, validate=True)
+    @api.response(202, "Deletion job started")
+    @api.response(400, "Neither or both of paths and a filter, or an invalid date")
+    @api.response(403, "Forbidden - Cannot delete outside data directory")
+    def post(self):
+        """Delete many files at once as a background job.
+
+        Give either `paths` (files, or folders deleted with everything in
+        them) or a filter over the files under `folder`: `glob`, `before`
+        and/or `after`. Follow the job at /api/jobs/<id>.
+        """
+        data = request.get_json()
+        try:
+            selection = Selection(
+                DATA_DIR,
+                paths=data.get("paths"),
+                folder=data.get("folder", ""),
+                pattern=data.get("glob"),
+                before=data.get("before"),
+                after=data.get("after"),
+            )
+        except OutsideDataDir as e:
+            return {"status": "error", "message": str(e)}, 403
+        except ValueError as e:
+            return {"status": "error", "message": str(e)}, 400
+        dry_run = bool(data.get("dry_run"))
+        params = {k: v for k, v in data.items() if k != "paths"}
+        if data.get("paths"):
+            params["n_paths"] = len(data["paths"])  # the list itself can be thousands long
+        job = jobs.submit("delete", lambda job: run_deletion(job, selection, storage.forget, dry_run), params)
+        if not dry_run:
+            add_log_message(f"Job {job.id}: deleting files", "info")
+        return {"status": "success", "job": job.describe()}, 202
+
+
+@api.route("/reprocess")
+class Reprocess(Resource):
+    @api.expect(reprocess_model, validate=True)
+    @api.response(202, "Reprocessing job started")
+    @api.response(400, "Invalid level, files or filter")
+    @api.response(403, "Forbidden - Outside the data or calibration directory")
+    @api.response(409, "A reprocessing job is already running")
+    def post(self):
+        """Reprocess saved raw captures at another processing level as a background job.
+
+        Select captures like /api/delete_batch, by `paths` or a filter over
+        `folder` (`glob` defaults to *.nc). Each is written to
+        <name>_lvl<processing_lvl>.nc next to it, on a pool of worker
+        processes. Follow the job at /api/jobs/<id>.
+        """
+        data = request.get_json()
+        lvl = data["processing_lvl"]
+        if not 0 <= lvl <= 8:
+            return {"status": "error", "message": "processing_lvl must be between 0 and 8"}, 400
+        try:
+            settings_path = calibration_file(data.get("json_path"), json_path)
+            calibration_path = calibration_file(data.get("cal_path"), cal_path)
+        except OutsideDataDir as e:
+            return {"status": "error", "message": str(e)}, 403
+        for path in (settings_path, calibration_path):
+            if not os.path.isfile(path):
+                return {"status": "error", "message": f"No such file: {path}"}, 400
+        try:
+            selection = Selection(
+                DATA_DIR,
+                paths=data.get("paths"),
+                folder=data.get("folder", ""),
+                pattern=data.get("glob") or (None if data.get("paths") else "*.nc"),
+                before=data.get("before"),
+                after=data.get("after"),
+            )
+        except OutsideDataDir as e:
+            return {"status": "error", "message": str(e)}, 403
+        except ValueError as e:
+            return {"status": "error", "message": str(e)}, 400
+        params = {k: v for k, v in data.items() if k != "paths"}
+        if data.get("paths"):
+            params["n_paths"] = len(data["paths"])
+        job = jobs.submit(
+            "reprocess",
+            lambda job: run_reprocess(
+                job,
+                selection,
+                lvl,
+                settings_path,
+                calibration_path,
+                overwrite=bool(data.get("overwrite")),
+                workers=REPROCESS_WORKERS,
+                record=storage.record,
+                check_space=lambda nbytes: storage.check_space(nbytes, prune=False),
+            ),
+            params,
+            exclusive=True,
+        )
+        if job is None:
+            return {"status": "error", "message": "A reprocessing job is already running"}, 409
+        add_log_message(f"Job {job.id}: reprocessing captures to level {lvl}", "info")
+        return {"status": "success", "job": job.describe()}, 202
+
+
+def calibration_file(requested, default):
+    """Settings or calibration file to reprocess with: `requested` or the server's own `default`.
+
+    Relative paths are taken from the data directory. Raises OutsideDataDir for
+    files outside both the data directory and the directory of `default`.
+    """
+    if not requested:
+        return default
+    path = os.path.abspath(os.path.join(DATA_DIR, requested))
+    roots = (os.path.abspath(DATA_DIR), os.path.dirname(os.path.abspath(default)))
+    if not any(within(root, path) for root in roots):
+        raise OutsideDataDir(f"'{requested}' is outside the data and calibration directories")
+    return path
+
+
+@api.route("/jobs")
+class Jobs(Resource):
+    @api.response(200, "Jobs retrieved successfully")
+    @api.param("kind", "Only jobs of this kind, e.g. delete", type="string")
+    def get(self):
+        """Background jobs, newest first, with their progress or result."""
+        return {"status": "success", "jobs": jobs.describe(request.args.get("kind"))}, 200
+
+
+@api.route("/jobs/<string:job_id>")
+class JobStatus(Resource):
+    @api.response(200, "Job retrieved successfully")
+    @api.response(404, "Unknown job")
+    def get(self, job_id):
+        """State, progress and result of one job."""
+        job = jobs.get(job_id)
+        if job is None:
+            api.abort(404, f"Unknown job '{job_id}'")
+        return {"status": "success", "job": job.describe()}, 200
+
+
+@api.route("/jobs/<string:job_id>/cancel")
+class JobCancel(Resource):
+    @api.response(200, "Job cancelled")
+    @api.response(404, "Unknown job")
+    @api.response(409, "The job has already ended")
+    def post(self, job_id):
+        """Stop a job after the file in hand; what it has done so far is kept."""
+        if jobs.get(job_id) is None:
+            api.abort(404, f"Unknown job '{job_id}'")
+        if not jobs.cancel(job_id):
+            return {"status": "error", "message": "The job has already ended"}, 409
+        return {"status": "success", "job": jobs.get(job_id).describe()}, 200
+
+
 @api.route("/file_list")
 class FileList(Resource):
     @api.param(
@@ -996,7 +2011,7 @@ class FileList(Resource):
     @api.response(404, "Directory not found")
     def get(self):
         """Get a list of all files in the specified directory."""
-        data_dir = "/data"
+        data_dir = DATA_DIR
         folder = request.args.get("folder", "")
 
         # Build the target directory path
@@ -1060,20 +2075,39 @@ class FileList(Resource):
             return {"status": "error", "message": f"Error listing files: {str(e)}"}, 500
 
 
+@api.route("/storage")
+class Storage(Resource):
+    @api.response(200, "Storage usage retrieved successfully")
+    def get(self):
+        """Disk usage of the data directory, from the incrementally updated index.
+
+        `indexed` is false until the startup walk of the data directory has
+        finished. Captures are refused when they would leave less than
+        min_free_bytes free; with retention on, the oldest captures are deleted
+        instead.
+        """
+        return dict(storage.usage(), status="success"), 200
+
+
 @api.route("/logs")
 class LogMessages(Resource):
     @api.response(200, "Log messages retrieved successfully")
     def get(self):
-        """Retrieve the log messages."""
+        """Retrieve the log messages. Answers 304 while they are unchanged."""
         with log_lock:
-            return {"status": "success", "logs": log_messages}, 200
+            tag = f"logs-{log_version}"
+            cached = compression.not_modified(tag)
+            if cached:
+                return cached
+            return {"status": "success", "logs": log_messages}, 200, compression.etag_header(tag)
 
     @api.response(200, "Log messages cleared successfully")
     def delete(self):
         """Clear the log messages."""
         with log_lock:
-            global log_messages
+            global log_messages, log_version
             log_messages = []
+            log_version += 1
             return {"status": "success", "message": "Log messages cleared"}, 200
 
 
@@ -1166,7 +2200,20 @@ class SystemTime(Resource):
                 "status": "error",
                 "error": f"Internal error: {str(e)}",
             }, 500
+
+
+def start():
+    """Open the cameras and start the background threads; call once before serving."""
+    global registry, telemetry_sampler
+    registry = open_cameras()
+    storage.start()
+    telemetry.update((entry.id, TelemetryHistory()) for entry in registry)
+    telemetry_sampler = TelemetrySampler([(telemetry[entry.id], telemetry_sample(entry)) for entry in registry])
+    telemetry_sampler.start()
+
+
 if __name__ == "__main__":
+    start()
     # Add initial log message
     add_log_message("Server started", "success")
     app.run(debug=False, threaded=True)
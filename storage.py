@@ -0,0 +1,231 @@
+"""
+Storage manager for the data directory.
+
+Keeps an index of the files under the data directory (path -> size, mtime)
+so disk usage can be reported without walking the tree. The directory is
+walked once, on a background thread at startup; after that the index is
+kept current by the server's own hooks, which call `record` after a save and
+`forget` after a delete.
+
+Captures are checked against the free space before they start, using the
+size of the cube they will produce. With retention enabled, the oldest saved
+captures (a `.nc` file and the files sharing its name, e.g. the `.png`
+quicklook) are pruned whenever free space drops below the watermark.
+"""
+import os
+import shutil
+import threading
+
+# Bytes per pixel of each camera pixel format; other formats are stored in 16 bits.
+PIXEL_FORMAT_BYTES = {"Mono8": 1}
+# The file that identifies a saved capture; files sharing its stem belong to it.
+CAPTURE_EXTENSION = ".nc"
+
+
+def expected_cube_bytes(settings, n_lines):
+    """Size of the cube a capture with `settings` will save.
+
+    n_lines x resolution x pixel size of the raw frames, an upper bound for
+    processed cubes too, since cropping and binning shrink them further than
+    radiance conversion grows them.
+    """
+    rows, cols = settings["resolution"]
+    return int(n_lines) * int(rows) * int(cols) * PIXEL_FORMAT_BYTES.get(settings.get("pixel_format"), 2)
+
+
+class InsufficientSpace(Exception):
+    def __init__(self, required, available):
+        super().__init__(
+            f"Not enough free space: {required / 2**20:.0f} MB needed, {max(available, 0) / 2**20:.0f} MB available"
+        )
+        self.required = required
+        self.available = available
+
+
+class StorageManager:
+    """Incrementally updated usage index of a data directory, with optional retention."""
+
+    def __init__(self, data_dir, min_free_bytes=0, retention=False):
+        self.data_dir = os.path.abspath(data_dir)
+        self.min_free_bytes = min_free_bytes
+        self.retention = retention
+        self.files = {}  # absolute path -> (size, mtime)
+        self.used_bytes = 0
+        self.lock = threading.Lock()
+        self.prune_lock = threading.Lock()
+        self.indexed = threading.Event()
+        self.wake = threading.Event()
+        self.thread = None
+        # Called with the result of each background prune, e.g. to log it.
+        self.on_prune = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="openhsi-storage", daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        scanned = self._scan(self.data_dir)
+        with self.lock:
+            # Keep anything the hooks recorded while the walk was running.
+            scanned.update(self.files)
+            self.files = scanned
+            self.used_bytes = sum(size for size, _ in scanned.values())
+        self.indexed.set()
+        while True:
+            if self.retention:
+                result = self.enforce_watermark()
+                if result["removed"] and self.on_prune:
+                    self.on_prune(result)
+            self.wake.wait()
+            self.wake.clear()
+
+    def _scan(self, path):
+        """{path: (size, mtime)} of every file under `path`."""
+        found = {}
+        stack = [path]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append(entry.path)
+                            elif entry.is_file(follow_symlinks=False):
+                                st = entry.stat(follow_symlinks=False)
+                                found[entry.path] = (st.st_size, st.st_mtime)
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+        return found
+
+    def _within(self, path):
+        return path == self.data_dir or path.startswith(self.data_dir + os.sep)
+
+    # Hooks -----------------------------------------------------------------
+    def record(self, *paths):
+        """Add or refresh files (or whole directories) that were just written."""
+        for path in paths:
+            path = os.path.abspath(path)
+            if not self._within(path):
+                continue
+            if os.path.isdir(path):
+                found = self._scan(path)
+            else:
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                found = {path: (st.st_size, st.st_mtime)}
+            with self.lock:
+                for name, info in found.items():
+                    old = self.files.get(name)
+                    self.used_bytes += info[0] - (old[0] if old else 0)
+                    self.files[name] = info
+        self.wake.set()
+
+    def forget(self, path):
+        """Drop a deleted file, or everything under a deleted directory."""
+        path = os.path.abspath(path)
+        prefix = path + os.sep
+        with self.lock:
+            if path in self.files:
+                self.used_bytes -= self.files.pop(path)[0]
+            elif any(name.startswith(prefix) for name in self.files):
+                for name in [name for name in self.files if name.startswith(prefix)]:
+                    self.used_bytes -= self.files.pop(name)[0]
+
+    # Queries ---------------------------------------------------------------
+    def disk_usage(self, path=None):
+        """shutil.disk_usage of `path` (default the data dir), or its nearest existing parent."""
+        path = os.path.abspath(path or self.data_dir)
+        while not os.path.exists(path) and os.path.dirname(path) != path:
+            path = os.path.dirname(path)
+        return shutil.disk_usage(path)
+
+    def usage(self):
+        disk = self.disk_usage()
+        with self.lock:
+            used, n_files = self.used_bytes, len(self.files)
+            n_captures = sum(1 for name in self.files if name.endswith(CAPTURE_EXTENSION))
+        return {
+            "data_dir": self.data_dir,
+            "indexed": self.indexed.is_set(),
+            "used_bytes": used,
+            "files": n_files,
+            "captures": n_captures,
+            "free_bytes": disk.free,
+            "total_bytes": disk.total,
+            "min_free_bytes": self.min_free_bytes,
+            "retention": self.retention,
+        }
+
+    def check_space(self, required_bytes, path=None, prune=True):
+        """Make sure `required_bytes` fit above the watermark, pruning if retention allows.
+
+        Raises InsufficientSpace otherwise. With `prune` False nothing is
+        deleted, e.g. when the new files are made from existing captures.
+        """
+        available = self.disk_usage(path).free - self.min_free_bytes
+        if available >= required_bytes:
+            return
+        if self.retention and prune:
+            self.prune(required_bytes - available)
+            available = self.disk_usage(path).free - self.min_free_bytes
+            if available >= required_bytes:
+                return
+        raise InsufficientSpace(required_bytes, available)
+
+    # Retention -------------------------------------------------------------
+    def captures(self):
+        """Saved captures, oldest first, as (mtime, size, [paths])."""
+        with self.lock:
+            files = dict(self.files)
+        groups = {}
+        for name, (size, mtime) in files.items():
+            groups.setdefault(os.path.splitext(name)[0], []).append((name, size, mtime))
+        captures = []
+        for stem, members in groups.items():
+            if not any(name == stem + CAPTURE_EXTENSION for name, _, _ in members):
+                continue
+            mtime = min(m for _, _, m in members)
+            captures.append((mtime, sum(s for _, s, _ in members), [name for name, _, _ in members]))
+        captures.sort()
+        return captures
+
+    def prune(self, bytes_needed):
+        """Delete the oldest captures until `bytes_needed` have been freed.
+
+        The most recent capture is never deleted.
+        """
+        self.indexed.wait()
+        with self.prune_lock:
+            return self._prune(bytes_needed)
+
+    def _prune(self, bytes_needed):
+        removed, freed = [], 0
+        for _, size, paths in self.captures()[:-1]:
+            if freed >= bytes_needed:
+                break
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    continue
+                self.forget(path)
+            freed += size
+            removed.append(os.path.relpath(os.path.splitext(paths[0])[0] + CAPTURE_EXTENSION, self.data_dir))
+            try:
+                os.rmdir(os.path.dirname(paths[0]))  # drop the day folder once it is empty
+            except OSError:
+                pass
+        return {"removed": removed, "freed_bytes": freed}
+
+    def enforce_watermark(self):
+        free = self.disk_usage().free
+        if free >= self.min_free_bytes:
+            return {"removed": [], "freed_bytes": 0}
+        return self.prune(self.min_free_bytes - free)
@@ -0,0 +1,186 @@
+"""
+Camera telemetry history.
+
+A sampler thread records the sensor temperature and capture line rate of
+every camera on a fixed cadence, whether or not it is capturing. Samples go
+into fixed-size rings at three resolutions:
+
+    1 s    for the last hour
+    1 min  for the last day
+    1 h    for the last 90 days
+
+Each coarser tier is fed by the buckets the finer one completes, and stores
+the mean, minimum and maximum of each field over its bucket. Memory use is
+fixed no matter how long the controller runs, and a query for any span can
+be answered from the tier that gives a plottable number of points.
+"""
+import math
+import threading
+import time
+
+import numpy as np
+
+FIELDS = ("temperature", "line_rate")
+# (name, bucket length in seconds, number of buckets kept)
+TIERS = (
+    ("1s", 1, 3600),
+    ("1m", 60, 24 * 60),
+    ("1h", 3600, 90 * 24),
+)
+# Queries pick the finest tier that covers the span in at most this many points.
+MAX_POINTS = 2000
+
+
+class Tier:
+    """Ring of per-bucket statistics at one resolution, with the bucket being filled."""
+
+    def __init__(self, name, resolution_s, capacity, n_fields):
+        self.name = name
+        self.resolution_s = resolution_s
+        self.capacity = capacity
+        self.t = np.zeros(capacity)
+        # Per bucket and field: sum, count, min, max.
+        self.stats = np.zeros((capacity, n_fields, 4))
+        self.pos = 0
+        self.count = 0
+        self.bucket = None
+        self.open = self._empty(n_fields)
+
+    @staticmethod
+    def _empty(n_fields):
+        stats = np.zeros((n_fields, 4))
+        stats[:, 2] = np.inf
+        stats[:, 3] = -np.inf
+        return stats
+
+    def add(self, t, stats):
+        """Merge (sum, count, min, max) per field at time `t`; returns the bucket closed, if any."""
+        bucket = math.floor(t / self.resolution_s) * self.resolution_s
+        closed = None
+        if self.bucket is not None and bucket != self.bucket:
+            closed = self.flush()
+        self.bucket = bucket
+        self.open[:, :2] += stats[:, :2]
+        np.minimum(self.open[:, 2], stats[:, 2], out=self.open[:, 2])
+        np.maximum(self.open[:, 3], stats[:, 3], out=self.open[:, 3])
+        return closed
+
+    def flush(self):
+        closed = (self.bucket, self.open)
+        self.t[self.pos] = self.bucket
+        self.stats[self.pos] = self.open
+        self.pos = (self.pos + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        self.bucket = None
+        self.open = self._empty(len(self.open))
+        return closed
+
+    @property
+    def oldest(self):
+        if self.count:
+            return self.t[(self.pos - self.count) % self.capacity]
+        return self.bucket
+
+    def between(self, t0, t1):
+        """Bucket times and statistics in [t0, t1], oldest first, including the open bucket."""
+        idx = (self.pos - self.count + np.arange(self.count)) % self.capacity
+        t, stats = self.t[idx], self.stats[idx]
+        if self.bucket is not None:
+            t = np.append(t, self.bucket)
+            stats = np.concatenate([stats, self.open[None]])
+        lo, hi = np.searchsorted(t, t0, side="left"), np.searchsorted(t, t1, side="right")
+        return t[lo:hi], stats[lo:hi]
+
+
+class TelemetryHistory:
+    """Multi-resolution history of the telemetry FIELDS of one camera."""
+
+    def __init__(self, fields=FIELDS, tiers=TIERS):
+        self.fields = fields
+        self.tiers = [Tier(name, res, cap, len(fields)) for name, res, cap in tiers]
+        self.lock = threading.Lock()
+        self.latest = None
+
+    def add(self, t, sample):
+        """Record a sample ({field: value or None}) taken at epoch time `t`."""
+        values = np.array([np.nan if sample.get(f) is None else float(sample[f]) for f in self.fields])
+        valid = ~np.isnan(values)
+        stats = np.zeros((len(self.fields), 4))
+        stats[:, 0] = np.where(valid, values, 0)
+        stats[:, 1] = valid
+        stats[:, 2] = np.where(valid, values, np.inf)
+        stats[:, 3] = np.where(valid, values, -np.inf)
+        with self.lock:
+            self.latest = dict(sample, time=t)
+            closed = (t, stats)
+            for tier in self.tiers:
+                closed = tier.add(*closed)
+                if closed is None:
+                    break
+
+    def pick_tier(self, t0, t1):
+        """The finest tier that holds the span [t0, t1] in MAX_POINTS or fewer.
+
+        A tier whose ring has not wrapped yet holds everything since startup,
+        so it covers any span as well as the coarser ones do.
+        """
+        for tier in self.tiers:
+            oldest = tier.oldest
+            if oldest is None:
+                continue
+            covers = oldest <= t0 or tier.count < tier.capacity
+            if covers and (t1 - max(t0, oldest)) / tier.resolution_s <= MAX_POINTS:
+                return tier
+        return self.tiers[-1]
+
+    def query(self, t0, t1, tier_name=None):
+        """Series between epoch times t0 and t1 from the named tier, or the best one for the span."""
+        with self.lock:
+            if tier_name is None:
+                tier = self.pick_tier(t0, t1)
+            else:
+                tier = next((tier for tier in self.tiers if tier.name == tier_name), None)
+                if tier is None:
+                    raise ValueError(f"Unknown tier '{tier_name}'. Choose from {', '.join(t.name for t in self.tiers)}")
+            t, stats = tier.between(t0, t1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = stats[..., 0] / stats[..., 1]
+        empty = stats[..., 1] == 0
+        series = {"tier": tier.name, "resolution_s": tier.resolution_s, "t": t.tolist()}
+        for i, field in enumerate(self.fields):
+            for key, column in (("", mean[:, i]), ("_min", stats[:, i, 2]), ("_max", stats[:, i, 3])):
+                values = np.where(empty[:, i], np.nan, column)
+                series[field + key] = [None if np.isnan(v) else round(float(v), 4) for v in values]
+        return series
+
+
+class TelemetrySampler:
+    """Thread calling `sample()` for each (history, sample) source every `interval_s` seconds."""
+
+    def __init__(self, sources, interval_s=1.0):
+        self.sources = sources
+        self.interval_s = interval_s
+        self.stop = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="openhsi-telemetry", daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        next_t = time.monotonic()
+        while not self.stop.is_set():
+            t = time.time()
+            for history, sample in self.sources:
+                try:
+                    history.add(t, sample())
+                except Exception:
+                    history.add(t, {})
+            # Fixed cadence: schedule from the previous tick, not from when sampling finished.
+            next_t += self.interval_s
+            delay = next_t - time.monotonic()
+            if delay < 0:
+                next_t = time.monotonic()
+                delay = 0
+            self.stop.wait(delay)
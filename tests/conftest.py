@@ -0,0 +1,36 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# server.py reads its configuration at import time.
+os.environ["OPENHSI_CAMERA_BACKEND"] = "simulated"
+os.environ["OPENHSI_DATA_DIR"] = tempfile.mkdtemp(prefix="openhsi-tests-")
+os.environ.pop("OPENHSI_ACQUISITION_ADDRESS", None)
+os.environ.pop("OPENHSI_CAMERAS_CONFIG", None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def asgi_app():
+    """The ASGI app; importing it opens the simulated camera (server.start())."""
+    import asgi
+
+    return asgi.app
+
+
+@pytest.fixture(scope="session")
+def client(asgi_app):
+    """Client of the ASGI app; its lifespan (and camera executor) lasts the session."""
+    from starlette.testclient import TestClient
+
+    with TestClient(asgi_app) as client:
+        yield client
+
+
+@pytest.fixture(scope="session")
+def server(asgi_app):
+    import server
+
+    return server
@@ -0,0 +1,26 @@
+def test_logs_are_compressed_and_tagged(client, server):
+    for i in range(40):
+        server.add_log_message(f"Test message {i}: " + "x" * 40, "info")
+    response = client.get("/api/logs", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert int(response.headers["Content-Length"]) < len(response.content)  # content is decoded
+    assert response.json()["logs"][-1]["message"].startswith("Test message 39")
+
+    etag = response.headers["ETag"]
+    unchanged = client.get("/api/logs", headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert unchanged.status_code == 304
+    assert unchanged.content == b""
+
+
+def test_status_gets_an_etag(client):
+    response = client.get("/api/status")
+    assert response.status_code == 200
+    assert response.headers["ETag"].startswith('W/"')
+    assert client.get("/api/status", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+
+
+def test_binary_routes_are_not_compressed(client):
+    response = client.get("/api/show", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
@@ -0,0 +1,40 @@
+import time
+
+
+def wait_for_phase(entry, phase, timeout=30):
+    deadline = time.monotonic() + timeout
+    while entry.status()["phase"] != phase:
+        assert time.monotonic() < deadline, f"camera never reached phase {phase}"
+        time.sleep(0.02)
+
+
+def test_line_rate_has_no_spike_after_resume(client, server):
+    entry = server.registry.default
+    cam = entry.cam
+    nominal = min(1_000 / (cam.settings["exposure_ms"] + 1), 120)  # SyntheticCamera pacing
+    sample = server.telemetry_sample(entry)
+    rates = []
+
+    def sample_for(seconds):
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            time.sleep(0.25)
+            rates.append(sample()["line_rate"])
+
+    assert client.post("/api/capture").status_code == 200
+    wait_for_phase(entry, "capturing")
+    sample_for(1.5)
+    assert client.post("/api/capture/pause").status_code == 200
+    wait_for_phase(entry, "paused")
+    sample_for(0.75)
+    paused = rates[-2:]
+    assert client.post("/api/capture/resume").status_code == 200
+    sample_for(1.5)
+    assert client.post("/api/capture/cancel").status_code == 200
+    while entry.status()["capturing"]:
+        time.sleep(0.05)
+
+    assert entry.status()["progress"]["current"] > nominal  # lines were captured before the pause
+    assert paused == [0.0, 0.0]
+    assert max(rates) < 2 * nominal, rates
+    assert any(rate > nominal / 2 for rate in rates[-4:]), rates  # counting resumed